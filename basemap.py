@@ -0,0 +1,90 @@
+"""
+Cached rendering of the parts of the page that only depend on static assets.
+
+The Folium base map and the location marker list are identical for every
+request, so they are rendered once and reused. The cache is rebuilt when the
+static/entry_images folder changes (a marker image added, removed or
+renamed), checked at most every check_interval seconds.
+"""
+import json
+import os
+import threading
+import time
+
+import folium
+from folium.plugins import Fullscreen
+
+from routes import MARKER_COORDS
+
+MANHATTAN_COORDS = [40.7381, -73.9712]
+ENTRY_IMAGES = "entry_images"
+
+
+def render_base_map():
+    """Return (map_name, map_html) for the main Manhattan map."""
+    m = folium.Map(location=MANHATTAN_COORDS, zoom_start=13, tiles='CartoDB positron')
+    Fullscreen(position='topright').add_to(m)
+    folium.LayerControl().add_to(m)
+    return m.get_name(), m.get_root().render()
+
+
+def build_marker_data(static_folder, static_url):
+    """Static location markers with their image URL (or the fallback icon)."""
+    folder = os.path.join(static_folder, ENTRY_IMAGES)
+    available = set(os.listdir(folder)) if os.path.isdir(folder) else set()
+
+    marker_data = []
+    for name, coords in MARKER_COORDS.items():
+        if f"{name}.jpg" in available:
+            img_url = static_url(f"{ENTRY_IMAGES}/{name}.jpg")
+        else:
+            img_url = static_url("images/location.png")
+        marker_data.append({
+            "name": name,
+            "lat": coords[0],
+            "lon": coords[1],
+            "img_url": img_url
+        })
+    return marker_data
+
+
+class BaseMapCache:
+    def __init__(self, static_folder, check_interval=2.0):
+        self.static_folder = static_folder
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._value = None
+
+    def _assets_signature(self):
+        try:
+            return os.stat(os.path.join(self.static_folder, ENTRY_IMAGES)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def get(self, static_url):
+        """
+        Return {"map_name", "map_html", "marker_data_json"}, rendering them
+        only on first use or after the marker images changed.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self._value is not None and now - self._checked_at < self.check_interval:
+                return self._value
+            self._checked_at = now
+
+            signature = self._assets_signature()
+            if self._value is None or signature != self._signature:
+                map_name, map_html = render_base_map()
+                self._value = {
+                    "map_name": map_name,
+                    "map_html": map_html,
+                    "marker_data_json": json.dumps(build_marker_data(self.static_folder, static_url)),
+                }
+                self._signature = signature
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
@@ -0,0 +1,223 @@
+"""
+Benchmarks for ingest, the query routes and page rendering on a synthetic
+congestion dataset.
+
+generate_congestion_csv() writes a seeded, realistic-looking CSV in the same
+layout as cleaned_data.csv: every 10-minute block x 12 detection groups x 6
+vehicle classes, with daily/weekly traffic curves and MTA peak flags. The
+benchmark loads it into a throwaway database (TRAFFIC_DB), times each step
+and writes the results as JSON, so two commits can be compared:
+
+    python bench.py --days 100 --output before.json
+    python bench.py --days 100 --output after.json --compare before.json
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from dimensions import VEHICLE_CLASSES, DETECTION_GROUPS
+from models import DATETIME_FORMAT
+
+DEFAULT_START = "2025-01-05 00:00:00"
+
+# Rough share of entries per class and relative volume per entry point
+CLASS_SHARE = {
+    'Car': 0.76,
+    'Taxi': 0.13,
+    'Buses': 0.015,
+    'Motorcycles': 0.01,
+    'Single Unit Trucks': 0.065,
+    'Multi Unit Trucks': 0.02,
+}
+BASE_ENTRIES_PER_BLOCK = 250
+
+
+def is_peak(moment):
+    """MTA peak hours: 5am-9pm on weekdays, 9am-9pm on weekends."""
+    first_hour = 5 if moment.weekday() < 5 else 9
+    return first_hour <= moment.hour < 21
+
+
+def traffic_profile(moment):
+    """Relative volume for a 10-minute block: morning and evening rush, quieter weekends."""
+    hour = moment.hour + moment.minute / 60
+    level = 0.12 + 0.9 * np.exp(-((hour - 8.5) / 2.0) ** 2) + 0.8 * np.exp(-((hour - 17.5) / 2.5) ** 2)
+    if moment.weekday() >= 5:
+        level *= 0.75
+    return level
+
+
+def generate_congestion_csv(path, days=100, start=DEFAULT_START, seed=0):
+    """
+    Write days of synthetic 10-minute rows to path and return the row count.
+    The same seed always produces the same file.
+    """
+    rng = np.random.default_rng(seed)
+    group_weight = rng.uniform(0.3, 1.6, size=len(DETECTION_GROUPS))
+    class_share = np.array([CLASS_SHARE[vclass] for vclass in VEHICLE_CLASSES])
+    base = BASE_ENTRIES_PER_BLOCK * np.outer(group_weight, class_share)
+
+    start_time = datetime.strptime(start, DATETIME_FORMAT)
+    index = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Index", "Datetime", "Is Peak", "Vehicle Class", "Detection Group",
+                         "CRZ Entries", "Excluded Roadway Entries"])
+        for block in range(days * 144):
+            moment = start_time + timedelta(minutes=10 * block)
+            stamp = moment.strftime(DATETIME_FORMAT)
+            peak = "true" if is_peak(moment) else "false"
+            entries = rng.poisson(base * traffic_profile(moment))
+            excluded = rng.poisson(entries * 0.03)
+            rows = []
+            for g, group in enumerate(DETECTION_GROUPS):
+                for c, vclass in enumerate(VEHICLE_CLASSES):
+                    rows.append((index, stamp, peak, vclass, group, int(entries[g, c]), int(excluded[g, c])))
+                    index += 1
+            writer.writerows(rows)
+    return index
+
+
+def time_call(fn, repeat=5, setup=None):
+    """Run fn repeat times (calling setup before each run) and return timing stats in ms."""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - started) * 1000)
+    return {
+        "runs": repeat,
+        "min_ms": round(min(times), 3),
+        "median_ms": round(statistics.median(times), 3),
+        "mean_ms": round(statistics.fmean(times), 3),
+        "max_ms": round(max(times), 3),
+    }
+
+
+def _get(client, url):
+    response = client.get(url)
+    assert response.status_code == 200, (url, response.status_code)
+    return response
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmarks(workdir, days=100, seed=0, repeat=5):
+    results = {}
+    csv_path = os.path.join(workdir, "synthetic.csv")
+
+    started = time.perf_counter()
+    rows = generate_congestion_csv(csv_path, days=days, seed=seed)
+    results["generate_csv"] = {"rows": rows, "seconds": round(time.perf_counter() - started, 3)}
+
+    # main reads TRAFFIC_DB at import time
+    os.environ["TRAFFIC_DB"] = os.path.join(workdir, "traffic.db")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    import main
+    from ingest import bulk_load_csv
+
+    app = main.app
+    with app.app_context():
+        main.db.create_all()
+        stats = bulk_load_csv(csv_path, main.db.engine)
+        results["ingest"] = {
+            "rows": stats["rows"],
+            "seconds": round(stats["seconds"], 3),
+            "rows_per_sec": round(stats["rows_per_sec"], 1),
+        }
+        results["cube_build"] = time_call(main.aggregate_cube.get, repeat=1, setup=main.aggregate_cube.clear)
+
+    client = app.test_client()
+    first_day = datetime.strptime(DEFAULT_START, DATETIME_FORMAT) + timedelta(days=3, hours=8)
+    window_start = first_day.strftime(DATETIME_FORMAT)
+    window_end = (first_day + timedelta(days=30)).strftime(DATETIME_FORMAT)
+
+    filter_url = f"/filter?datetime_start={window_start}&datetime_end={window_end}"
+    results["filter_cold"] = time_call(lambda: _get(client, filter_url), repeat,
+                                       setup=main.filter_cache.clear)
+    results["filter_warm"] = time_call(lambda: _get(client, filter_url), repeat)
+
+    for interval_key in main.INTERVAL_CONFIG:
+        url = f"/realtime_series?interval={interval_key}&datetime_start={window_start}"
+        results[f"realtime_series_{interval_key}_cold"] = time_call(
+            lambda: _get(client, url), repeat, setup=main.frame_store.clear)
+        results[f"realtime_series_{interval_key}_warm"] = time_call(lambda: _get(client, url), repeat)
+
+    # The spawn pipeline and the page, on one day of frames
+    response = _get(client, f"/realtime_series?interval=1day&datetime_start={window_start}")
+    frame_id = response.headers["X-Frame-Id"]
+    frames_path = os.path.join(workdir, "frames.json")
+    with open(frames_path, "w") as f:
+        f.write(response.get_data(as_text=True))
+
+    results["parse_info_json"] = time_call(lambda: main.parse_info_json(frames_path), repeat)
+    timestep_data = main.parse_info_json(frames_path)
+    results["build_spawn_js_from_timestepdata"] = time_call(
+        lambda: main.build_spawn_js_from_timestepdata(timestep_data, speed=4000), repeat)
+    results["index"] = time_call(lambda: _get(client, f"/?frame_id={frame_id}"), repeat)
+
+    return results
+
+
+def compare(results, baseline, threshold=1.1):
+    """Print the median change per benchmark against a previous run's results."""
+    print(f"{'benchmark':45} {'before':>10} {'after':>10} {'ratio':>7}")
+    for name, stats in results.items():
+        before = baseline.get(name, {}).get("median_ms")
+        after = stats.get("median_ms")
+        if before is None or after is None:
+            continue
+        ratio = after / before if before else float("inf")
+        flag = "  <-- slower" if ratio > threshold else ""
+        print(f"{name:45} {before:10.2f} {after:10.2f} {ratio:7.2f}{flag}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark ingest and the query routes on synthetic data")
+    parser.add_argument("--days", type=int, default=100, help="days of 10-minute blocks to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per benchmark")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare against")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run_benchmarks(workdir, days=args.days, seed=args.seed, repeat=args.repeat)
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "days": args.days,
+            "seed": args.seed,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f)["results"])
@@ -0,0 +1,184 @@
+"""
+Bounded in-process caches for query results.
+
+ResultCache is an LRU with an optional per-entry TTL and byte cap that keeps
+hit/miss counters. The congestion data only changes when an ingest runs:
+DataVersionWatcher polls the data version the ingest bumps and clears every
+registered cache when it moves. Caches registered with a key_range function
+only lose the entries that overlap the block ranges the ingest changed.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+def normalize_params(*parts, **params):
+    """
+    Cache key from a route name (or other fixed parts) plus query parameters.
+    Empty parameters are dropped and the rest sorted, so parameter order and
+    blank filters don't produce different keys.
+    """
+    cleaned = tuple(sorted(
+        (name, value.strip() if isinstance(value, str) else value)
+        for name, value in params.items()
+        if value is not None and value != ""
+    ))
+    return parts + cleaned
+
+
+class ResultCache:
+    def __init__(self, max_entries=256, ttl=None, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or (lambda value: 0)
+        self._entries = OrderedDict()  # key -> (value, stored_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING, count=False) is not _MISSING
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def total_bytes(self):
+        return self._bytes
+
+    def get(self, key, default=None, count=True):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and self.ttl is not None and time.monotonic() - item[1] > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                item = None
+
+            if item is None:
+                if count:
+                    self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return item[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic(), size)
+            self._bytes += size
+            self._evict()
+        return value
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = self.put(key, compute())
+        return value
+
+    def clear(self):
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._bytes = 0
+
+    def invalidate(self, predicate):
+        """Drop the entries whose key predicate(key) is true."""
+        with self._lock:
+            stale = [key for key in self._entries if predicate(key)]
+            for key in stale:
+                self._remove(key)
+            if stale:
+                self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _evict(self):
+        # Always keep the newest entry, even if it alone is over the byte cap.
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries
+            or (self.max_bytes is not None and self._bytes > self.max_bytes)
+        ):
+            key = next(iter(self._entries))
+            self._remove(key)
+            self.evictions += 1
+
+
+def _overlaps(key_range, ranges):
+    if key_range is None:
+        return True
+    start, end = key_range
+    return any(start < change_end and change_start < end for change_start, change_end in ranges)
+
+
+class DataVersionWatcher:
+    """
+    Clears the registered caches whenever version_source() returns a new
+    value. The source is polled at most every check_interval seconds.
+
+    changes_source(old, new), if given, returns the block ranges changed
+    between two versions (None if unknown). Caches registered with key_range
+    then only invalidate() the keys whose range overlaps them; key_range(key)
+    returns the [start_block, end_block) an entry was computed from, or None
+    if it can't tell.
+    """
+
+    def __init__(self, version_source, check_interval=1.0, changes_source=None):
+        self.version_source = version_source
+        self.changes_source = changes_source
+        self.check_interval = check_interval
+        self.version = None
+        self._caches = []
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def register(self, cache, key_range=None):
+        self._caches.append((cache, key_range))
+        return cache
+
+    def check(self):
+        now = time.monotonic()
+        with self._lock:
+            if self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return self.version
+            self._checked_at = now
+            version = self.version_source()
+            if version != self.version:
+                if self.version is not None:
+                    ranges = None
+                    if self.changes_source is not None:
+                        ranges = self.changes_source(self.version, version)
+                    for cache, key_range in self._caches:
+                        if ranges is not None and key_range is not None:
+                            cache.invalidate(lambda key: _overlaps(key_range(key), ranges))
+                        else:
+                            cache.clear()
+                self.version = version
+            return version
@@ -0,0 +1,327 @@
+"""
+Prefix-sum cube of crz_entries for constant-time range totals.
+
+prefix[i, g, c, p] holds the total entries for detection group g, vehicle
+class c and peak flag p over blocks [first_block, first_block + i). Any range
+total is then prefix[end] - prefix[start], two lookups no matter how long
+the window is. The array is saved as .npy next to traffic.db and memory-mapped
+back in, so extra workers share the pages instead of rebuilding it.
+
+    python cube.py            # (re)build instance/aggregate_cube
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from sqlalchemy.exc import OperationalError
+
+from dimensions import VEHICLE_CLASSES, DETECTION_GROUPS
+from frames import price_matrix
+from models import TrafficEntry, Dimensions, get_data_version, changed_ranges, merge_ranges
+
+
+def _axis(known, observed):
+    """Known names first (stable codes), then anything new the data contains."""
+    extra = sorted(set(observed) - set(known))
+    return list(known) + extra
+
+
+def _codes(values, axis):
+    names, inverse = np.unique(np.asarray(values, dtype=str), return_inverse=True)
+    lookup = np.array([axis.index(name) for name in names.tolist()], dtype=np.int64)
+    return lookup[inverse] if len(names) else np.zeros(0, dtype=np.int64)
+
+
+def _decode_axis(codes, names, known):
+    """Axis for an array of dimension codes, and the codes mapped onto it."""
+    present = np.unique(codes).tolist()
+    axis = _axis(known, [names[code] for code in present])
+    lookup = np.zeros(max(present) + 1, dtype=np.int64)
+    for code in present:
+        lookup[code] = axis.index(names[code])
+    return axis, lookup[codes]
+
+
+class AggregateCube:
+    """
+    prices are the (off-peak, peak) tolls of each class on the class axis,
+    taken from the vehicle_class table when the cube is built and saved with
+    it, like Columns.prices.
+    """
+
+    def __init__(self, first_block, groups, classes, prefix, prices, data_version=0):
+        self.first_block = first_block
+        self.groups = groups
+        self.classes = classes
+        self.prefix = prefix
+        self.prices = prices
+        self.data_version = data_version
+        self._group_index = {name: i for i, name in enumerate(groups)}
+        self._class_index = {name: i for i, name in enumerate(classes)}
+        self._prices = np.asarray(prices, dtype=np.float64).reshape(len(classes), 2)
+
+    @property
+    def num_blocks(self):
+        return self.prefix.shape[0] - 1
+
+    @property
+    def end_block(self):
+        return self.first_block + self.num_blocks
+
+    @classmethod
+    def from_rows(cls, rows, class_prices, data_version=0):
+        """
+        rows are (block, detection_group, vehicle_class, is_peak, count)
+        tuples, class_prices the tolls by class name (Dimensions.class_prices).
+        """
+        if not rows:
+            return None
+        blocks, groups, classes, peaks, counts = zip(*rows)
+        group_axis = _axis(DETECTION_GROUPS, groups)
+        class_axis = _axis(VEHICLE_CLASSES, classes)
+        return cls._from_arrays(blocks, _codes(groups, group_axis), _codes(classes, class_axis), peaks, counts,
+                                group_axis, class_axis, class_prices, data_version)
+
+    @classmethod
+    def from_coded_rows(cls, rows, dimensions, data_version=0):
+        """from_rows for (block, group_code, class_code, is_peak, count) rows."""
+        if not rows:
+            return None
+        blocks, group_codes, class_codes, peaks, counts = zip(*rows)
+        group_axis, group_index = _decode_axis(np.asarray(group_codes, dtype=np.int64), dimensions.groups,
+                                               DETECTION_GROUPS)
+        class_axis, class_index = _decode_axis(np.asarray(class_codes, dtype=np.int64), dimensions.classes,
+                                               VEHICLE_CLASSES)
+        return cls._from_arrays(blocks, group_index, class_index, peaks, counts, group_axis, class_axis,
+                                dimensions.class_prices, data_version)
+
+    @classmethod
+    def _from_arrays(cls, blocks, group_index, class_index, peaks, counts, group_axis, class_axis, class_prices,
+                     data_version):
+        blocks = np.asarray(blocks, dtype=np.int64)
+        first_block = int(blocks.min())
+        num_blocks = int(blocks.max()) - first_block + 1
+
+        prefix = np.zeros((num_blocks + 1, len(group_axis), len(class_axis), 2), dtype=np.int64)
+        np.add.at(
+            prefix,
+            (
+                blocks - first_block + 1,
+                group_index,
+                class_index,
+                (np.asarray(peaks, dtype=np.int64) == 1).astype(np.int64),
+            ),
+            np.asarray(counts, dtype=np.int64)
+        )
+        np.cumsum(prefix, axis=0, out=prefix)
+        return cls(first_block, group_axis, class_axis, prefix, price_matrix(class_axis, class_prices).tolist(),
+                   data_version)
+
+    def updated(self, rows, ranges, dimensions, data_version):
+        """
+        The cube with the blocks of ranges (merged [start, end) ranges) recounted
+        from rows, their block_rows, so an append doesn't rebuild the whole
+        cube. None if the rows name a group or class the cube has no axis for.
+        """
+        blocks, group_codes, class_codes, peaks, counts = zip(*rows) if rows else ((),) * 5
+        try:
+            group_index = [self._group_index[dimensions.groups[code]] for code in group_codes]
+            class_index = [self._class_index[dimensions.classes[code]] for code in class_codes]
+        except KeyError:
+            return None
+
+        first_block = min([self.first_block] + [start for start, _ in ranges])
+        end_block = max([self.end_block] + [end for _, end in ranges])
+        block_counts = np.zeros((end_block - first_block,) + self.prefix.shape[1:], dtype=np.int64)
+        offset = self.first_block - first_block
+        block_counts[offset:offset + self.num_blocks] = np.diff(self.prefix, axis=0)
+        for start, end in ranges:
+            block_counts[start - first_block:end - first_block] = 0
+        np.add.at(
+            block_counts,
+            (
+                np.asarray(blocks, dtype=np.int64) - first_block,
+                np.asarray(group_index, dtype=np.int64),
+                np.asarray(class_index, dtype=np.int64),
+                (np.asarray(peaks, dtype=np.int64) == 1).astype(np.int64),
+            ),
+            np.asarray(counts, dtype=np.int64)
+        )
+        prefix = np.zeros((len(block_counts) + 1,) + block_counts.shape[1:], dtype=np.int64)
+        np.cumsum(block_counts, axis=0, out=prefix[1:])
+        return AggregateCube(first_block, self.groups, self.classes, prefix,
+                             price_matrix(self.classes, dimensions.class_prices).tolist(), data_version)
+
+    @staticmethod
+    def block_rows(conn, start_block=None, end_block=None):
+        """The coded rows from_coded_rows takes, for all blocks or for [start_block, end_block)."""
+        where, params = "", ()
+        if start_block is not None:
+            where, params = "WHERE block >= ? AND block < ? ", (start_block, end_block)
+        return conn.exec_driver_sql(
+            f"SELECT block, group_code, class_code, is_peak, SUM(crz_entries) "
+            f"FROM {TrafficEntry.__tablename__} {where}GROUP BY block, group_code, class_code, is_peak",
+            params
+        ).all()
+
+    @classmethod
+    def build(cls, engine):
+        """Aggregate the whole traffic_entry table into a cube (None if it's empty)."""
+        with engine.connect() as conn:
+            data_version = get_data_version(conn)
+            dimensions = Dimensions.load(conn)
+            rows = cls.block_rows(conn)
+        return cls.from_coded_rows(rows, dimensions, data_version)
+
+    def save(self, directory):
+        # Write-then-rename, other processes may have the old file mapped.
+        # Tmp names are per process: workers rebuilding after the same data
+        # version bump each rename their own complete file into place.
+        os.makedirs(directory, exist_ok=True)
+        prefix_path = os.path.join(directory, "prefix.npy")
+        prefix_tmp = f"{prefix_path}.{os.getpid()}.tmp"
+        with open(prefix_tmp, "wb") as f:
+            np.save(f, self.prefix)
+        os.replace(prefix_tmp, prefix_path)
+
+        meta_path = os.path.join(directory, "meta.json")
+        meta_tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(meta_tmp, "w") as f:
+            json.dump({
+                "first_block": self.first_block,
+                "groups": self.groups,
+                "classes": self.classes,
+                "prices": self.prices,
+                "data_version": self.data_version,
+            }, f)
+        os.replace(meta_tmp, meta_path)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """The saved cube, or None if it was saved without its tolls and needs a rebuild."""
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        if "prices" not in meta:
+            return None
+        prefix = np.load(os.path.join(directory, "prefix.npy"), mmap_mode="r" if mmap else None)
+        return cls(meta["first_block"], meta["groups"], meta["classes"], prefix, meta["prices"],
+                   meta["data_version"])
+
+    def _clamp(self, block):
+        return min(max(block - self.first_block, 0), self.num_blocks)
+
+    def totals(self, start_block, end_block):
+        """Entries over [start_block, end_block) as a (groups, classes, is_peak) array."""
+        start = self._clamp(start_block)
+        end = max(self._clamp(end_block), start)
+        return self.prefix[end] - self.prefix[start]
+
+    def class_totals(self, start_block, end_block, detection_group=None, vehicle_class=None):
+        """
+        (vehicles, revenue) per class, each a dict of class -> value, with the
+        same optional group/class filters /filter takes. Classes with no
+        entries in the range are left out.
+        """
+        counts = self.totals(start_block, end_block)
+        if detection_group:
+            if detection_group not in self._group_index:
+                return {}, {}
+            counts = counts[self._group_index[detection_group]][np.newaxis]
+
+        vehicles = counts.sum(axis=(0, 2))
+        revenue = (counts * self._prices).sum(axis=(0, 2))
+
+        vehicle_counts = {}
+        revenue_per_class = {}
+        for c, name in enumerate(self.classes):
+            if vehicle_class and name != vehicle_class:
+                continue
+            if vehicles[c]:
+                vehicle_counts[name] = int(vehicles[c])
+                revenue_per_class[name] = float(revenue[c])
+        return vehicle_counts, revenue_per_class
+
+
+class CubeHolder:
+    """
+    Lazily provides the cube for the current data version: memory-mapped from
+    directory when the saved cube is current, otherwise updated over the
+    block ranges ingested since (or rebuilt from the database when those
+    aren't recorded) and saved for the next process. clear() drops it, so it
+    can be registered with a DataVersionWatcher.
+    """
+
+    def __init__(self, engine_source, directory):
+        self.engine_source = engine_source
+        self.directory = directory
+        self._cube = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._cube = None
+            self._loaded = False
+
+    def get(self):
+        with self._lock:
+            if not self._loaded:
+                self._cube = self._load_or_build()
+                self._loaded = True
+            return self._cube
+
+    def _load_or_build(self):
+        engine = self.engine_source()
+        try:
+            with engine.connect() as conn:
+                data_version = get_data_version(conn)
+        except OperationalError:
+            # No tables yet, nothing to aggregate
+            return None
+
+        cube = None
+        if os.path.exists(os.path.join(self.directory, "meta.json")):
+            cube = AggregateCube.load(self.directory)
+            if cube is not None and cube.data_version != data_version:
+                cube = self._update(engine, cube)
+                if cube is not None:
+                    cube.save(self.directory)
+                    cube = AggregateCube.load(self.directory)
+        if cube is None:
+            cube = AggregateCube.build(engine)
+            if cube is not None:
+                cube.save(self.directory)
+                cube = AggregateCube.load(self.directory)
+        return cube
+
+    @staticmethod
+    def _update(engine, cube):
+        """
+        The saved cube brought up to the current data version by recounting
+        only the block ranges ingested since, or None if they aren't known.
+        """
+        with engine.connect() as conn:
+            data_version = get_data_version(conn)
+            ranges = None
+            if cube.data_version < data_version:
+                ranges = changed_ranges(conn, cube.data_version, data_version)
+            if ranges is None:
+                return None
+            ranges = merge_ranges(ranges)
+            rows = [row for start, end in ranges for row in AggregateCube.block_rows(conn, start, end)]
+            dimensions = Dimensions.load(conn)
+        return cube.updated(rows, ranges, dimensions, data_version)
+
+
+if __name__ == '__main__':
+    from main import app, db, CUBE_DIR
+
+    with app.app_context():
+        cube = AggregateCube.build(db.engine)
+        if cube is None:
+            print("traffic_entry is empty, no cube built.")
+        else:
+            cube.save(CUBE_DIR)
+            print(f"Saved {cube.num_blocks} blocks x {len(cube.groups)} groups x "
+                  f"{len(cube.classes)} classes to {CUBE_DIR}.")
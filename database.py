@@ -0,0 +1,84 @@
+"""
+SQLite settings for serving from several workers/threads at once.
+
+The main engine opens traffic.db in WAL mode, so readers never block on the
+ingest writer (and vice versa), with a busy timeout instead of immediate
+"database is locked" errors. Query routes use a separate read-only bind
+(mode=ro, query_only) through read_session().
+"""
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db
+
+READONLY_BIND = "readonly"
+BUSY_TIMEOUT_MS = 30000
+
+
+def sqlite_config(db_path, pool_size=8, max_overflow=8):
+    """
+    SQLALCHEMY_DATABASE_URI, SQLALCHEMY_ENGINE_OPTIONS and SQLALCHEMY_BINDS
+    for traffic.db at db_path (an absolute path).
+    """
+    engine_options = {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_pre_ping": True,
+        "connect_args": {"timeout": BUSY_TIMEOUT_MS / 1000, "check_same_thread": False},
+    }
+    return {
+        "SQLALCHEMY_DATABASE_URI": f"sqlite:///{db_path}",
+        "SQLALCHEMY_ENGINE_OPTIONS": engine_options,
+        "SQLALCHEMY_BINDS": {
+            READONLY_BIND: {
+                "url": f"sqlite:///file:{db_path}?mode=ro&uri=true",
+                **engine_options,
+            }
+        },
+    }
+
+
+def _set_write_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _set_readonly_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA query_only=1")
+    cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+def init_sqlite(app):
+    """Install the connection pragmas. Call after db.init_app(app)."""
+    with app.app_context():
+        event.listen(db.engine, "connect", _set_write_pragmas)
+        event.listen(db.engines[READONLY_BIND], "connect", _set_readonly_pragmas)
+
+
+def readonly_engine():
+    """
+    The read-only engine, or the main one while traffic.db doesn't exist yet
+    (mode=ro can't create the file).
+    """
+    engine = db.engines[READONLY_BIND]
+    if not os.path.exists(engine.url.database.removeprefix("file:")):
+        return db.engine
+    return engine
+
+
+@contextmanager
+def read_session():
+    """ORM session on the read-only connection pool, for query routes."""
+    session = Session(readonly_engine())
+    try:
+        yield session
+    finally:
+        session.close()
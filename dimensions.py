@@ -0,0 +1,91 @@
+"""
+The fixed dimensions of the congestion dataset: vehicle classes, detection
+groups (entry points) and the toll charged per class and peak period.
+
+traffic_entry stores both dimensions as integer codes into the vehicle_class
+and detection_group tables. seed_dimensions() fills those with the values
+below (codes are the positions in VEHICLE_CLASSES / DETECTION_GROUPS), and
+DimensionEncoder turns names into codes while loading, adding any class or
+group the tables don't know yet.
+"""
+from models import VehicleClass, DetectionGroup, Dimensions
+
+VEHICLE_CLASSES = (
+    'Car',
+    'Taxi',
+    'Buses',
+    'Motorcycles',
+    'Single Unit Trucks',
+    'Multi Unit Trucks',
+)
+
+DETECTION_GROUPS = (
+    'Brooklyn Bridge',
+    'West Side Highway at 60th St',
+    'West 60th St',
+    'Queensboro Bridge',
+    'Queens Midtown Tunnel',
+    'Lincoln Tunnel',
+    'Holland Tunnel',
+    'FDR Drive at 60th St',
+    'East 60th St',
+    'Williamsburg Bridge',
+    'Manhattan Bridge',
+    'Hugh L. Carey Tunnel',
+)
+
+PRICING = {
+    ('Car', 0): 2.25,
+    ('Car', 1): 9,
+    ('Buses', 0): 3.6,
+    ('Buses', 1): 14.4,
+    ('Motorcycles', 0): 1.05,
+    ('Motorcycles', 1): 4.5,
+    ('Taxi', 0): 0.75,
+    ('Taxi', 1): 0.75,
+    ('Single Unit Trucks', 0): 3.6,
+    ('Single Unit Trucks', 1): 14.4,
+    ('Multi Unit Trucks', 0): 5.40,
+    ('Multi Unit Trucks', 1): 21.60
+}
+
+
+def seed_dimensions(conn):
+    """Insert the known classes and detection groups; rows already there are kept."""
+    from routes import MARKER_COORDS, ROUTE_GEOMETRY
+
+    conn.exec_driver_sql(
+        f"INSERT OR IGNORE INTO {VehicleClass.__tablename__} (code, name, off_peak_price, peak_price) "
+        "VALUES (?, ?, ?, ?)",
+        [(code, name, PRICING.get((name, 0), 0), PRICING.get((name, 1), 0))
+         for code, name in enumerate(VEHICLE_CLASSES)]
+    )
+    conn.exec_driver_sql(
+        f"INSERT OR IGNORE INTO {DetectionGroup.__tablename__} (code, name, latitude, longitude, heading) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(code, name, *MARKER_COORDS.get(name, (None, None)), ROUTE_GEOMETRY.get(name, {}).get("heading"))
+         for code, name in enumerate(DETECTION_GROUPS)]
+    )
+
+
+class DimensionEncoder:
+    """Name -> code for loading rows, registering names seen for the first time."""
+
+    def __init__(self, conn):
+        dimensions = Dimensions.load(conn)
+        self.class_codes = dimensions.class_codes
+        self.group_codes = dimensions.group_codes
+
+    def _code(self, conn, codes, table, name):
+        code = codes.get(name)
+        if code is None:
+            code = max(codes.values(), default=-1) + 1
+            conn.exec_driver_sql(f"INSERT INTO {table} (code, name) VALUES (?, ?)", (code, name))
+            codes[name] = code
+        return code
+
+    def class_code(self, conn, name):
+        return self._code(conn, self.class_codes, VehicleClass.__tablename__, name)
+
+    def group_code(self, conn, name):
+        return self._code(conn, self.group_codes, DetectionGroup.__tablename__, name)
@@ -0,0 +1,174 @@
+"""
+Streaming bulk export of traffic_entry for /export.
+
+Rows are read with plain DB-API cursors in batches of BATCH_SIZE tuples,
+decoded (class and group codes to names) and encoded batch by batch, so an
+export of any size runs in constant memory and the first bytes go out as
+soon as the first batch is read. Formats are CSV, NDJSON and, if pyarrow is
+installed, Arrow IPC stream.
+
+Pages are keyset-paginated on (block, id): the order traffic_entry's
+datetimes sort in, which ix_traffic_block (entries sorted by block, then
+rowid) serves without a sort. The planner picks that index by itself, and
+falls back to a sort while it doesn't exist (a bulk load drops it). A
+cursor is "<block>:<id>" of the last row of the previous page; the row
+after it starts the next page.
+"""
+import csv
+import io
+import json
+
+from models import TrafficEntry, Dimensions
+
+try:
+    import pyarrow
+except ImportError:  # optional, no Arrow export without it
+    pyarrow = None
+
+BATCH_SIZE = 5000
+EXPORT_COLUMNS = ("id", "datetime", "is_peak", "vehicle_class", "detection_group", "crz_entries",
+                  "excluded_roadway_entries")
+
+
+def parse_cursor(value):
+    """(block, id) from a "<block>:<id>" cursor, None if there's none, ValueError if malformed."""
+    if not value:
+        return None
+    block, _, row_id = value.partition(":")
+    return int(block), int(row_id)
+
+
+def format_cursor(block, row_id):
+    return f"{block}:{row_id}"
+
+
+def _where(dimensions, start_block, end_block, detection_group, vehicle_class, after):
+    """WHERE clause and parameters, or None if a filter names an unknown group/class."""
+    clauses, params = [], []
+    if start_block is not None:
+        clauses.append("block >= ?")
+        params.append(start_block)
+    if end_block is not None:
+        clauses.append("block < ?")
+        params.append(end_block)
+    if detection_group:
+        if detection_group not in dimensions.group_codes:
+            return None
+        clauses.append("group_code = ?")
+        params.append(dimensions.group_codes[detection_group])
+    if vehicle_class:
+        if vehicle_class not in dimensions.class_codes:
+            return None
+        clauses.append("class_code = ?")
+        params.append(dimensions.class_codes[vehicle_class])
+    if after is not None:
+        clauses.append("(block, id) > (?, ?)")
+        params.extend(after)
+    return ("WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def next_cursor(conn, limit, start_block=None, end_block=None, detection_group=None, vehicle_class=None,
+                after=None):
+    """Cursor of the last row of the page of limit rows after `after`, None if no rows come after that page."""
+    dimensions = Dimensions.load(conn)
+    where = _where(dimensions, start_block, end_block, detection_group, vehicle_class, after)
+    if where is None:
+        return None
+    clause, params = where
+    rows = conn.exec_driver_sql(
+        f"SELECT block, id FROM {TrafficEntry.__tablename__} {clause} "
+        f"ORDER BY block, id LIMIT 2 OFFSET ?",
+        tuple(params) + (limit - 1,)
+    ).all()
+    if len(rows) < 2:
+        return None
+    return format_cursor(*rows[0])
+
+
+def iter_row_batches(conn, start_block=None, end_block=None, detection_group=None, vehicle_class=None,
+                     after=None, limit=None, batch_size=BATCH_SIZE):
+    """Lists of up to batch_size EXPORT_COLUMNS tuples, in (block, id) order."""
+    dimensions = Dimensions.load(conn)
+    where = _where(dimensions, start_block, end_block, detection_group, vehicle_class, after)
+    if where is None:
+        return
+    clause, params = where
+    sql = (
+        f"SELECT id, datetime, is_peak, class_code, group_code, crz_entries, excluded_roadway_entries "
+        f"FROM {TrafficEntry.__tablename__} {clause} ORDER BY block, id"
+    )
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+
+    result = conn.exec_driver_sql(sql, tuple(params))
+    classes, groups = dimensions.classes, dimensions.groups
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not rows:
+            break
+        yield [
+            (row_id, timestamp, is_peak, classes.get(class_code), groups.get(group_code), entries, excluded)
+            for row_id, timestamp, is_peak, class_code, group_code, entries, excluded in rows
+        ]
+
+
+def encode_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def encode_ndjson(batches):
+    for batch in batches:
+        yield "".join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, row)), separators=(",", ":")) + "\n" for row in batch
+        ).encode("utf-8")
+
+
+def _arrow_schema():
+    return pyarrow.schema([
+        ("id", pyarrow.int64()),
+        ("datetime", pyarrow.string()),
+        ("is_peak", pyarrow.int8()),
+        ("vehicle_class", pyarrow.string()),
+        ("detection_group", pyarrow.string()),
+        ("crz_entries", pyarrow.int64()),
+        ("excluded_roadway_entries", pyarrow.int64()),
+    ])
+
+
+def encode_arrow(batches):
+    schema = _arrow_schema()
+    sink = io.BytesIO()
+    with pyarrow.ipc.new_stream(sink, schema) as writer:
+        for batch in batches:
+            columns = list(zip(*batch))
+            writer.write_batch(pyarrow.record_batch(
+                [pyarrow.array(column, type=field.type) for column, field in zip(columns, schema)],
+                schema=schema
+            ))
+            yield sink.getvalue()
+            sink.seek(0)
+            sink.truncate()
+    # End-of-stream marker
+    yield sink.getvalue()
+
+
+# format -> (encoder, mimetype, file extension)
+FORMATS = {
+    "csv": (encode_csv, "text/csv", "csv"),
+    "ndjson": (encode_ndjson, "application/x-ndjson", "ndjson"),
+    "arrow": (encode_arrow, "application/vnd.apache.arrow.stream", "arrows"),
+}
+
+
+def available_formats():
+    return [name for name in FORMATS if name != "arrow" or pyarrow is not None]
@@ -0,0 +1,132 @@
+"""
+Minimum / maximum / percentile and top-k queries over traffic volumes.
+
+frame_extremes() summarizes one computed window (FrameArrays) per location and
+per class in a single vectorized pass over the frame axis. It replaces the
+old find_min_vehicle_timestamp, which rescanned its result list for every
+location of every frame.
+
+extreme_windows() answers dataset-wide questions such as "the quietest hour
+at Lincoln Tunnel in March" from the aggregate cube: every sliding-window sum
+is one subtraction of two prefix sums.
+"""
+import numpy as np
+
+from models import from_block, DATETIME_FORMAT
+
+DEFAULT_PERCENTILES = (50, 90)
+
+
+def _series_extremes(values, mask, timestamps, names, k, percentiles):
+    """
+    values/mask have shape (frames, series). Frames where mask is False
+    (no data for that series) are ignored.
+    """
+    if values.size == 0:
+        return {}
+    low = np.where(mask, values, np.inf)
+    high = np.where(mask, values, -np.inf)
+    counts = mask.sum(axis=0)
+    # Series without any data are left out below; skipping them here spares
+    # nanpercentile its "All-NaN slice" warning
+    pct = np.zeros((len(percentiles), values.shape[1]))
+    if percentiles and counts.any():
+        pct[:, counts > 0] = np.nanpercentile(np.where(mask, values, np.nan)[:, counts > 0], percentiles, axis=0)
+
+    k = min(k, values.shape[0])
+    quiet_order = np.argsort(low, axis=0, kind="stable")[:k]
+    busy_order = np.argsort(-high, axis=0, kind="stable")[:k]
+
+    def point(f, s):
+        return {"timestamp": timestamps[f], "vehicles": round(float(values[f, s]), 2)}
+
+    result = {}
+    for s, name in enumerate(names):
+        if not counts[s]:
+            continue
+        result[name] = {
+            "min": point(int(quiet_order[0, s]), s),
+            "max": point(int(busy_order[0, s]), s),
+            "percentiles": {str(q): round(float(pct[i, s]), 2) for i, q in enumerate(percentiles)},
+            "quietest": [point(int(f), s) for f in quiet_order[:, s] if mask[f, s]],
+            "busiest": [point(int(f), s) for f in busy_order[:, s] if mask[f, s]],
+        }
+    return result
+
+
+def frame_extremes(arrays, k=3, percentiles=DEFAULT_PERCENTILES):
+    """
+    Per-location and per-class min/max/percentiles and the k quietest and
+    busiest frames of a window, from its FrameArrays.
+    """
+    location_totals = arrays.vehicles.sum(axis=2)
+    location_mask = arrays.present.any(axis=2)
+    class_totals = arrays.vehicles.sum(axis=1)
+    class_mask = arrays.present.any(axis=1)
+    return {
+        "locations": _series_extremes(location_totals, location_mask, arrays.timestamps,
+                                      arrays.locations, k, percentiles),
+        "classes": _series_extremes(class_totals, class_mask, arrays.timestamps,
+                                    arrays.classes, k, percentiles),
+    }
+
+
+def window_sums(cube, window_blocks, start_block, end_block, detection_group=None, vehicle_class=None):
+    """
+    Sums over every window of window_blocks consecutive blocks starting in
+    [start_block, end_block - window_blocks]. Returns (first_block, sums).
+    """
+    start = max(start_block, cube.first_block)
+    end = min(end_block, cube.end_block)
+    if end - start < window_blocks:
+        return start, np.zeros(0, dtype=np.int64)
+
+    prefix = cube.prefix[start - cube.first_block:end - cube.first_block + 1]
+    if detection_group:
+        prefix = prefix[:, [cube.groups.index(detection_group)]]
+    if vehicle_class:
+        prefix = prefix[:, :, [cube.classes.index(vehicle_class)]]
+    prefix = prefix.sum(axis=(1, 2, 3))
+    return start, prefix[window_blocks:] - prefix[:-window_blocks]
+
+
+def extreme_windows(cube, window_blocks, start_block, end_block, detection_group=None,
+                    vehicle_class=None, k=5, busiest=False):
+    """
+    The k quietest (or busiest) non-overlapping windows of window_blocks
+    blocks between start_block and end_block, as a list of
+    {"start", "end", "vehicles"} dicts ordered from most to least extreme.
+    """
+    first, sums = window_sums(cube, window_blocks, start_block, end_block,
+                              detection_group, vehicle_class)
+    order = np.argsort(-sums if busiest else sums, kind="stable")
+
+    picked = []
+    for i in order.tolist():
+        if len(picked) == k:
+            break
+        # Neighbouring windows overlap almost entirely, keep only disjoint ones
+        if all(abs(i - j) >= window_blocks for j in picked):
+            picked.append(i)
+
+    return [
+        {
+            "start": from_block(first + i).strftime(DATETIME_FORMAT),
+            "end": from_block(first + i + window_blocks).strftime(DATETIME_FORMAT),
+            "vehicles": int(sums[i]),
+        }
+        for i in picked
+    ]
+
+
+def series_summary(cube, start_block, end_block, detection_group=None, vehicle_class=None,
+                   percentiles=DEFAULT_PERCENTILES):
+    """Min/max/percentiles of the per-block totals in a range (blocks without data count as 0)."""
+    _, sums = window_sums(cube, 1, start_block, end_block, detection_group, vehicle_class)
+    if not sums.size:
+        return {}
+    return {
+        "min": int(sums.min()),
+        "max": int(sums.max()),
+        "percentiles": {str(q): float(v) for q, v in zip(percentiles, np.percentile(sums, percentiles))},
+    }
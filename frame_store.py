@@ -0,0 +1,71 @@
+"""
+In-process store for computed /realtime_series frame sets.
+
+Frames are kept under a frame id so /save_timestep, /get_updated_spawns and
+index() can refer to them instead of the browser uploading the whole payload
+back and the server round-tripping it through info.json. It is a ResultCache,
+so entries are evicted least-recently-used once the store holds more than
+max_entries sets or more than max_bytes of serialized frame JSON.
+"""
+import json
+
+from cache import ResultCache
+from httpcache import content_hash
+from frames import frames_to_json, arrays_from_frames_json
+from metrics import metrics
+
+
+def make_frame_id(interval_key, start_block):
+    """Frame ids encode their query so any worker can rebuild a missing entry."""
+    return f"{interval_key}:{start_block}"
+
+
+def parse_frame_id(frame_id):
+    """Inverse of make_frame_id. Returns (interval_key, start_block) or None."""
+    interval_key, _, start_block = (frame_id or "").partition(":")
+    if not interval_key or not start_block.isdigit():
+        return None
+    return interval_key, int(start_block)
+
+
+class FrameEntry:
+    def __init__(self, frame_id, frames, arrays=None):
+        self.frame_id = frame_id
+        self.frames = frames
+        with metrics.phase("serialize"):
+            self.body = json.dumps(frames, separators=(",", ":"), sort_keys=True).encode("utf-8")
+        self._arrays = arrays
+        # Derived views (summary, spawn data, ...) computed once per entry.
+        self.derived = {}
+
+    @property
+    def arrays(self):
+        """The frames as FrameArrays, rebuilt from the JSON for uploaded frames."""
+        if self._arrays is None:
+            self._arrays = arrays_from_frames_json(self.frames)
+        return self._arrays
+
+    @property
+    def digest(self):
+        """content_hash of the body, for the ETag."""
+        if "digest" not in self.derived:
+            self.derived["digest"] = content_hash(self.body)
+        return self.derived["digest"]
+
+    @property
+    def size(self):
+        return len(self.body)
+
+
+class FrameStore(ResultCache):
+    def __init__(self, max_entries=32, max_bytes=64 * 1024 * 1024, ttl=None):
+        super().__init__(max_entries=max_entries, ttl=ttl, max_bytes=max_bytes,
+                         sizeof=lambda entry: entry.size)
+
+    def put(self, frame_id, frames, arrays=None):
+        return super().put(frame_id, FrameEntry(frame_id, frames, arrays))
+
+    def put_arrays(self, frame_id, arrays):
+        with metrics.phase("frames"):
+            frames = frames_to_json(arrays)
+        return self.put(frame_id, frames, arrays)
@@ -0,0 +1,231 @@
+"""
+Dense NumPy frame engine behind /realtime_series.
+
+Query rows are scattered into arrays shaped (frames, locations, classes), so
+the per-frame counts, revenue and running cumulative totals come out of a
+handful of vectorized operations instead of nested dict lookups. Only the
+final JSON conversion walks the arrays in Python.
+"""
+from datetime import timedelta
+
+import numpy as np
+
+from models import DATETIME_FORMAT
+
+
+class FrameArrays:
+    """
+    Per-frame totals for one /realtime_series window.
+
+    vehicles and revenue have shape (frames, locations, classes). present
+    marks the (frame, location, class) cells that had rows in the database,
+    which is what decides whether a location/class shows up in a frame.
+    """
+
+    def __init__(self, timestamps, locations, classes, vehicles, revenue, present):
+        self.timestamps = timestamps
+        self.locations = locations
+        self.classes = classes
+        self.vehicles = vehicles
+        self.revenue = revenue
+        self.present = present
+
+    @property
+    def num_frames(self):
+        return len(self.timestamps)
+
+
+def price_matrix(classes, prices):
+    """
+    Toll per (class, is_peak) as a (classes, 2) array. prices are the
+    vehicle_class tolls as {class: (off-peak, peak)} (Dimensions.class_prices),
+    0 for classes it doesn't have. Still (0, 2) for a window without rows, so
+    it broadcasts against empty counts.
+    """
+    return np.array(
+        [list(prices.get(vclass, (0, 0))) for vclass in classes],
+        dtype=np.float64
+    ).reshape(len(classes), 2)
+
+
+def frame_timestamps(start_time, interval_duration, num_frames):
+    frame_duration = interval_duration.total_seconds() / num_frames
+    return [
+        (start_time + timedelta(seconds=i * frame_duration)).strftime(DATETIME_FORMAT)
+        for i in range(num_frames)
+    ]
+
+
+def _scatter_rows(rows, prices, num_slots, first_slot=0):
+    """
+    Scatter (vehicle_class, is_peak, slot, detection_group, vehicle_count)
+    rows into (slots, locations, classes) vehicle, revenue and presence arrays,
+    pricing them with prices (see price_matrix).
+    """
+    if rows:
+        vclass_col, peak_col, slot_col, location_col, count_col = zip(*rows)
+    else:
+        vclass_col = peak_col = slot_col = location_col = count_col = ()
+
+    classes, class_idx = np.unique(np.array(vclass_col, dtype=object).astype(str), return_inverse=True)
+    locations, location_idx = np.unique(np.array(location_col, dtype=object).astype(str), return_inverse=True)
+    slot_idx = np.asarray(slot_col, dtype=np.int64) - first_slot
+    peak_idx = (np.asarray(peak_col, dtype=np.int64) == 1).astype(np.int64)
+    counts = np.asarray(count_col, dtype=np.float64)
+
+    # (slots, locations, classes, is_peak) -> pricing broadcasts over the last two axes.
+    slot_counts = np.zeros((num_slots, len(locations), len(classes), 2))
+    np.add.at(slot_counts, (slot_idx, location_idx, class_idx, peak_idx), counts)
+    present = np.zeros((num_slots, len(locations), len(classes)), dtype=bool)
+    present[slot_idx, location_idx, class_idx] = True
+
+    revenue = (slot_counts * price_matrix(classes, prices)).sum(axis=-1)
+    return locations.tolist(), classes.tolist(), slot_counts.sum(axis=-1), revenue, present
+
+
+def build_frame_arrays(rows, prices, start_time, start_block, num_blocks, num_frames):
+    """
+    rows are (vehicle_class, is_peak, block, detection_group, vehicle_count)
+    tuples for the blocks [start_block, start_block + num_blocks), prices the
+    vehicle_class tolls (see price_matrix).
+
+    Each frame pulls the block it overlaps with and takes a blocks_per_frame
+    share of it. Used for windows with fewer blocks than frames, longer ones
+    are bucketed in SQL, see build_bucketed_frame_arrays.
+    """
+    timestamps = frame_timestamps(start_time, timedelta(minutes=10) * num_blocks, num_frames)
+    locations, classes, block_vehicles, block_revenue, block_present = _scatter_rows(rows, prices, num_blocks, start_block)
+
+    blocks_per_frame = num_blocks / num_frames
+    frame_blocks = (np.arange(num_frames) * blocks_per_frame).astype(np.int64)
+
+    return FrameArrays(
+        timestamps=timestamps,
+        locations=locations,
+        classes=classes,
+        vehicles=block_vehicles[frame_blocks] * blocks_per_frame,
+        revenue=block_revenue[frame_blocks] * blocks_per_frame,
+        present=block_present[frame_blocks],
+    )
+
+
+def frame_bucket(block_offset, num_blocks, num_frames):
+    """
+    Frame index of the block block_offset blocks into the window, when a frame
+    spans at least one block: frame f covers the blocks with
+    offset * num_frames // num_blocks == f. Works on ints, arrays and SQL
+    expressions alike.
+    """
+    return block_offset * num_frames // num_blocks
+
+
+def build_bucketed_frame_arrays(rows, prices, start_time, num_blocks, num_frames):
+    """
+    rows are (vehicle_class, is_peak, frame, detection_group, vehicle_count)
+    tuples already summed per frame bucket (see frame_bucket), so every frame
+    holds the totals of all the blocks it spans.
+    """
+    timestamps = frame_timestamps(start_time, timedelta(minutes=10) * num_blocks, num_frames)
+    locations, classes, vehicles, revenue, present = _scatter_rows(rows, prices, num_frames)
+    return FrameArrays(
+        timestamps=timestamps,
+        locations=locations,
+        classes=classes,
+        vehicles=vehicles,
+        revenue=revenue,
+        present=present,
+    )
+
+
+def _round_current(values):
+    # Non-zero per-class counts never display below 1.
+    rounded = np.round(values, 2)
+    return np.where(rounded > 0, np.maximum(rounded, 1), rounded)
+
+
+def frames_to_json(arrays):
+    """
+    Convert FrameArrays to the list-of-frames payload /realtime_series returns.
+    Frames carry no marker scale: that's chosen per class, and reported with
+    each class's spawn schedule (see spawn_schedule.py).
+    """
+    cum_vehicles = np.cumsum(arrays.vehicles, axis=0)
+    cum_revenue = np.cumsum(arrays.revenue, axis=0)
+    # A class appears in a location's cumulative block once it has been seen.
+    seen = np.logical_or.accumulate(arrays.present, axis=0)
+    location_present = arrays.present.any(axis=2)
+
+    cur_total_vehicles = np.round(arrays.vehicles.sum(axis=2), 2).tolist()
+    cur_total_revenue = np.round(arrays.revenue.sum(axis=2), 2).tolist()
+    cur_vehicles = _round_current(arrays.vehicles).tolist()
+    cur_revenue = _round_current(arrays.revenue).tolist()
+    cum_total_vehicles = np.round(cum_vehicles.sum(axis=2), 2).tolist()
+    cum_total_revenue = np.round(cum_revenue.sum(axis=2), 2).tolist()
+    cum_vehicles = np.round(cum_vehicles, 2).tolist()
+    cum_revenue = np.round(cum_revenue, 2).tolist()
+    present = arrays.present.tolist()
+    seen = seen.tolist()
+
+    classes = arrays.classes
+    frames = []
+    for f, timestamp in enumerate(arrays.timestamps):
+        locations = {}
+        for l in np.flatnonzero(location_present[f]).tolist():
+            locations[arrays.locations[l]] = {
+                "current": {
+                    "total_vehicles": cur_total_vehicles[f][l],
+                    "total_revenue": cur_total_revenue[f][l],
+                    "by_class": {
+                        classes[c]: {"vehicles": cur_vehicles[f][l][c], "revenue": cur_revenue[f][l][c]}
+                        for c in range(len(classes)) if present[f][l][c]
+                    }
+                },
+                "cumulative": {
+                    "vehicles": cum_total_vehicles[f][l],
+                    "revenue": cum_total_revenue[f][l],
+                    "by_class": {
+                        classes[c]: {"vehicles": cum_vehicles[f][l][c], "revenue": cum_revenue[f][l][c]}
+                        for c in range(len(classes)) if seen[f][l][c]
+                    }
+                }
+            }
+        frames.append({"timestamp": timestamp, "locations": locations})
+    return frames
+
+
+def arrays_from_frames_json(frames):
+    """
+    Rebuild FrameArrays from an existing frames payload (uploaded or loaded
+    from info.json), using each frame's current by_class values.
+    """
+    locations = sorted({name for frame in frames for name in frame.get("locations", {})})
+    classes = sorted({
+        vclass
+        for frame in frames
+        for loc in frame.get("locations", {}).values()
+        for vclass in loc.get("current", {}).get("by_class", {})
+    })
+    location_index = {name: i for i, name in enumerate(locations)}
+    class_index = {name: i for i, name in enumerate(classes)}
+
+    shape = (len(frames), len(locations), len(classes))
+    vehicles = np.zeros(shape)
+    revenue = np.zeros(shape)
+    present = np.zeros(shape, dtype=bool)
+    for f, frame in enumerate(frames):
+        for name, loc in frame.get("locations", {}).items():
+            l = location_index[name]
+            for vclass, stats in loc.get("current", {}).get("by_class", {}).items():
+                c = class_index[vclass]
+                vehicles[f, l, c] = stats.get("vehicles", 0)
+                revenue[f, l, c] = stats.get("revenue", 0)
+                present[f, l, c] = True
+
+    return FrameArrays(
+        timestamps=[frame.get("timestamp") for frame in frames],
+        locations=locations,
+        classes=classes,
+        vehicles=vehicles,
+        revenue=revenue,
+        present=present,
+    )
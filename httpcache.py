@@ -0,0 +1,127 @@
+"""
+HTTP caching for the data routes: ETags, Cache-Control and compression.
+
+A response built with http_cache.response(body) gets a strong ETag made of
+the data version and a hash of its body. A client sending the ETag back in
+If-None-Match gets a bodyless 304 (compressed variants carry the weak form
+of the same ETag, which matches too). Cache-Control depends on the URL: if the
+request pins the current data version (?v=<version>, the value of the
+X-Data-Version header), the response can't change and is marked immutable.
+Otherwise clients must revalidate, which is just a 304 until the next ingest.
+
+Large text responses are gzip (or brotli, if the brotli package is
+installed) compressed. Compressed bodies of ETagged responses are kept in a
+small LRU, so repeat requests for the same frames don't compress them again.
+"""
+import gzip
+import hashlib
+
+from flask import request, Response
+
+from cache import ResultCache
+
+try:
+    import brotli
+except ImportError:  # optional, gzip only without it
+    brotli = None
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+COMPRESSIBLE_TYPES = ("application/json", "text/html", "text/plain", "application/javascript", "text/csv")
+
+
+def content_hash(body):
+    return hashlib.sha1(body).hexdigest()[:20]
+
+
+class HttpCache:
+    def __init__(self, version_source, min_size=1024, compressed_cache_bytes=32 * 1024 * 1024):
+        self.version_source = version_source
+        self.min_size = min_size
+        self.compressed = ResultCache(max_entries=256, max_bytes=compressed_cache_bytes, sizeof=len)
+
+    def init_app(self, app):
+        app.after_request(self.finalize)
+
+    def response(self, body, mimetype="application/json", digest=None, private=False):
+        """
+        A cacheable response for body (bytes). digest is the body's
+        content_hash if the caller already has it. private responses depend on
+        the session cookie and are never shared by proxies.
+        """
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        response = Response(body, mimetype=mimetype)
+        return self._cacheable(response, digest or content_hash(body), private)
+
+    def gzip_response(self, gzipped, digest, mimetype="application/json", private=False):
+        """
+        response() for a body that is already gzip'd on disk (digest is the
+        content_hash of the uncompressed body). Clients that accept gzip get
+        the bytes as they are.
+        """
+        if not request.accept_encodings["gzip"]:
+            return self.response(gzip.decompress(gzipped), mimetype, digest, private)
+        response = Response(gzipped, mimetype=mimetype)
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        self._cacheable(response, digest, private)
+        response.set_etag(response.get_etag()[0], weak=True)
+        return response
+
+    def _cacheable(self, response, digest, private):
+        version = self.version_source()
+        response.set_etag(f"{version}-{digest}")
+        response.headers["X-Data-Version"] = str(version)
+
+        pinned = request.args.get("v") == str(version)
+        if private:
+            response.headers["Cache-Control"] = f"private, {REVALIDATE}"
+            response.vary.add("Cookie")
+        else:
+            response.headers["Cache-Control"] = IMMUTABLE if pinned else REVALIDATE
+        return response
+
+    def _encoding(self):
+        if brotli is not None and request.accept_encodings["br"]:
+            return "br"
+        if request.accept_encodings["gzip"]:
+            return "gzip"
+        return None
+
+    def _compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=5)
+        return gzip.compress(body, compresslevel=6)
+
+    def finalize(self, response):
+        """after_request hook: answer If-None-Match with 304, then compress."""
+        if response.status_code != 200 or response.direct_passthrough or response.is_streamed:
+            return response
+
+        etag, _ = response.get_etag()
+        if etag is not None and request.if_none_match.contains_weak(etag):
+            not_modified = Response(status=304)
+            for header in ("ETag", "Cache-Control", "Vary", "X-Data-Version"):
+                if header in response.headers:
+                    not_modified.headers[header] = response.headers[header]
+            return not_modified
+
+        if "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        body = response.get_data()
+        encoding = self._encoding()
+        if encoding is None or len(body) < self.min_size:
+            return response
+
+        if etag is not None:
+            compressed = self.compressed.get_or_compute((etag, encoding), lambda: self._compress(body, encoding))
+        else:
+            compressed = self._compress(body, encoding)
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        if etag is not None:
+            # Same content, different bytes: only weakly equal to the plain body
+            response.set_etag(etag, weak=True)
+        response.vary.add("Accept-Encoding")
+        return response
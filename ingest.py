@@ -0,0 +1,278 @@
+"""
+Streaming bulk loader for the MTA congestion CSV.
+
+The CSV is read in chunks of CHUNK_SIZE rows and each chunk goes into SQLite
+as one executemany INSERT plus a checkpoint update in the same transaction,
+so memory stays flat and a crashed load picks up after the last committed
+chunk instead of starting over. Vehicle classes and detection groups are
+stored as their dimension codes (see dimensions.py), and the hourly and
+daily rollups of the loaded range are refreshed at the end.
+
+Loads append: rows whose Index is already in the table are skipped, and the
+data version bump records the block range the new rows cover, so servers
+only drop the cached results of that range. ingest_drop_directory() loads
+every new CSV in a drop directory (write files under another name and
+rename them to *.csv when complete) and moves them to done/ afterwards.
+
+    python ingest.py cleaned_data.csv
+    python ingest.py cleaned_data.csv --chunk-size 100000 --restart
+    python ingest.py --drop-dir instance/incoming --watch 60
+"""
+import argparse
+import csv
+import functools
+import os
+import shutil
+import time
+
+from dimensions import seed_dimensions, DimensionEncoder
+from models import db, TrafficEntry, IngestCheckpoint, to_block, bump_data_version
+from rollups import refresh_rollups
+
+CHUNK_SIZE = 50000
+
+INSERT_SQL = (
+    f"INSERT OR IGNORE INTO {TrafficEntry.__tablename__} "
+    "(id, datetime, block, is_peak, class_code, group_code, crz_entries, excluded_roadway_entries) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+
+
+# Every timestamp repeats once per detection group and class, so cache the
+# string -> block conversion instead of re-parsing it for each row.
+_block_for = functools.lru_cache(maxsize=4096)(to_block)
+
+
+def _parse_peak(value):
+    return 1 if value.strip().lower() in ('1', 'true', 'yes') else 0
+
+
+def parse_csv_row(row):
+    """
+    Turn one csv.DictReader row into the tuple INSERT_SQL expects, with the
+    class and group still as names (see encode_chunk).
+    """
+    return (
+        int(row['Index']),
+        row['Datetime'],
+        _block_for(row['Datetime']),
+        _parse_peak(row['Is Peak']),
+        row['Vehicle Class'],
+        row['Detection Group'],
+        int(row['CRZ Entries']),
+        int(row['Excluded Roadway Entries']),
+    )
+
+
+def iter_csv_chunks(filepath, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """Yield lists of parsed row tuples, at most chunk_size long."""
+    with open(filepath, newline='', encoding='utf-8') as csvfile:
+        reader = csv.DictReader(csvfile)
+        chunk = []
+        for row_number, row in enumerate(reader):
+            if row_number < skip_rows:
+                continue
+            chunk.append(parse_csv_row(row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def encode_chunk(conn, encoder, chunk):
+    """Replace the class and group names of parsed rows by their codes."""
+    return [
+        (row[0], row[1], row[2], row[3], encoder.class_code(conn, row[4]), encoder.group_code(conn, row[5]),
+         row[6], row[7])
+        for row in chunk
+    ]
+
+
+def new_rows(conn, chunk):
+    """The rows of chunk whose id isn't in traffic_entry yet."""
+    if not chunk:
+        return chunk
+    ids = [row[0] for row in chunk]
+    existing = {row[0] for row in conn.exec_driver_sql(
+        f"SELECT id FROM {TrafficEntry.__tablename__} WHERE id BETWEEN ? AND ?", (min(ids), max(ids))
+    )}
+    return [row for row in chunk if row[0] not in existing] if existing else chunk
+
+
+def _load_checkpoint(conn, source, stat):
+    row = conn.exec_driver_sql(
+        f"SELECT file_size, file_mtime, rows_done, completed "
+        f"FROM {IngestCheckpoint.__tablename__} WHERE source = ?",
+        (source,)
+    ).first()
+    if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime:
+        # Unknown or modified file: start from the top.
+        return 0, False
+    return row[2], bool(row[3])
+
+
+def _save_checkpoint(conn, source, stat, rows_done, completed=False):
+    conn.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {IngestCheckpoint.__tablename__} "
+        "(source, file_size, file_mtime, rows_done, completed) VALUES (?, ?, ?, ?, ?)",
+        (source, stat.st_size, stat.st_mtime, rows_done, int(completed))
+    )
+
+
+def bulk_load_csv(filepath, engine, chunk_size=CHUNK_SIZE, resume=True):
+    """
+    Load a congestion CSV into traffic_entry and return a stats dict
+    ({"rows", "inserted", "seconds", "rows_per_sec", "resumed_from"}).
+    inserted leaves out rows whose id was already loaded.
+
+    On an empty table the secondary indexes are dropped for the load and
+    rebuilt once at the end, which is much cheaper than maintaining them row
+    by row.
+    """
+    table = TrafficEntry.__table__
+    db.metadata.create_all(bind=engine)
+
+    source = os.path.abspath(filepath)
+    stat = os.stat(filepath)
+
+    with engine.begin() as conn:
+        seed_dimensions(conn)
+        if resume:
+            rows_done, completed = _load_checkpoint(conn, source, stat)
+        else:
+            rows_done, completed = 0, False
+        if completed:
+            print(f"{filepath} already loaded ({rows_done} rows), skipping.")
+            return {"rows": 0, "inserted": 0, "seconds": 0.0, "rows_per_sec": 0.0, "resumed_from": rows_done}
+
+        table_empty = conn.exec_driver_sql(f"SELECT 1 FROM {table.name} LIMIT 1").first() is None
+        if table_empty:
+            for index in table.indexes:
+                conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+
+    if rows_done:
+        print(f"Resuming {filepath} after row {rows_done}...")
+
+    started = time.perf_counter()
+    loaded = 0
+    inserted = 0
+    resumed_from = rows_done
+    first_block = last_block = None
+    with engine.connect() as conn:
+        # The checkpoint makes every chunk recoverable, so there's no need to
+        # pay for an fsync per commit while loading. The pooled connection
+        # gets its own setting back afterwards (NORMAL, see database.py).
+        synchronous = conn.exec_driver_sql("PRAGMA synchronous").scalar()
+        conn.exec_driver_sql("PRAGMA synchronous = OFF")
+        conn.commit()
+        encoder = DimensionEncoder(conn)
+        conn.commit()
+        try:
+            for chunk in iter_csv_chunks(filepath, chunk_size, skip_rows=rows_done):
+                with conn.begin():
+                    fresh = new_rows(conn, chunk)
+                    if fresh:
+                        conn.exec_driver_sql(INSERT_SQL, encode_chunk(conn, encoder, fresh))
+                    rows_done += len(chunk)
+                    _save_checkpoint(conn, source, stat, rows_done)
+                loaded += len(chunk)
+                inserted += len(fresh)
+                if fresh:
+                    blocks = [row[2] for row in fresh]
+                    first_block = min(blocks) if first_block is None else min(first_block, min(blocks))
+                    last_block = max(blocks) if last_block is None else max(last_block, max(blocks))
+                elapsed = time.perf_counter() - started
+                print(f"  {rows_done:,} rows loaded ({loaded / elapsed:,.0f} rows/sec)")
+        finally:
+            conn.exec_driver_sql(f"PRAGMA synchronous = {int(synchronous)}")
+            conn.commit()
+
+    # Also after a load that was interrupted while its indexes were dropped,
+    # which this resumed run no longer sees as a load into an empty table
+    print("Building indexes...")
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        _save_checkpoint(conn, source, stat, rows_done, completed=True)
+        # Tells running servers their cached results are stale
+        if resumed_from:
+            # Rows of the interrupted run are in the table but not in the rollups yet
+            refresh_rollups(conn)
+            bump_data_version(conn)
+        elif first_block is not None:
+            refresh_rollups(conn, first_block, last_block + 1)
+            bump_data_version(conn, first_block, last_block + 1)
+        # Full statistics after a load into an empty table, a cheap refresh after appends
+        conn.exec_driver_sql("ANALYZE" if table_empty else "PRAGMA optimize")
+
+    elapsed = time.perf_counter() - started
+    rate = loaded / elapsed if elapsed else 0.0
+    print(f"Loaded {loaded:,} rows ({inserted:,} new) from {filepath} in {elapsed:.1f}s ({rate:,.0f} rows/sec).")
+    return {
+        "rows": loaded,
+        "inserted": inserted,
+        "seconds": elapsed,
+        "rows_per_sec": rate,
+        "resumed_from": rows_done - loaded,
+    }
+
+
+def ingest_drop_directory(directory, engine, chunk_size=CHUNK_SIZE):
+    """
+    Append every *.csv in directory, oldest name first, moving each to
+    directory/done once loaded. Returns the bulk_load_csv stats per file.
+    """
+    if not os.path.isdir(directory):
+        return []
+    done_dir = os.path.join(directory, "done")
+    results = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith(".csv") or name.startswith(".") or not os.path.isfile(path):
+            continue
+        stats = bulk_load_csv(path, engine, chunk_size=chunk_size)
+        os.makedirs(done_dir, exist_ok=True)
+        shutil.move(path, os.path.join(done_dir, name))
+        results.append(dict(stats, file=name))
+    return results
+
+
+def refresh_precomputed():
+    """Bring the saved cube and pre-baked windows up to the new data (call in an app context)."""
+    from main import aggregate_cube, read_data_version, PREBAKE_DIR
+    from database import readonly_engine
+    from prebake import prebake
+
+    # Recounts just the block ranges loaded since the cube was saved
+    aggregate_cube.clear()
+    aggregate_cube.get()
+    if os.path.exists(os.path.join(PREBAKE_DIR, "index.json")):
+        # Only the days whose rows changed are baked again
+        prebake(PREBAKE_DIR, readonly_engine(), read_data_version())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Bulk load a congestion CSV into traffic.db")
+    parser.add_argument("csv_path", nargs="?", default="cleaned_data.csv")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--restart", action="store_true",
+                        help="ignore any checkpoint and read the file from the top")
+    parser.add_argument("--drop-dir", help="append the new CSVs of this directory instead of csv_path")
+    parser.add_argument("--watch", type=float, default=None,
+                        help="with --drop-dir, keep checking the directory every WATCH seconds")
+    args = parser.parse_args()
+
+    from main import app
+
+    with app.app_context():
+        if not args.drop_dir:
+            bulk_load_csv(args.csv_path, db.engine, chunk_size=args.chunk_size, resume=not args.restart)
+        else:
+            while True:
+                results = ingest_drop_directory(args.drop_dir, db.engine, chunk_size=args.chunk_size)
+                if any(stats["inserted"] for stats in results):
+                    refresh_precomputed()
+                if args.watch is None:
+                    break
+                time.sleep(args.watch)
@@ -1,88 +1,262 @@
-from flask import Flask, render_template, url_for, request, jsonify
-import folium
+from flask import Flask, render_template, url_for, request, jsonify, session, Response, stream_with_context
 import json
-import requests
-from sqlalchemy import func
-import csv
+from sqlalchemy.exc import OperationalError
 from datetime import datetime, timedelta
-from collections import defaultdict
 import os
-from models import db, TrafficEntry
+import hashlib
+from models import db, DailyTotal, to_block, from_block, get_data_version, changed_ranges
+from database import sqlite_config, init_sqlite, readonly_engine
+from migrations import upgrade_traffic_db
+from ingest import bulk_load_csv, ingest_drop_directory
+from dimensions import VEHICLE_CLASSES
+from frames import build_frame_arrays, build_bucketed_frame_arrays
+from extremes import frame_extremes, extreme_windows, series_summary
+from frame_store import FrameStore, make_frame_id, parse_frame_id
+from cache import ResultCache, DataVersionWatcher, normalize_params
+from cube import CubeHolder
+from prebake import PrebakedStore
+from storage import make_backend
+from rollups import daily_totals
+from export import FORMATS, available_formats, iter_row_batches, next_cursor, parse_cursor
+from spawn_schedule import build_spawn_schedule, build_spawn_bundle
+from playback import RouteTable, frame_block_ranges, window_timestamps, stream_events
+from routes import RouteRegistry
+from basemap import BaseMapCache
+from metrics import metrics
+from httpcache import HttpCache
 import math
-from folium.plugins import Fullscreen
 from views import views_bp
 
 app = Flask(__name__)
 app.register_blueprint(views_bp)
-DB_PATH = 'instance/traffic.db'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///traffic.db'
+# TRAFFIC_DB points the app at another database, e.g. bench.py's synthetic one
+DB_PATH = os.environ.get('TRAFFIC_DB') or os.path.join(app.instance_path, 'traffic.db')
+# WAL mode, a sized pool per worker and a read-only bind for query routes
+app.config.update(sqlite_config(DB_PATH, pool_size=int(os.environ.get('DB_POOL_SIZE', 8))))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['FRAME_STORE_MAX_ENTRIES'] = 32
+app.config['FRAME_STORE_MAX_BYTES'] = 64 * 1024 * 1024
+app.config['RESULT_CACHE_MAX_ENTRIES'] = 256
+app.config['RESULT_CACHE_TTL'] = 3600
+# Where the query routes read traffic_entry from: "sqlite", or "columnar"
+# for memory-mapped NumPy columns, see storage.py
+app.config['STORAGE_BACKEND'] = os.environ.get('STORAGE_BACKEND', 'sqlite')
+# Adds phase timings to every response, see metrics.py
+app.config['SERVER_TIMING'] = os.environ.get('SERVER_TIMING') == '1'
 db.init_app(app)
+init_sqlite(app)
+# Per-route latency, phase and SQL metrics at /metrics
+metrics.init_app(app)
+# Compact JSON for jsonify() responses (ETagged bodies are built by json_body)
+app.json.compact = True
 
-PRICING = {
-    ('Car', 0): 2.25,
-    ('Car', 1): 9,
-    ('Buses', 0): 3.6,
-    ('Buses', 1): 14.4,
-    ('Motorcycles', 0): 1.05,
-    ('Motorcycles', 1): 4.5,
-    ('Taxi', 0): 0.75,
-    ('Taxi', 1): 0.75,
-    ('Single Unit Trucks', 0): 3.6,
-    ('Single Unit Trucks', 1): 14.4,
-    ('Multi Unit Trucks', 0): 5.40,
-    ('Multi Unit Trucks', 1): 21.60
-}
+def load_secret_key(path):
+    """
+    SECRET_KEY from the environment, otherwise a random key kept in the
+    instance folder. Every worker has to sign sessions with the same key.
+    """
+    if os.environ.get('SECRET_KEY'):
+        return os.environ['SECRET_KEY']
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path):
+        # The key is written in full to a file of this worker's own, then
+        # linked into place; the first link wins and the others read its key,
+        # so no worker can read a key file that's still being written.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(os.urandom(32).hex())
+        try:
+            os.link(tmp_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'r') as f:
+        return f.read().strip()
+
+app.config['SECRET_KEY'] = load_secret_key(os.path.join(app.instance_path, 'secret_key'))
+UPLOAD_DIR = os.path.join(os.path.dirname(DB_PATH), 'uploads')
+# Frames uploaded to /save_timestep: request size, frames per upload and
+# files kept (oldest are pruned first), see save_upload
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
+app.config['MAX_UPLOAD_FRAMES'] = 1000
+app.config['MAX_UPLOADS'] = 256
+
+def read_data_version():
+    try:
+        with readonly_engine().connect() as conn:
+            return get_data_version(conn)
+    except OperationalError:
+        # No data_version table yet, i.e. nothing has been ingested
+        return 0
+
+def read_changed_ranges(since_version, version):
+    try:
+        with readonly_engine().connect() as conn:
+            return changed_ranges(conn, since_version, version)
+    except OperationalError:
+        return None
+
+def frame_id_range(frame_id):
+    """Blocks a frame store entry was computed from; uploaded and default frames read none."""
+    parsed = parse_frame_id(frame_id)
+    if parsed is None or parsed[0] not in INTERVAL_CONFIG:
+        return (0, 0)
+    interval_key, start_block = parsed
+    return start_block, start_block + INTERVAL_CONFIG[interval_key]["blocks"]
+
+def result_key_range(key):
+    """Blocks a /filter or /calendar_totals result covers, from its cache key."""
+    params = dict(key[1:])
+    if "start_block" in params:
+        return params["start_block"], params["end_block"]
+    if "month" in params:
+        first = datetime.strptime(params["month"], "%Y-%m")
+        following = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return to_block(first), to_block(following)
+    return None
+
+# Cached results are dropped when an ingest bumps the data version; those
+# that know their block range only if the ingest touched it
+data_version = DataVersionWatcher(read_data_version, changes_source=read_changed_ranges)
+frame_store = data_version.register(FrameStore(
+    max_entries=app.config['FRAME_STORE_MAX_ENTRIES'],
+    max_bytes=app.config['FRAME_STORE_MAX_BYTES'],
+    ttl=app.config['RESULT_CACHE_TTL']
+), key_range=frame_id_range)
+filter_cache = data_version.register(ResultCache(
+    max_entries=app.config['RESULT_CACHE_MAX_ENTRIES'],
+    ttl=app.config['RESULT_CACHE_TTL']
+), key_range=result_key_range)
+# ETags/304s and compression for the data routes, see httpcache.py
+http_cache = HttpCache(lambda: data_version.version)
+http_cache.init_app(app)
+# Prefix sums for constant-time range totals, see cube.py
+CUBE_DIR = os.path.join(os.path.dirname(DB_PATH), 'aggregate_cube')
+aggregate_cube = data_version.register(CubeHolder(readonly_engine, CUBE_DIR))
+COLUMNS_DIR = os.path.join(os.path.dirname(DB_PATH), 'columns')
+storage = data_version.register(make_backend(app.config['STORAGE_BACKEND'], readonly_engine, COLUMNS_DIR))
+# Windows baked ahead of time by prebake.py, served straight from disk
+PREBAKE_DIR = os.path.join(os.path.dirname(DB_PATH), 'prebaked')
+# New CSVs dropped here are appended by ingest_drop_directory (see ingest.py)
+DROP_DIR = os.environ.get('INGEST_DROP_DIR') or os.path.join(os.path.dirname(DB_PATH), 'incoming')
+prebaked = data_version.register(PrebakedStore(PREBAKE_DIR, lambda: data_version.version,
+                                               changes_source=read_changed_ranges, window_range=frame_id_range))
+DEFAULT_FRAME_ID = "default"
+DEFAULT_CLASS = "Car"
+
+@app.before_request
+def check_data_version():
+    data_version.check()
+
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    return jsonify({
+        "data_version": data_version.version,
+        "filter": filter_cache.stats(),
+        "frames": frame_store.stats()
+    })
 
 def load_data_from_csv(filepath):
-    with open(filepath, newline='', encoding='utf-8') as csvfile:
-        reader = csv.DictReader(csvfile)
-        for row in reader:
-            entry = TrafficEntry(
-                id=int(row['Index']),
-                datetime=row['Datetime'],
-                is_peak=row['Is Peak'],
-                vehicle_class=row['Vehicle Class'],
-                detection_group=row['Detection Group'],
-                crz_entries=int(row['CRZ Entries']),
-                excluded_roadway_entries=int(row['Excluded Roadway Entries'])
-            )
-            db.session.add(entry)
-        db.session.commit()
-        print("CSV data loaded into database.")
+    # Streams the file in chunks with periodic commits, see ingest.py
+    bulk_load_csv(filepath, db.engine)
 
 @app.route('/data', methods=['GET'])
 def get_traffic_data():
-    entries = TrafficEntry.query.limit(12).all()
-    return jsonify([{
-        'id': e.id,
-        'datetime': e.datetime,
-        'is_peak': e.is_peak,
-        'vehicle_class': e.vehicle_class,
-        'detection_group': e.detection_group,
-        'crz_entries': e.crz_entries,
-        'excluded_roadway_entries': e.excluded_roadway_entries
-    } for e in entries])
+    return jsonify(storage.entries(12))
+
 
+@app.route('/export', methods=['GET'])
+def export_entries():
+    # Streams the matching rows as CSV, NDJSON or Arrow. With ?limit= the
+    # rows come in pages; X-Next-Cursor is the ?after= of the next one.
+    export_format = request.args.get('format', 'csv')
+    if export_format not in available_formats():
+        return jsonify({'error': f"format must be one of {', '.join(available_formats())}"}), 400
+    datetime_start = request.args.get('datetime_start')
+    datetime_end = request.args.get('datetime_end')
+    try:
+        start_block = to_block(datetime_start, round_up=True) if datetime_start else None
+        end_block = to_block(datetime_end, round_up=True) if datetime_end else None
+        after = parse_cursor(request.args.get('after'))
+        limit = int(request.args['limit']) if request.args.get('limit') else None
+        if limit is not None and limit < 1:
+            raise ValueError(limit)
+    except ValueError:
+        return jsonify({'error': 'Invalid datetime_start, datetime_end, after or limit'}), 400
+
+    filters = dict(
+        start_block=start_block,
+        end_block=end_block,
+        detection_group=request.args.get('detection_group'),
+        vehicle_class=request.args.get('vehicle_class'),
+        after=after
+    )
+    encoder, mimetype, extension = FORMATS[export_format]
+    headers = {
+        "X-Data-Version": str(data_version.version),
+        "Content-Disposition": f'attachment; filename="traffic.{extension}"',
+    }
+    if limit is not None:
+        with readonly_engine().connect() as conn:
+            cursor = next_cursor(conn, limit, **filters)
+        if cursor is not None:
+            headers["X-Next-Cursor"] = cursor
+
+    return Response(encoder(export_batches(readonly_engine(), limit, filters)), mimetype=mimetype, headers=headers)
+
+def export_batches(engine, limit, filters):
+    # The connection is opened once the response is being sent and closed
+    # with the generator, also when the client goes away mid-download
+    with engine.connect() as conn:
+        yield from iter_row_batches(conn, limit=limit, **filters)
 
 @app.route("/get_updated_spawns", methods=["GET"])
 def get_updated_spawns():
-    # Re-parse info.json so we see the updated data
-    # Then build the same JS lines that spawn cars.
-    # For example, if you already have parse_info_json() and build_spawn_js_from_timestepdata() used by index():
-
-    # re-parse the info.json
-    all_timestep_data = parse_info_json("info.json")  # only SELECTED_CLASS vehicles
-    # build new JavaScript lines
-    spawn_js = build_spawn_js_from_timestepdata(
-        timestep_data=all_timestep_data,
+    # Spawn schedule for the frames the client last saved (or an explicit
+    # ?frame_id=). ?encoding=binary packs the spawn triples, ?format=js
+    # returns the old per-vehicle setTimeout lines.
+    entry = load_frame_entry(current_frame_id())
+    if entry is None:
+        return jsonify({"error": "Unknown frame_id"}), 404
+
+    vehicle_class = current_vehicle_class()
+    all_timestep_data = parse_frames(entry.frames, vehicle_class)
+
+    if request.args.get("format") == "js":
+        spawn_js = build_spawn_js_from_timestepdata(
+            timestep_data=all_timestep_data,
+            vehicle_class=vehicle_class,
+            speed=4000,
+            spawn_window=20000,
+            step_delay=2000
+        )
+        return http_cache.response(json.dumps({"spawn_js": spawn_js}), private=True)
+
+    schedule = build_spawn_schedule(
+        all_timestep_data,
+        route_registry.lookup(vehicle_class),
         speed=4000,
         spawn_window=20000,
-        step_delay=2000
+        step_delay=2000,
+        binary=request.args.get("encoding") == "binary"
+    )
+    # Depends on the session's class and frames, so only the client may cache it
+    return http_cache.response(json_body({"schedule": schedule}), private=True)
+
+@app.route("/spawn_bundle", methods=["GET"])
+def get_spawn_bundle():
+    # Schedules for all classes of one frame set, so the page can switch
+    # class without another request
+    frame_id = current_frame_id()
+    entry = load_frame_entry(frame_id)
+    if entry is None:
+        return jsonify({"error": "Unknown frame_id"}), 404
+    return http_cache.response(
+        json_body({"frame_id": frame_id, **spawn_bundle_for_entry(entry)}),
+        private="frame_id" not in request.args
     )
-
-    # Return it as JSON:
-    return jsonify({"spawn_js": spawn_js})
 
 @app.route('/filter', methods=['GET'])
 def get_filtered_data():
@@ -94,84 +268,116 @@ def get_filtered_data():
     if not datetime_start or not datetime_end:
         return jsonify({'error': 'datetime_start and datetime_end are required'}), 400
 
-    # Base query
-    query = db.session.query(
-        TrafficEntry.vehicle_class,
-        TrafficEntry.is_peak,
-        func.sum(TrafficEntry.crz_entries)
-    ).filter(
-        TrafficEntry.datetime >= datetime_start,
-        TrafficEntry.datetime < datetime_end
+    try:
+        # Rows sit on block boundaries, so rounding both bounds up keeps the
+        # same rows the old datetime >= start / < end string comparison did.
+        start_block = to_block(datetime_start, round_up=True)
+        end_block = to_block(datetime_end, round_up=True)
+    except ValueError:
+        return jsonify({'error': 'datetime_start and datetime_end must be in format YYYY-MM-DD HH:MM:SS'}), 400
+
+    key = normalize_params(
+        "filter",
+        start_block=start_block,
+        end_block=end_block,
+        detection_group=detection_group,
+        vehicle_class=vehicle_class_filter
+    )
+    body = filter_cache.get_or_compute(
+        key, lambda: json_body(compute_filter_totals(start_block, end_block, detection_group, vehicle_class_filter))
     )
+    return http_cache.response(body)
 
-    if detection_group:
-        query = query.filter(TrafficEntry.detection_group == detection_group)
+@app.route('/calendar_totals', methods=['GET'])
+def calendar_totals():
+    # Per-day totals of a month, for shading the date picker
+    month = request.args.get('month', '')
+    detection_group = request.args.get('detection_group')
+    vehicle_class_filter = request.args.get('vehicle_class')
+    try:
+        first = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        return jsonify({'error': 'month must be in format YYYY-MM'}), 400
 
-    if vehicle_class_filter:
-        query = query.filter(TrafficEntry.vehicle_class == vehicle_class_filter)
+    key = normalize_params(
+        "calendar_totals",
+        month=first.strftime("%Y-%m"),
+        detection_group=detection_group,
+        vehicle_class=vehicle_class_filter
+    )
+    body = filter_cache.get_or_compute(
+        key, lambda: json_body(compute_calendar_totals(first, detection_group, vehicle_class_filter))
+    )
+    return http_cache.response(body)
+
+def compute_calendar_totals(first, detection_group=None, vehicle_class_filter=None):
+    """Vehicles and revenue per day of the month starting at first, from the daily rollup."""
+    following = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+    first_day = to_block(first) // DailyTotal.blocks_per_period
+    stop_day = to_block(following) // DailyTotal.blocks_per_period
+    with metrics.phase("query"):
+        with readonly_engine().connect() as conn:
+            rows = daily_totals(conn, first_day, stop_day, detection_group, vehicle_class_filter)
+    days = {
+        from_block(day * DailyTotal.blocks_per_period).strftime("%Y-%m-%d"): {"vehicles": vehicles, "revenue": revenue}
+        for day, vehicles, revenue in rows
+    }
+    return {
+        "month": first.strftime("%Y-%m"),
+        "days": days,
+        "max_vehicles": max((day["vehicles"] for day in days.values()), default=0)
+    }
 
-    query = query.group_by(TrafficEntry.vehicle_class, TrafficEntry.is_peak)
+def json_body(data):
+    """Compact, key-sorted JSON bytes, so equal results hash to the same ETag."""
+    with metrics.phase("serialize"):
+        return json.dumps(data, separators=(",", ":"), sort_keys=True).encode("utf-8")
+
+def compute_filter_totals(start_block, end_block, detection_group=None, vehicle_class_filter=None):
+    """Vehicle and revenue totals per class for the blocks [start_block, end_block)."""
+    cube = aggregate_cube.get()
+    if cube is not None:
+        with metrics.phase("aggregate"):
+            vehicle_counts, revenue_per_class = cube.class_totals(
+                start_block, end_block, detection_group, vehicle_class_filter
+            )
+        return {
+            "vehicle_counts": vehicle_counts,
+            "total_vehicles": sum(vehicle_counts.values()),
+            "revenue_per_class": revenue_per_class,
+            "total_revenue": sum(revenue_per_class.values())
+        }
 
-    results = query.all()
+    # No cube (empty database), aggregate in the storage backend
+    with metrics.phase("query"):
+        results = storage.class_totals(start_block, end_block, detection_group, vehicle_class_filter)
 
     vehicle_counts = {}
     revenue_per_class = {}
-    total_vehicles = 0
-    total_revenue = 0
+    for vehicle_class, entry_sum, revenue in results:
+        vehicle_counts[vehicle_class] = entry_sum
+        revenue_per_class[vehicle_class] = revenue
 
-    for vehicle_class, is_peak, entry_sum in results:
-        price_per = PRICING.get((vehicle_class, is_peak), 0)
-        revenue = entry_sum * price_per
-
-        # Update per-class stats
-        vehicle_counts[vehicle_class] = vehicle_counts.get(vehicle_class, 0) + entry_sum
-        revenue_per_class[vehicle_class] = revenue_per_class.get(vehicle_class, 0) + revenue
-
-        total_vehicles += entry_sum
-        total_revenue += revenue
-
-    return jsonify({
+    return {
         "vehicle_counts": vehicle_counts,
-        "total_vehicles": total_vehicles,
+        "total_vehicles": sum(vehicle_counts.values()),
         "revenue_per_class": revenue_per_class,
-        "total_revenue": total_revenue
-    })
-
-SUMMARY_FILE = "summary_stats.json"
-
-def read_summary_stats():
-    """Load summary_stats.json and return as dict. If file doesn't exist, return {}."""
-    if not os.path.exists(SUMMARY_FILE):
-        return {}
-    with open(SUMMARY_FILE, "r") as f:
-        return json.load(f)
-
-def write_summary_stats(stats_dict):
-    """Overwrite summary_stats.json with stats_dict."""
-    with open(SUMMARY_FILE, "w") as f:
-        json.dump(stats_dict, f, indent=2)
+        "total_revenue": sum(revenue_per_class.values())
+    }
 
-def compute_summary_for_info(json_path="info.json"):
+def compute_summary_for_frames(frames):
     """
-    Example: parse the final frame of info.json
-    and sum up vehicles/revenue by class.
+    Sum up vehicles/revenue by class from the cumulative totals of the final frame.
     """
-    if not os.path.exists(json_path):
-        return {}
-
-    with open(json_path, "r") as f:
-        data = json.load(f)
-
-    if not data:
+    if not frames:
         return {}
 
-    # Let's pick the final frame
-    final_frame = data[-1]  # or data[0], whichever is correct
+    final_frame = frames[-1]
     locations = final_frame.get("locations", {})
     totals_by_class = {}
 
     for loc_name, loc_info in locations.items():
-        by_class = loc_info["cumulative"]["by_class"]
+        by_class = loc_info.get("cumulative", {}).get("by_class", {})
         for vclass, stats in by_class.items():
             vehicles = stats.get("vehicles", 0)
             revenue = stats.get("revenue", 0)
@@ -183,7 +389,6 @@ def compute_summary_for_info(json_path="info.json"):
     return totals_by_class
 
 
-
 # Mapping interval keys to number of 10-min blocks and animation duration in seconds
 INTERVAL_CONFIG = {
     "10min":   {"blocks": 1, "duration": 3},
@@ -211,515 +416,363 @@ def realtime_series():
     except ValueError:
         return jsonify({"error": "datetime_start must be in format YYYY-MM-DD HH:MM:SS"}), 400
 
-    config = INTERVAL_CONFIG[interval_key]
-    num_blocks = config["blocks"]
-    num_frames = config["duration"]
-    block_duration = timedelta(minutes=10)
-    interval_duration = block_duration * num_blocks
-    end_time = start_time + interval_duration
-
-    # Query 10-minute blocks in range
-    rows = db.session.query(
-        TrafficEntry.vehicle_class,
-        TrafficEntry.is_peak,
-        TrafficEntry.datetime,
-        TrafficEntry.detection_group,
-        func.sum(TrafficEntry.crz_entries).label("vehicle_count")
-    ).filter(
-        TrafficEntry.datetime >= start_time.strftime("%Y-%m-%d %H:%M:%S"),
-        TrafficEntry.datetime < end_time.strftime("%Y-%m-%d %H:%M:%S")
-    ).group_by(
-        TrafficEntry.vehicle_class,
-        TrafficEntry.is_peak,
-        TrafficEntry.datetime,
-        TrafficEntry.detection_group
-    ).all()
-
-    block_map = defaultdict(lambda: defaultdict(lambda: defaultdict(lambda: {"vehicles": 0, "revenue": 0})))
-    all_block_times = set()
-
-    for vclass, is_peak, dt, location, count in rows:
-        key = (vclass, is_peak)
-        price = PRICING.get(key, 0)
-        block_map[dt][location][vclass]["vehicles"] += count
-        block_map[dt][location][vclass]["revenue"] += count * price
-        all_block_times.add(dt)
-
-    all_block_times = sorted(all_block_times)
-    blocks_per_frame = num_blocks / num_frames
-    frames = []
-
-    cumulative = defaultdict(lambda: defaultdict(lambda: {"vehicles": 0, "revenue": 0}))
-    cumulative_total = defaultdict(lambda: {"vehicles": 0, "revenue": 0})
-
-    for i in range(num_frames):
-        frame_duration = interval_duration.total_seconds() / num_frames
-        frame_start = start_time + timedelta(seconds=(i * frame_duration))
-        frame_data = {
-            "timestamp": frame_start.strftime("%Y-%m-%d %H:%M:%S"),
-            "scale": 1,
-            "locations": {}
-        }
-
-        # Always pull the block the frame overlaps with
-        block_index = int(i * blocks_per_frame)
-
-        if block_index < len(all_block_times):
-            block_time = all_block_times[block_index]
-            portion = blocks_per_frame  # portion of block assigned to each frame
-            frame_fraction = portion
-
-            for location, classes in block_map[block_time].items():
-                if location not in frame_data["locations"]:
-                    frame_data["locations"][location] = {
-                        "current": {
-                            "total_vehicles": 0,
-                            "total_revenue": 0,
-                            "by_class": {}
-                        }
-                    }
-
-                for vclass, data in classes.items():
-                    vcount = data["vehicles"] * frame_fraction
-                    vrevenue = data["revenue"] * frame_fraction
-
-                    frame_data["locations"][location]["current"]["total_vehicles"] += vcount
-                    frame_data["locations"][location]["current"]["total_revenue"] += vrevenue
-
-                    if vclass not in frame_data["locations"][location]["current"]["by_class"]:
-                        frame_data["locations"][location]["current"]["by_class"][vclass] = {"vehicles": 0, "revenue": 0}
-                    frame_data["locations"][location]["current"]["by_class"][vclass]["vehicles"] += vcount
-                    frame_data["locations"][location]["current"]["by_class"][vclass]["revenue"] += vrevenue
-
-                    cumulative[location][vclass]["vehicles"] += vcount
-                    cumulative[location][vclass]["revenue"] += vrevenue
-                    cumulative_total[location]["vehicles"] += vcount
-                    cumulative_total[location]["revenue"] += vrevenue
-
-        # Finalize cumulative and round values after updating all data
-        for location in frame_data["locations"]:
-            cumulative_by_class = {
-                vclass: {
-                    "vehicles": round(cumulative[location][vclass]["vehicles"], 2),
-                    "revenue": round(cumulative[location][vclass]["revenue"], 2)
-                } for vclass in cumulative[location]
-            }
-
-            frame_data["locations"][location]["cumulative"] = {
-                "vehicles": round(cumulative_total[location]["vehicles"], 2),
-                "revenue": round(cumulative_total[location]["revenue"], 2),
-                "by_class": cumulative_by_class
-            }
-
-            # Round current
-            curr = frame_data["locations"][location]["current"]
-            curr["total_vehicles"] = round(curr["total_vehicles"], 2)
-            curr["total_revenue"] = round(curr["total_revenue"], 2)
-            for vclass in curr["by_class"]:
-                curr_class_vehicles_round = round(curr["by_class"][vclass]["vehicles"], 2)
-                curr_class_rev_round = round(curr["by_class"][vclass]["revenue"], 2)
-                if (curr_class_vehicles_round > 0):
-                    curr_class_vehicles_round = max(curr_class_vehicles_round, 1)
-                if (curr_class_rev_round > 0):
-                    curr_class_rev_round = max(curr_class_rev_round, 1)
-                curr["by_class"][vclass]["vehicles"] = curr_class_vehicles_round
-                curr["by_class"][vclass]["revenue"] = curr_class_rev_round
-
-        frames.append(frame_data)
-
-    timestamps = find_min_vehicle_timestamp(frames)
-    with open("min_timestamps.json", "w") as f:
-        json.dump(timestamps, f, indent=2)
-
-    return jsonify(frames)
-
-def find_min_vehicle_timestamp(frames):
-    # Initialize an empty list to store the results
-    min_vehicle_timestamps = []
-
-    # Iterate through each frame in the list of frames
-    for frame in frames:
-        # Iterate through each location in the frame's data
-        for location, data in frame['locations'].items():
-            # Check if this location has been processed already
-            location_found = False
-            for entry in min_vehicle_timestamps:
-                if entry["locations"].get(location):
-                    location_found = True
-                    break
-
-            # If the location hasn't been found yet, initialize it
-            if not location_found:
-                min_vehicle_timestamps.append({
-                    "locations": {location: {"min_timestamp": None, "min_total_vehicles": float("inf")}}
-                })
-
-            # Now find the minimum vehicles for this location and frame
-            location_data = frame["locations"][location]
-            total_vehicles = location_data["current"]["total_vehicles"]
-
-            # If the total vehicles for this location is smaller than the current minimum, update the minimum and timestamp
-            for entry in min_vehicle_timestamps:
-                if location in entry["locations"]:
-                    min_location = entry["locations"][location]
-                    if total_vehicles < min_location["min_total_vehicles"]:
-                        min_location["min_total_vehicles"] = total_vehicles
-                        min_location["min_timestamp"] = frame["timestamp"]
-
-    return min_vehicle_timestamps
-
-
-def get_car_routes():
-    """
-    Return a list of route dictionaries.
-    Each dictionary has: name, start, end, duration, icon_url
-    """
-    return [
-        {
-            "name": "Lincoln Tunnel",
-            "start": [40.766708, -74.018524],
-            "end": [40.760159, -74.002774],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_135.png')
-        },
-        {
-            "name": "Brooklyn Bridge",
-            "start": [40.702210, -73.992004],
-            "end": [40.708034, -73.999334],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_315.png')
-        },
-        {
-            "name": "Williamsburg Bridge",
-            "start": [40.712044, -73.966979],
-            "end": [40.714744, -73.976249],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_315.png')
-        },
-        {
-            "name": "Manhattan Bridge",
-            "start": [40.702299, -73.987915],
-            "end": [40.709581, -73.991853],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_315.png')
-        },
-        {
-            "name": "Holland Tunnel",
-            "start": [40.728897, -74.031589],
-            "end": [40.726183, -74.011329],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_180.png')
-        },
-        {
-            "name": "Hugh L. Carey Tunnel",
-            "start": [40.685010, -74.007056],
-            "end": [40.700987, -74.015532],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_315.png')
-        },
-        {
-            "name": "Queensboro Bridge",
-            "start": [40.754783, -73.949994],
-            "end": [40.758882, -73.959143],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_0.png')
-        },
-        {
-            "name": "Queens Midtown",
-            "start": [40.74289229922877, -73.96082715665342],
-            "end": [40.747834966345074, -73.96816127996215],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_0.png')
-        },
-        {
-            "name": "West 60th",
-            "start": [40.77164541992876, -73.98306418072985],
-            "end": [40.768193524649575, -73.98565628724995],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_0.png')
-        },
-        {
-            "name": "11th Ave and 60th",
-            "start": [40.77326978935373, -73.98933771562456],
-            "end": [40.768173333383125, -73.99302066958496],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_0.png')
-        },
-        {
-            "name": "East 60th",
-            "start": [40.76328718520095, -73.96243948478009],
-            "end": [40.75937598422883, -73.96541471379228],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_0.png')
-        },
-        {
-            "name": "60th and 1st",
-            "start": [40.76444641664966, -73.95843436877433],
-            "end": [40.76103366817469, -73.96405583512909],
-            "duration": 4000,
-            "icon_url": url_for('static', filename='vehicles/car_icon_0.png')
-        }
-    ]
+    start_block = to_block(start_time, round_up=True)
+    frame_id = make_frame_id(interval_key, start_block)
+    entry = frame_store.get(frame_id)
+    if entry is None:
+        baked = prebaked.lookup(frame_id)
+        if baked is not None:
+            # Pre-baked: the gzip'd file goes out as it is
+            with metrics.phase("file_io"):
+                gzipped = prebaked.read(baked["frames"])
+            response = http_cache.gzip_response(gzipped, baked["frames"])
+            response.headers["X-Frame-Id"] = frame_id
+            return response
+        entry = frame_store.put_arrays(frame_id, compute_frame_arrays(interval_key, start_block))
+
+    response = http_cache.response(entry.body, digest=entry.digest)
+    response.headers["X-Frame-Id"] = frame_id
+    return response
+
+@app.route('/playback_stream', methods=['GET'])
+def playback_stream():
+    # The /realtime_series window as Server-Sent Events, one frame at a
+    # time at the animation's pace (see playback.py). ?cursor= (or the frame
+    # after the Last-Event-ID of a reconnect) starts later in the window, ?pace=0
+    # sends every frame at once.
+    interval_key = request.args.get("interval", "1hr")
+    start_str = request.args.get("datetime_start")
 
-def parse_info_json(json_path="info.json"):
-    """
-    Reads the JSON file (with multiple items representing time steps).
-    We ignore the 'timestamp' field and just treat each item as:
-       {
-         "locations": {
-           "Brooklyn Bridge": { "current": { "total_vehicles": ... } },
-           ...
-         },
-         "scale": ... (maybe ignored)
-       }
-    We'll return a list of dicts of the form:
-       {
-         "index": i, # i is the iteration
-         "locations": {
-            "Brooklyn Bridge": 138,
-            "East 60th St": 312,
-            ...
-         }
-       }
-    """
-    with open(json_path, "r") as f:
-        data = json.load(f)
+    if not start_str or interval_key not in INTERVAL_CONFIG:
+        return jsonify({"error": "Missing or invalid datetime_start or interval"}), 400
 
-    results = []
-    for i, time_step in enumerate(data):
-        # time_step["locations"] is a dict of location_name -> detail
-        location_dict = time_step.get("locations", {})
-        step_info = {"index": i, "locations": {}}
-
-        for loc_name, loc_data in location_dict.items():
-            # The "current" portion has "total_vehicles"
-            vehicles_float = loc_data["current"]["total_vehicles"]
-            # Round or floor the float
-            vehicles_count = int(math.floor(vehicles_float)/10)
-            step_info["locations"][loc_name] = vehicles_count
+    try:
+        start_time = datetime.strptime(start_str, "%Y-%m-%d %H:%M:%S")
+        # A reconnecting EventSource resends its URL, cursor and all
+        if request.headers.get("Last-Event-ID"):
+            cursor = int(request.headers["Last-Event-ID"]) + 1
+        else:
+            cursor = int(request.args.get("cursor", 0))
+    except ValueError:
+        return jsonify({"error": "datetime_start must be in format YYYY-MM-DD HH:MM:SS, cursor a frame number"}), 400
 
-        results.append(step_info)
-    return results
+    config = INTERVAL_CONFIG[interval_key]
+    if not 0 <= cursor <= config["duration"]:
+        return jsonify({"error": f"cursor must be between 0 and {config['duration']}"}), 400
+
+    start_block = to_block(start_time, round_up=True)
+    # The session is left alone: the page's frames on reload stay the last
+    # window saved through /save_timestep, not a long one meant to be streamed
+    frame_id = make_frame_id(interval_key, start_block)
+    events = stream_events(
+        playback_frame_source(interval_key, start_block),
+        config["duration"],
+        window_timestamps(from_block(start_block), config["blocks"], config["duration"]),
+        RouteTable(route_registry, VEHICLE_CLASSES),
+        VEHICLE_CLASSES,
+        cursor=cursor,
+        speed=4000,
+        spawn_window=20000,
+        step_delay=2000,
+        pace=request.args.get("pace") != "0"
+    )
+    response = Response(stream_with_context(events), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.headers["X-Frame-Id"] = frame_id
+    return response
 
-def get_route_for_location(loc_name):
+def playback_frame_source(interval_key, start_block):
     """
-    Match the location name to a route from get_car_routes().
-    Return None if not found.
+    frame index -> (FrameArrays, index inside them) for /playback_stream.
+    Windows already in the frame store or pre-baked, and the short ones with
+    fewer blocks than frames, are sliced from their whole FrameArrays; the
+    others query just the blocks of the frame asked for.
     """
-    for r in get_car_routes():
-        if r["name"] == loc_name:
-            return r
-    return None
-
-
-@app.route("/save_timestep", methods=["POST"])
-def save_timestep():
-    data = request.get_json()
-
-    # 1) Write frames_data to info.json
-    frames_data = data.get("frames_data", [])
-    with open("info.json", "w") as f:
-        json.dump(frames_data, f, indent=2)
+    config = INTERVAL_CONFIG[interval_key]
+    num_blocks = config["blocks"]
+    num_frames = config["duration"]
+    frame_id = make_frame_id(interval_key, start_block)
+
+    entry = frame_store.get(frame_id)
+    if entry is None and (num_blocks < num_frames or prebaked.lookup(frame_id) is not None):
+        entry = load_frame_entry(frame_id)
+    if entry is not None:
+        arrays = entry.arrays
+        return lambda index: (arrays, index)
+
+    ranges = frame_block_ranges(start_block, num_blocks, num_frames)
+
+    def frame(index):
+        first, stop = ranges[index]
+        with metrics.phase("query"):
+            rows = storage.frame_rows(first, stop - first, 1)
+            prices = storage.class_prices()
+        with metrics.phase("aggregate"):
+            return build_bucketed_frame_arrays(rows, prices, from_block(first), stop - first, 1), 0
+    return frame
+
+def compute_frame_arrays(interval_key, start_block):
+    """Query the window and build its FrameArrays (the /realtime_series payload before JSON)."""
+    config = INTERVAL_CONFIG[interval_key]
+    num_blocks = config["blocks"]
+    num_frames = config["duration"]
 
-    chosen_vehicle = data.get("chosen_vehicle", "Car")
-    global SELECTED_CLASS
-    SELECTED_CLASS = chosen_vehicle
+    # Windows with at least one block per frame come back bucketed, one
+    # row per frame x location x class x peak flag
+    with metrics.phase("query"):
+        rows = storage.frame_rows(start_block, num_blocks, num_frames)
+        prices = storage.class_prices()
 
-    # 2) Now that info.json is updated, compute new summary
-    new_summary = compute_summary_for_info("info.json")
+    with metrics.phase("aggregate"):
+        if num_blocks >= num_frames:
+            return build_bucketed_frame_arrays(rows, prices, from_block(start_block), num_blocks, num_frames)
+        return build_frame_arrays(rows, prices, from_block(start_block), start_block, num_blocks, num_frames)
 
-    # 3) Save that summary to summary_stats.json
-    write_summary_stats(new_summary)
+def load_frame_entry(frame_id):
+    """
+    Frames for frame_id from the frame store. Windows this process hasn't
+    computed yet are rebuilt from the id; returns None for unknown ids.
+    """
+    if not frame_id:
+        return None
+
+    entry = frame_store.get(frame_id)
+    if entry is not None:
+        return entry
+
+    if frame_id == DEFAULT_FRAME_ID:
+        # The frames shipped in info.json, shown until a window is submitted
+        with metrics.phase("file_io"), open("info.json", "r") as f:
+            frames = json.load(f)
+        return frame_store.put(frame_id, frames)
+
+    baked = prebaked.lookup(frame_id)
+    if baked is not None:
+        with metrics.phase("file_io"):
+            entry = frame_store.put(frame_id, prebaked.load(baked["frames"]))
+            entry.derived["summary"] = prebaked.load(baked["summary"])
+            entry.derived["spawn_bundle"] = prebaked.load(baked["bundle"])
+        return entry
+
+    if frame_id.startswith(UPLOAD_PREFIX):
+        # Uploaded by a client, possibly to another worker
+        with metrics.phase("file_io"):
+            frames = load_upload(frame_id)
+        return frame_store.put(frame_id, frames) if frames is not None else None
+
+    parsed = parse_frame_id(frame_id)
+    if parsed is None or parsed[0] not in INTERVAL_CONFIG:
+        return None
+    return frame_store.put_arrays(frame_id, compute_frame_arrays(*parsed))
+
+UPLOAD_PREFIX = "upload:"
+
+def save_upload(frames_data):
+    """
+    Keep uploaded frames under instance/uploads, named by their content hash,
+    so every worker can load them by frame_id. Returns the frame_id.
+    """
+    body = json.dumps(frames_data, sort_keys=True)
+    digest = hashlib.sha1(body.encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(UPLOAD_DIR, f"{digest}.json")
+    if os.path.exists(path):
+        # Uploaded again, so it's among the last to be pruned
+        os.utime(path)
+    else:
+        with metrics.phase("file_io"):
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+            prune_uploads(app.config['MAX_UPLOADS'])
+    return UPLOAD_PREFIX + digest
+
+def prune_uploads(max_uploads):
+    """Delete the least recently uploaded files beyond the newest max_uploads."""
+    paths = [os.path.join(UPLOAD_DIR, name) for name in os.listdir(UPLOAD_DIR) if name.endswith(".json")]
+    if len(paths) <= max_uploads:
+        return
+    by_age = []
+    for path in paths:
+        try:
+            by_age.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            pass  # pruned by another worker
+    for _, path in sorted(by_age)[:len(by_age) - max_uploads]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def load_upload(frame_id):
+    digest = frame_id[len(UPLOAD_PREFIX):]
+    if not digest.isalnum():
+        return None
+    try:
+        with open(os.path.join(UPLOAD_DIR, f"{digest}.json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def current_frame_id():
+    """?frame_id= if given, else the frames this client last saved."""
+    return request.args.get("frame_id") or session.get("frame_id", DEFAULT_FRAME_ID)
+
+def current_vehicle_class():
+    """?vehicle= if given, else the class this client last chose."""
+    return request.args.get("vehicle") or session.get("vehicle", DEFAULT_CLASS)
+
+def summary_for_entry(entry):
+    if "summary" not in entry.derived:
+        entry.derived["summary"] = compute_window_summary(entry.frame_id)
+        if entry.derived["summary"] is None:
+            # Uploaded or default frames, sum up their final frame
+            entry.derived["summary"] = compute_summary_for_frames(entry.frames)
+    return entry.derived["summary"]
+
+def compute_window_summary(frame_id):
+    """Per-class totals for a /realtime_series window straight from the cube, or None."""
+    parsed = parse_frame_id(frame_id)
+    cube = aggregate_cube.get() if parsed else None
+    if cube is None or parsed[0] not in INTERVAL_CONFIG:
+        return None
+    interval_key, start_block = parsed
+    vehicle_counts, revenue_per_class = cube.class_totals(
+        start_block, start_block + INTERVAL_CONFIG[interval_key]["blocks"]
+    )
+    return {
+        vclass: {"vehicles": vehicle_counts[vclass], "revenue": revenue_per_class[vclass]}
+        for vclass in vehicle_counts
+    }
 
-    return jsonify({"status": "success", "message": "Data saved"}), 200
+def spawn_bundle_for_entry(entry):
+    if "spawn_bundle" not in entry.derived:
+        with metrics.phase("spawns"):
+            entry.derived["spawn_bundle"] = build_spawn_bundle(
+                entry.frames,
+                route_registry,
+                VEHICLE_CLASSES,
+                speed=4000,
+                spawn_window=20000,
+                step_delay=2000
+            )
+    return entry.derived["spawn_bundle"]
 
+def extremes_for_entry(entry):
+    if "extremes" not in entry.derived:
+        entry.derived["extremes"] = frame_extremes(entry.arrays)
+    return entry.derived["extremes"]
 
-def build_spawn_js_from_timestepdata(timestep_data, speed=2000, spawn_window=5000, step_delay=2000):
+@app.route('/extremes', methods=['GET'])
+def get_extremes():
     """
-    Spawns each time step's cars over 'spawn_window' ms (e.g. 5000 = 5s),
-    then waits 'step_delay' ms before starting the next time step.
-
-    So the total time between step i and step i+1 = spawn_window + step_delay.
-
-    :param timestep_data: [
-      { "index": 0, "locations": {"Brooklyn Bridge": 20, ...} },
-      { "index": 1, "locations": {...} },
-      ...
-    ]
-    :param speed: ms each car takes to traverse its route
-    :param spawn_window: ms to spread out the spawns in a single time step
-    :param step_delay: ms to wait *after* finishing a step's spawns, before next step starts
+    ?frame_id=... : min/max/percentiles and quietest/busiest frames of a computed window.
+    Otherwise the k quietest (or ?mode=busiest) windows of ?window= length
+    between datetime_start and datetime_end, optionally for one
+    detection_group and/or vehicle_class.
     """
+    frame_id = request.args.get("frame_id")
+    if frame_id:
+        entry = load_frame_entry(frame_id)
+        if entry is None:
+            return jsonify({"error": "Unknown frame_id"}), 404
+        return jsonify(extremes_for_entry(entry))
+
+    window_key = request.args.get("window", "1hr")
+    datetime_start = request.args.get("datetime_start")
+    datetime_end = request.args.get("datetime_end")
+    detection_group = request.args.get("detection_group") or None
+    vehicle_class = request.args.get("vehicle_class") or None
+    mode = request.args.get("mode", "quietest")
+
+    if window_key not in INTERVAL_CONFIG or not datetime_start or not datetime_end \
+            or mode not in ("quietest", "busiest"):
+        return jsonify({"error": "datetime_start, datetime_end, a valid window and mode are required"}), 400
+    try:
+        start_block = to_block(datetime_start, round_up=True)
+        end_block = to_block(datetime_end, round_up=True)
+        k = int(request.args.get("k", 5))
+        if k < 1:
+            raise ValueError(k)
+    except ValueError:
+        return jsonify({"error": "Invalid datetime or k (a whole number of at least 1)"}), 400
 
-    lines = []
-    # total real-time length per step
-    total_step_time = spawn_window + step_delay
+    cube = aggregate_cube.get()
+    if cube is None:
+        return jsonify({"windows": [], "blocks": {}})
+    if (detection_group and detection_group not in cube.groups) or \
+            (vehicle_class and vehicle_class not in cube.classes):
+        return jsonify({"error": "Unknown detection_group or vehicle_class"}), 400
 
-    for step_info in timestep_data:
-        step_index = step_info["index"]
-        locations = step_info["locations"]
-        # Offset for this step in real-time
-        # e.g. if step_index=0 => offset=0, step_index=1 => offset=1*(spawn_window+step_delay)=7000, etc.
-        offset_for_step = step_index * total_step_time
-        for loc_name, vehicle_count in locations.items():
-            route = get_route_for_location(loc_name)
-            if not route or vehicle_count <= 0:
-                continue
+    window_blocks = INTERVAL_CONFIG[window_key]["blocks"]
+    return jsonify({
+        "windows": extreme_windows(cube, window_blocks, start_block, end_block,
+                                   detection_group, vehicle_class, k=k, busiest=mode == "busiest"),
+        "blocks": series_summary(cube, start_block, end_block, detection_group, vehicle_class),
+    })
 
-            # Spread out spawns in this step over 'spawn_window'
-            # If multiple cars, each is spaced: spawn_window/(vehicle_count - 1) if >1
-            if vehicle_count > 1:
-                delay_per_car = float(spawn_window) / (vehicle_count - 1)
-            else:
-                delay_per_car = 0
 
-            for c in range(vehicle_count):
-                # each car spawns between offset_for_step and offset_for_step+spawn_window
-                spawn_time = int(offset_for_step + c * delay_per_car)
+@app.route("/save_timestep", methods=["POST"])
+def save_timestep():
+    data = request.get_json(silent=True) or {}
 
-                line = (
-                    f"setTimeout(function() {{ "
-                    f"addCar([{route['start'][0]}, {route['start'][1]}], "
-                    f"[{route['end'][0]}, {route['end'][1]}], "
-                    f"{speed}, "
-                    f"'{route['icon_url']}'); "
-                    f"}}, {spawn_time});"
-                )
-                lines.append(line)
+    # 1) Find the frames: normally by the id /realtime_series returned,
+    #    older clients still upload the frames themselves.
+    frame_id = data.get("frame_id")
+    if frame_id is None and "frames_data" in data:
+        frames_data = data["frames_data"]
+        if not isinstance(frames_data, list):
+            return jsonify({"status": "error", "message": "frames_data must be a list of frames"}), 400
+        if len(frames_data) > app.config['MAX_UPLOAD_FRAMES']:
+            return jsonify({"status": "error",
+                            "message": f"At most {app.config['MAX_UPLOAD_FRAMES']} frames per upload"}), 413
+        frame_id = save_upload(frames_data)
+    if not frame_id:
+        return jsonify({"status": "error", "message": "frame_id or frames_data is required"}), 400
 
-    return "\n".join(lines)
+    entry = load_frame_entry(frame_id)
+    if entry is None:
+        return jsonify({"status": "error", "message": "Unknown frame_id"}), 404
 
+    # Remembered per client (signed session cookie), not per process
+    session["vehicle"] = data.get("chosen_vehicle", DEFAULT_CLASS)
+    session["frame_id"] = frame_id
 
+    # 2) Summary is computed once per frame set and kept with it
+    summary = summary_for_entry(entry)
+
+    return jsonify({"status": "success", "message": "Data saved", "frame_id": frame_id, "summary": summary}), 200
 
-###############################################################
-# 1) Hardcode which vehicle class to show, e.g. "Car" or "Taxi"
-###############################################################
-SELECTED_CLASS = "Car"  # e.g. "Car", "Taxi", "Buses", etc.
 
 #####################################
-# 2) Define route definitions
-#    but route icons depend on SELECTED_CLASS.
+# 1) Route definitions for every class, built once at startup
 #####################################
-def get_car_routes():
-    """
-    Each route uses the SELECTED_CLASS to pick its icon filename.
-    Make sure you actually have, e.g. car_icon_135.png, taxi_icon_135.png, etc.
-    """
-    class_lower = SELECTED_CLASS.lower()
-    return [
-        {
-            "name": "Lincoln Tunnel",
-            "start": [40.766708, -74.018524],
-            "end": [40.760159, -74.002774],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_135.png')
-        },
-        {
-            "name": "Brooklyn Bridge",
-            "start": [40.702210, -73.992004],
-            "end": [40.708034, -73.999334],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_315.png')
-        },
-        {
-            "name": "Williamsburg Bridge",
-            "start": [40.712044, -73.966979],
-            "end": [40.714744, -73.976249],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_337.png')
-        },
-        {
-            "name": "Manhattan Bridge",
-            "start": [40.702299, -73.987915],
-            "end": [40.709581, -73.991853],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_292.png')
-        },
-        {
-            "name": "Holland Tunnel",
-            "start": [40.728897, -74.031589],
-            "end": [40.726183, -74.011329],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_180.png')
-        },
-        {
-            "name": "Hugh L. Carey Tunnel",
-            "start": [40.685010, -74.007056],
-            "end": [40.700987, -74.015532],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_292.png')
-        },
-        {
-            "name": "Queensboro Bridge",
-            "start": [40.754783, -73.949994],
-            "end": [40.758882, -73.959143],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_337.png')
-        },
-        {
-            "name": "Queens Midtown Tunnel",
-            "start": [40.74289229922877, -73.96082715665342],
-            "end": [40.747834966345074, -73.96816127996215],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_337.png')
-        },
-        {
-            "name": "West 60th St",
-            "start": [40.77164541992876, -73.98306418072985],
-            "end": [40.768193524649575, -73.98565628724995],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_45.png')
-        },
-        {
-            "name": "FDR Drive at 60th St",
-            "start": [40.765785223608674, -73.95748405831618],
-            "end": [40.76275029301429, -73.95971426811401],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_45.png')
-        },
-        {
-            "name": "East 60th St",
-            "start": [40.76328718520095, -73.96243948478009],
-            "end": [40.75937598422883, -73.96541471379228],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_45.png')
-        },
-        {
-            "name": "West Side Highway at 60th St",
-            "start": [40.77321742695657, -73.98939439202347],
-            "end": [40.77019877213487, -73.99163134442664],
-            "duration": 4000,
-            "icon_url": url_for('static', filename=f'vehicles/{class_lower}_icon_45.png')
-        }
-    ]
+with app.test_request_context():
+    route_registry = RouteRegistry(lambda filename: url_for('static', filename=filename))
 
-def get_route_for_location(loc_name):
-    for r in get_car_routes():
-        if r["name"] == loc_name:
-            return r
-    return None
+def get_route_for_location(loc_name, vehicle_class=DEFAULT_CLASS):
+    return route_registry.get(vehicle_class, loc_name)
 
 #########################################################
-# 3) Parse JSON but only keep the selected vehicle class
+# 2) Parse JSON but only keep the selected vehicle class
 #########################################################
-def parse_info_json(json_path="info.json"):
+def parse_frames(frames, vehicle_class=DEFAULT_CLASS):
     """
-    We'll read each time step's 'by_class', but only keep SELECTED_CLASS vehicles.
+    We'll read each time step's 'by_class', but only keep vehicle_class vehicles.
     e.g. "Car" => read by_class["Car"]["vehicles"] -> spawn that many
     """
-    with open(json_path, "r") as f:
-        data = json.load(f)
-
     results = []
-    for i, time_step in enumerate(data):
+    for i, time_step in enumerate(frames):
         step_info = {"index": i, "vehicles": [],"timestep": time_step["timestamp"]}
         locations = time_step.get("locations", {})
 
         for loc_name, loc_data in locations.items():
             by_class = loc_data["current"].get("by_class", {})
             # If the selected class is in by_class for that location:
-            if SELECTED_CLASS in by_class:
-                vehicles_float = by_class[SELECTED_CLASS]["vehicles"]
+            if vehicle_class in by_class:
+                vehicles_float = by_class[vehicle_class]["vehicles"]
                 vehicle_count = int(math.floor(vehicles_float))  # or round
                 if vehicle_count > 0:
                     step_info["vehicles"].append({
@@ -729,12 +782,18 @@ def parse_info_json(json_path="info.json"):
         results.append(step_info)
     return results
 
+def parse_info_json(json_path="info.json", vehicle_class=DEFAULT_CLASS):
+    """parse_frames() for frames saved to a JSON file."""
+    with open(json_path, "r") as f:
+        return parse_frames(json.load(f), vehicle_class)
+
 ###############################################################
-# 4) Build JS spawns, ignoring other classes
+# 3) Build JS spawns, ignoring other classes
 ###############################################################
-def build_spawn_js_from_timestepdata(timestep_data, speed=2000, spawn_window=20000, step_delay=2000):
+def build_spawn_js_from_timestepdata(timestep_data, vehicle_class=DEFAULT_CLASS, speed=2000,
+                                     spawn_window=20000, step_delay=2000):
     """
-    We'll spawn only SELECTED_CLASS vehicles (already filtered in parse_info_json).
+    We'll spawn only vehicle_class vehicles (already filtered in parse_frames).
     Each step spawns them over 'spawn_window' ms,
     then we wait 'step_delay' before the next step.
     """
@@ -749,11 +808,11 @@ def build_spawn_js_from_timestepdata(timestep_data, speed=2000, spawn_window=200
         for item in vehicles_list:
             loc_name = item["location"]
             count = item["count"]
-            route = get_route_for_location(loc_name)
+            route = get_route_for_location(loc_name, vehicle_class)
             if not route or count <= 0:
                 continue
 
-            # route["icon_url"] was built from SELECTED_CLASS, so let's just use that
+            # route["icon_url"] was built from vehicle_class, so let's just use that
             icon_path = route["icon_url"]
 
             # Spread out spawns in spawn_window
@@ -781,78 +840,42 @@ def build_spawn_js_from_timestepdata(timestep_data, speed=2000, spawn_window=200
     return "\n".join(lines)
 
 ###############################################################
-# 5) get_image_url for static location markers
+# 4) Base map and static location markers, rendered once
 ###############################################################
-def get_image_url(name):
-    folder = "entry_images"
-    file_path = os.path.join(app.static_folder, folder, f"{name}.jpg")
-    if os.path.exists(file_path):
-        return url_for('static', filename=f"{folder}/{name}.jpg")
-    return url_for('static', filename="images/location.png")
+base_map_cache = BaseMapCache(app.static_folder)
 
 @app.route('/')
 def index():
-    # 1) read summary
-    summary_data = read_summary_stats()
-
-    # 2) Create the Folium map, parse info.json, build spawns, etc.
-    manhattan_coords = [40.7381, -73.9712]
-    m = folium.Map(location=manhattan_coords, zoom_start=13, tiles='CartoDB positron')
-    Fullscreen(position='topright').add_to(m)
-    folium.LayerControl().add_to(m)
-
-    # 2) Add static location markers
-    location_coords = {
-        "Brooklyn Bridge": [40.7061, -73.9969],
-        "West Side Highway at 60th St": [40.7713, -73.9902],
-        "West 60th St": [40.7700, -73.9836],
-        "Queensboro Bridge": [40.7570, -73.9544],
-        "Queens Midtown Tunnel": [40.7433, -73.9698],
-        "Lincoln Tunnel": [40.7608, -74.0021],
-        "Holland Tunnel": [40.7260, -74.0086],
-        "FDR Drive at 60th St": [40.7626, -73.9585],
-        "East 60th St": [40.7616, -73.9641],
-        "Williamsburg Bridge": [40.7132, -73.9712],
-        "Manhattan Bridge": [40.7075, -73.9903],
-        "Hugh L. Carey Tunnel": [40.7003, -74.0132]
-    }
-    marker_data = []
-    for name, coords in location_coords.items():
-        marker_data.append({
-            "name": name,
-            "lat": coords[0],
-            "lon": coords[1],
-            "img_url": get_image_url(name)
-        })
-    marker_data_json = json.dumps(marker_data)
-
-    # Parse the JSON to get only SELECTED_CLASS
-    all_timestep_data = parse_info_json("info.json")
-
-    # Build the JS snippet
-    selected_car_js = build_spawn_js_from_timestepdata(
-        timestep_data=all_timestep_data,
-        speed=4000,
-        spawn_window=20000,
-        step_delay=2000
-    )
-
-    # Render
-    map_name = m.get_name()
-    map_html = m.get_root().render()
-    
-    min_data = []
-    with open("min_timestamps.json", "r") as f:
-        min_data = json.load(f)
-    return render_template(
-        'index.html',
-        map_html=map_html,
-        map_name=map_name,
-        marker_data_json=marker_data_json,
-        selected_car_js=selected_car_js,
-        summary_data=summary_data,
-        min_data=min_data
-    )
+    # 1) frames the client last saved (or an explicit ?frame_id=), and their summary
+    entry = load_frame_entry(current_frame_id())
+    if entry is None:
+        entry = load_frame_entry(DEFAULT_FRAME_ID)
+    summary_data = summary_for_entry(entry)
+
+    # 2) Folium map and static location markers come from the cache,
+    #    only the spawns below depend on the request
+    base_map = base_map_cache.get(lambda filename: url_for('static', filename=filename))
+
+    # Schedules for every class, cached with the frames; the page plays the
+    # client's class and swaps locally when another one is picked
+    vehicle_class = current_vehicle_class()
+    if vehicle_class not in VEHICLE_CLASSES:
+        vehicle_class = DEFAULT_CLASS
+    spawn_bundle = spawn_bundle_for_entry(entry)
+    extremes = extremes_for_entry(entry)
+
+    with metrics.phase("render"):
+        return render_template(
+            'index.html',
+            map_html=base_map["map_html"],
+            map_name=base_map["map_name"],
+            marker_data_json=base_map["marker_data_json"],
+            spawn_bundle=spawn_bundle,
+            vehicle_class=vehicle_class,
+            summary_data=summary_data,
+            extremes=extremes,
+            data_version=data_version.version
+        )
 
 if __name__ == '__main__':
     with app.app_context():
@@ -862,5 +885,10 @@ if __name__ == '__main__':
             load_data_from_csv('cleaned_data.csv')
         else:
             print("Database exists. Skipping CSV import.")
+            upgrade_traffic_db(db.engine)
+        # Append any new days waiting in the drop directory
+        ingest_drop_directory(DROP_DIR, db.engine)
+        # Load (or build) the aggregate cube before the first request needs it
+        aggregate_cube.get()
     app.run(debug=True)
 
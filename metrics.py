@@ -0,0 +1,202 @@
+"""
+Request, phase and SQL instrumentation, exposed in Prometheus text format.
+
+metrics.init_app(app) times every request per route and records the response
+size. It also counts and times every SQL statement through SQLAlchemy cursor
+events, and serves everything at /metrics. Code that wants a finer breakdown
+wraps its steps in metrics.phase("query"), metrics.phase("serialize") and so
+on. With SERVER_TIMING enabled, each response also carries its phases in a
+Server-Timing header, so a slow /realtime_series can be read off the browser's
+network panel.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, request, has_request_context, current_app, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2)
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[-1] if series else 0
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, bucket_count in zip(self.buckets, series):
+                    labels = _format_labels(self.labels, label_values, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = _format_labels(self.labels, label_values, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {series[-1]}")
+                labels = _format_labels(self.labels, label_values)
+                lines.append(f"{self.name}_sum{labels} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{labels} {series[-1]}")
+        return lines
+
+
+def _current_route():
+    if not has_request_context():
+        return "-"
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+class Metrics:
+    def __init__(self):
+        self.request_duration = Histogram(
+            "http_request_duration_seconds", "Request latency by route.",
+            labels=("route", "method", "status"))
+        self.response_bytes = Histogram(
+            "http_response_size_bytes", "Response body size by route.",
+            labels=("route",), buckets=SIZE_BUCKETS)
+        self.phase_duration = Histogram(
+            "phase_duration_seconds", "Time spent per phase (query, aggregate, serialize, file_io, ...).",
+            labels=("route", "phase"))
+        self.sql_duration = Histogram(
+            "sql_statement_duration_seconds", "SQL statement execution time by route.",
+            labels=("route",))
+        self.sql_statements = Counter(
+            "sql_statements_total", "SQL statements executed by route.", labels=("route",))
+        self._collectors = [self.request_duration, self.response_bytes, self.phase_duration,
+                            self.sql_duration, self.sql_statements]
+
+    def init_app(self, app):
+        app.config.setdefault("SERVER_TIMING", False)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+        if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            event.listen(Engine, "handle_error", _handle_error)
+
+    @contextmanager
+    def phase(self, name):
+        """Time a block of work as phase `name` of the current request (or "-" outside one)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record_phase(name, time.perf_counter() - started)
+
+    def _record_phase(self, name, seconds):
+        self.phase_duration.observe(seconds, _current_route(), name)
+        if has_request_context() and hasattr(g, "metrics_phases"):
+            g.metrics_phases[name] = g.metrics_phases.get(name, 0.0) + seconds
+
+    def _record_sql(self, seconds):
+        route = _current_route()
+        self.sql_duration.observe(seconds, route)
+        self.sql_statements.inc(route)
+        if has_request_context() and hasattr(g, "metrics_phases"):
+            g.metrics_sql_statements += 1
+            g.metrics_sql_seconds += seconds
+
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_phases = {}
+        g.metrics_sql_statements = 0
+        g.metrics_sql_seconds = 0.0
+
+    def _finish_request(self, response):
+        if not hasattr(g, "metrics_started"):
+            return response
+        elapsed = time.perf_counter() - g.metrics_started
+        route = _current_route()
+        self.request_duration.observe(elapsed, route, request.method, response.status_code)
+        if response.content_length is not None:
+            self.response_bytes.observe(response.content_length, route)
+
+        if current_app.config["SERVER_TIMING"]:
+            timings = [f"{name};dur={seconds * 1000:.2f}" for name, seconds in g.metrics_phases.items()]
+            timings.append(f'sql;dur={g.metrics_sql_seconds * 1000:.2f};desc="{g.metrics_sql_statements} statements"')
+            timings.append(f"total;dur={elapsed * 1000:.2f}")
+            response.headers["Server-Timing"] = ", ".join(timings)
+        return response
+
+    def render(self):
+        lines = []
+        for collector in self._collectors:
+            lines.extend(collector.render())
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+
+metrics = Metrics()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("metrics_query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["metrics_query_start"].pop()
+    metrics._record_sql(time.perf_counter() - started)
+
+
+def _handle_error(exception_context):
+    # after_cursor_execute doesn't run for failed statements
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("metrics_query_start"):
+        conn.info["metrics_query_start"].pop()
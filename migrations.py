@@ -0,0 +1,101 @@
+"""
+Bring an existing traffic.db up to the current schema in models.py.
+
+Missing tables are created as-is. Databases created before TrafficEntry had a
+block column only store the datetime string; upgrade_traffic_db() adds the
+column, backfills it from the string in a single UPDATE and builds the
+composite indexes, so old files keep working without re-importing the CSV.
+
+Databases that still store vehicle_class and detection_group as strings get
+the dimension tables seeded and traffic_entry rebuilt with their integer
+codes, then a VACUUM to hand the space of the old strings back. Empty
+hourly and daily rollup tables are filled from traffic_entry.
+
+    python migrations.py            # upgrades instance/traffic.db
+"""
+from dimensions import seed_dimensions
+from models import db, TrafficEntry, VehicleClass, DetectionGroup, BLOCK_SECONDS
+from rollups import refresh_rollups, rollups_empty
+
+
+def _column_names(conn, table_name):
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table_name})")}
+
+
+def _encode_dimensions(conn, table):
+    """Rebuild a string-column traffic_entry with class and group codes."""
+    print("Encoding vehicle_class and detection_group as dimension codes...")
+    for dimension, column in ((VehicleClass, "vehicle_class"), (DetectionGroup, "detection_group")):
+        dim = dimension.__tablename__
+        conn.exec_driver_sql(
+            f"INSERT INTO {dim} (code, name) "
+            f"SELECT (SELECT COALESCE(MAX(code), -1) FROM {dim}) + ROW_NUMBER() OVER (ORDER BY {column}), {column} "
+            f"FROM (SELECT DISTINCT {column} FROM {table.name} "
+            f"WHERE {column} IS NOT NULL AND {column} NOT IN (SELECT name FROM {dim}))"
+        )
+
+    old_name = f"{table.name}_strings"
+    for index in table.indexes:
+        conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+    conn.exec_driver_sql(f"ALTER TABLE {table.name} RENAME TO {old_name}")
+    table.create(bind=conn)
+    for index in table.indexes:
+        conn.exec_driver_sql(f"DROP INDEX {index.name}")
+    conn.exec_driver_sql(
+        f"INSERT INTO {table.name} "
+        f"(id, datetime, block, is_peak, class_code, group_code, crz_entries, excluded_roadway_entries) "
+        f"SELECT t.id, t.datetime, t.block, t.is_peak, c.code, g.code, t.crz_entries, t.excluded_roadway_entries "
+        f"FROM {old_name} t "
+        f"LEFT JOIN {VehicleClass.__tablename__} c ON c.name = t.vehicle_class "
+        f"LEFT JOIN {DetectionGroup.__tablename__} g ON g.name = t.detection_group"
+    )
+    conn.exec_driver_sql(f"DROP TABLE {old_name}")
+
+
+def upgrade_traffic_db(engine):
+    """
+    Create missing tables, add and backfill TrafficEntry.block, encode the
+    dimension columns and build the indexes. Safe to re-run.
+    """
+    table = TrafficEntry.__table__
+    db.metadata.create_all(bind=engine)
+
+    with engine.begin() as conn:
+        seed_dimensions(conn)
+        columns = _column_names(conn, table.name)
+        if 'block' not in columns:
+            print("Adding block column to traffic_entry...")
+            conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN block INTEGER")
+
+        conn.exec_driver_sql(
+            f"UPDATE {table.name} "
+            f"SET block = CAST(strftime('%s', datetime) AS INTEGER) / {BLOCK_SECONDS} "
+            f"WHERE block IS NULL"
+        )
+
+        encoded = 'class_code' not in columns
+        if encoded:
+            _encode_dimensions(conn, table)
+
+        if rollups_empty(conn):
+            print("Building hourly and daily rollups...")
+            refresh_rollups(conn)
+
+    for index in table.indexes:
+        index.create(bind=engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        # Refresh planner statistics so the new indexes are actually picked.
+        conn.exec_driver_sql("ANALYZE")
+
+    if encoded:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.exec_driver_sql("VACUUM")
+
+
+if __name__ == '__main__':
+    from main import app
+
+    with app.app_context():
+        upgrade_traffic_db(db.engine)
+        print("traffic.db is up to date.")
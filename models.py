@@ -1,12 +1,192 @@
+import calendar
+import math
+from datetime import datetime as _datetime, timedelta
+
 from flask_sqlalchemy import SQLAlchemy
 
 db = SQLAlchemy()
 
+# TrafficEntry rows are 10-minute aggregates, so time is stored as a block
+# number: seconds since the Unix epoch (timestamps treated as UTC, the same
+# way SQLite's strftime('%s', ...) does) divided by BLOCK_SECONDS.
+BLOCK_SECONDS = 600
+_EPOCH = _datetime(1970, 1, 1)
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_block(value, round_up=False):
+    """
+    Convert a datetime (or an ISO string like '2025-03-12 00:00:00') to its
+    10-minute block number. With round_up=True a timestamp that falls inside
+    a block maps to the next one, which is what '>=' range bounds need.
+    """
+    if isinstance(value, str):
+        value = _datetime.fromisoformat(value)
+    seconds = calendar.timegm(value.timetuple())
+    if round_up:
+        return math.ceil(seconds / BLOCK_SECONDS)
+    return seconds // BLOCK_SECONDS
+
+
+def from_block(block):
+    """Inverse of to_block: the naive datetime at the start of a block."""
+    return _EPOCH + timedelta(seconds=int(block) * BLOCK_SECONDS)
+
+
+class VehicleClass(db.Model):
+    """Vehicle class dimension with its toll; traffic_entry refers to it by code."""
+    code = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    off_peak_price = db.Column(db.Float, nullable=False, server_default="0")
+    peak_price = db.Column(db.Float, nullable=False, server_default="0")
+
+
+class DetectionGroup(db.Model):
+    """Entry point dimension with its map marker and direction of travel."""
+    code = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    heading = db.Column(db.Integer)
+
+
 class TrafficEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     datetime = db.Column(db.String(100))
+    block = db.Column(db.Integer)
     is_peak = db.Column(db.Integer)
-    vehicle_class = db.Column(db.String(50))
-    detection_group = db.Column(db.String(50))
+    class_code = db.Column(db.Integer, db.ForeignKey('vehicle_class.code'))
+    group_code = db.Column(db.Integer, db.ForeignKey('detection_group.code'))
     crz_entries = db.Column(db.Integer)
-    excluded_roadway_entries = db.Column(db.Integer)
\ No newline at end of file
+    excluded_roadway_entries = db.Column(db.Integer)
+
+    # Both indexes carry every column the range aggregations read, so SQLite
+    # answers /filter and /realtime_series from the index alone.
+    __table_args__ = (
+        db.Index('ix_traffic_block_group_class',
+                 'block', 'group_code', 'class_code', 'is_peak', 'crz_entries'),
+        db.Index('ix_traffic_group_class_block',
+                 'group_code', 'class_code', 'block', 'is_peak', 'crz_entries'),
+        # Entries are ordered by (block, rowid): /export's keyset order
+        db.Index('ix_traffic_block', 'block'),
+    )
+
+
+class _RollupColumns:
+    # period is the hour (block // 6) or day (block // 144) number
+    period = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    group_code = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    class_code = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    is_peak = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    crz_entries = db.Column(db.Integer, nullable=False)
+    revenue = db.Column(db.Float, nullable=False)
+
+    # Rows live in the primary key b-tree, so a period range is one contiguous scan
+    __table_args__ = {'sqlite_with_rowid': False}
+
+
+class HourlyTotal(_RollupColumns, db.Model):
+    """traffic_entry summed per hour, group, class and peak flag, tolls applied (see rollups.py)."""
+    __tablename__ = 'traffic_hourly'
+    blocks_per_period = 6
+
+
+class DailyTotal(_RollupColumns, db.Model):
+    """traffic_entry summed per day, group, class and peak flag, tolls applied (see rollups.py)."""
+    __tablename__ = 'traffic_daily'
+    blocks_per_period = 144
+
+
+class IngestCheckpoint(db.Model):
+    """How far the bulk loader got through a CSV file, so a crashed load can resume."""
+    source = db.Column(db.String(500), primary_key=True)
+    file_size = db.Column(db.Integer)
+    file_mtime = db.Column(db.Float)
+    rows_done = db.Column(db.Integer, default=0)
+    completed = db.Column(db.Integer, default=0)
+
+
+class DataVersion(db.Model):
+    """Single-row counter bumped by every ingest so in-process caches know the data changed."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DataChange(db.Model):
+    """The block range each data version changed (NULL: anything may have changed)."""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    start_block = db.Column(db.Integer)
+    end_block = db.Column(db.Integer)
+
+
+def get_data_version(conn):
+    row = conn.exec_driver_sql(f"SELECT version FROM {DataVersion.__tablename__} WHERE id = 1").first()
+    return row[0] if row else 0
+
+
+def bump_data_version(conn, start_block=None, end_block=None):
+    """
+    Move to the next data version, recording that only the blocks
+    [start_block, end_block) changed if the caller knows.
+    """
+    conn.exec_driver_sql(
+        f"INSERT INTO {DataVersion.__tablename__} (id, version) VALUES (1, 1) "
+        "ON CONFLICT(id) DO UPDATE SET version = version + 1"
+    )
+    conn.exec_driver_sql(
+        f"INSERT OR REPLACE INTO {DataChange.__tablename__} (version, start_block, end_block) VALUES (?, ?, ?)",
+        (get_data_version(conn), start_block, end_block)
+    )
+
+
+def changed_ranges(conn, since_version, version):
+    """
+    The [start_block, end_block) ranges changed by the versions after
+    since_version up to version, or None if one of them changed everything
+    or wasn't recorded.
+    """
+    rows = conn.exec_driver_sql(
+        f"SELECT start_block, end_block FROM {DataChange.__tablename__} WHERE version > ? AND version <= ?",
+        (since_version, version)
+    ).all()
+    if len(rows) != version - since_version or any(start is None for start, _ in rows):
+        return None
+    return [(start, end) for start, end in rows]
+
+
+def merge_ranges(ranges):
+    """[start, end) ranges sorted, with overlapping and touching ones joined."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class Dimensions:
+    """
+    The vehicle_class and detection_group tables as code -> name dicts (and
+    code -> (off-peak, peak) toll), for decoding coded query results.
+    class_prices has the tolls by class name, for frames.price_matrix.
+    """
+
+    def __init__(self, classes, groups, prices):
+        self.classes = classes
+        self.groups = groups
+        self.prices = prices
+        self.class_codes = {name: code for code, name in classes.items()}
+        self.group_codes = {name: code for code, name in groups.items()}
+        self.class_prices = {classes[code]: price for code, price in prices.items()}
+
+    @classmethod
+    def load(cls, conn):
+        classes = {}
+        prices = {}
+        for code, name, off_peak, peak in conn.exec_driver_sql(
+                f"SELECT code, name, off_peak_price, peak_price FROM {VehicleClass.__tablename__}"):
+            classes[code] = name
+            prices[code] = (off_peak, peak)
+        groups = dict(conn.exec_driver_sql(f"SELECT code, name FROM {DetectionGroup.__tablename__}").all())
+        return cls(classes, groups, prices)
@@ -0,0 +1,123 @@
+"""
+Server-Sent Events playback of a /realtime_series window.
+
+/playback_stream sends a window one frame at a time instead of the whole
+spawn bundle up front:
+
+    event: meta     routes, animation timing and the number of frames
+    event: frame    one frame's spawns per class, id: <frame index>
+    event: end
+
+Frames are computed lazily as the stream reaches them (a bucketed window
+queries just the blocks of the next frame), and are paced to the animation
+clock: the first `lookahead` frames go out at once, then one per
+spawn_window + step_delay, so the page only ever holds a couple of frames
+whatever the interval. Pausing closes the EventSource; resuming or seeking
+opens a new one at ?cursor=<frame> (an automatic reconnect resumes after
+Last-Event-ID).
+"""
+import json
+import math
+import time
+from datetime import timedelta
+
+from frames import frame_timestamps
+from spawn_schedule import choose_scale, apportion, DEFAULT_MAX_ACTIVE_MARKERS
+
+DEFAULT_LOOKAHEAD = 2
+
+
+def frame_block_ranges(start_block, num_blocks, num_frames):
+    """
+    [first, stop) blocks of each frame of a bucketed window: the blocks
+    frames.frame_bucket puts in that frame.
+    """
+    bounds = [start_block + -(-f * num_blocks // num_frames) for f in range(num_frames + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def window_timestamps(start_time, num_blocks, num_frames):
+    return frame_timestamps(start_time, timedelta(minutes=10) * num_blocks, num_frames)
+
+
+class RouteTable:
+    """Routes of every class, numbered in first-use order for the meta event."""
+
+    def __init__(self, route_registry, classes):
+        self.routes = []
+        self.index = {}  # (class, location) -> route number
+        for vclass in classes:
+            for location, route in sorted(route_registry.for_class(vclass).items()):
+                self.index[(vclass, location)] = len(self.routes)
+                self.routes.append({"start": route["start"], "end": route["end"], "icon_url": route["icon_url"]})
+
+
+def frame_spawns(arrays, frame, route_table, classes, speed, spawn_window,
+                 max_active_markers=DEFAULT_MAX_ACTIVE_MARKERS):
+    """
+    {class: {"vehicles", "revenue", "scale", "spawns": [route, icons, ...]}}
+    for one frame of FrameArrays. Whole vehicles only, as in parse_frames;
+    the marker budget is applied per frame since later frames aren't known yet.
+    """
+    classes_present = list(arrays.classes)
+    result = {}
+    for vclass in classes:
+        items = []
+        vehicles = revenue = 0.0
+        if vclass in classes_present:
+            c = classes_present.index(vclass)
+            vehicles = float(arrays.vehicles[frame][:, c].sum())
+            revenue = float(arrays.revenue[frame][:, c].sum())
+            for l, location in enumerate(arrays.locations):
+                route = route_table.index.get((vclass, location))
+                count = int(math.floor(arrays.vehicles[frame][l][c])) if arrays.present[frame][l][c] else 0
+                if route is not None and count > 0:
+                    items.append((route, count))
+        scale = choose_scale([sum(count for _, count in items)], max_active_markers, speed, spawn_window)
+        spawns = []
+        for (route, _), icons in zip(items, apportion([count for _, count in items], scale)):
+            if icons > 0:
+                spawns.extend((route, icons))
+        result[vclass] = {"vehicles": round(vehicles, 2), "revenue": round(revenue, 2), "scale": scale,
+                          "spawns": spawns}
+    return result
+
+
+def sse_event(event, data, event_id=None):
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":")))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
+
+
+def stream_events(frame_source, num_frames, timestamps, route_table, classes, cursor=0, speed=4000,
+                  spawn_window=20000, step_delay=2000, lookahead=DEFAULT_LOOKAHEAD, pace=True,
+                  sleep=time.sleep, clock=time.monotonic):
+    """
+    The SSE byte stream from frame `cursor` on. frame_source(index) returns
+    FrameArrays holding that frame (and the index of the frame inside them).
+    """
+    step_seconds = (spawn_window + step_delay) / 1000
+    yield sse_event("meta", {
+        "frames": num_frames,
+        "cursor": cursor,
+        "speed": speed,
+        "spawn_window": spawn_window,
+        "step_delay": step_delay,
+        "routes": route_table.routes,
+    })
+
+    started = clock()
+    for index in range(cursor, num_frames):
+        if pace:
+            delay = started + max(0, index - cursor - lookahead + 1) * step_seconds - clock()
+            if delay > 0:
+                sleep(delay)
+        arrays, frame = frame_source(index)
+        yield sse_event("frame", {
+            "index": index,
+            "timestamp": timestamps[index],
+            "classes": frame_spawns(arrays, frame, route_table, classes, speed, spawn_window),
+        }, event_id=index)
+    yield sse_event("end", {"frames": num_frames})
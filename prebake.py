@@ -0,0 +1,274 @@
+"""
+Offline pre-bake of /realtime_series windows to static files.
+
+The UI only asks for fixed INTERVAL_CONFIG windows starting on 10-minute
+marks, so every window of the dataset can be computed ahead of time. For each
+day, start time and interval, the job writes the frames, their summary and
+the spawn bundle (the schedules of all six classes, so the class axis comes
+for free). Everything goes under instance/prebaked:
+
+    objects/ab/ab12....json.gz   gzip'd JSON named by the hash of its content
+    days/2025-03-05.json         fingerprint of the day's source rows + its windows
+    index.json                   frame_id -> object hashes, for the server
+
+Identical payloads (empty windows, for instance) are stored once. Days are
+baked in parallel with a process pool, and a day is only rebuilt when the
+fingerprint of the rows its windows read has changed.
+
+PrebakedStore is the server side. It serves those files straight from disk
+while index.json matches the current data version, and after an append keeps
+serving the windows outside the block ranges it changed.
+
+    python prebake.py                        # every hour, UI intervals
+    python prebake.py --minutes 0 10 20 30 40 50 --workers 8
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from httpcache import content_hash
+from models import TrafficEntry, from_block
+
+BLOCKS_PER_DAY = 144
+# The intervals the page's selector offers
+UI_INTERVALS = ("10min", "30min", "1hr", "3hr", "6hr", "1day")
+# Bump when the baked payloads change shape, so every day is rebuilt
+PREBAKE_FORMAT = 1
+
+
+def object_path(directory, digest):
+    return os.path.join(directory, "objects", digest[:2], f"{digest}.json.gz")
+
+
+def _write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_object(directory, body):
+    """Store body (JSON bytes) under its content hash, return the hash."""
+    digest = content_hash(body)
+    path = object_path(directory, digest)
+    if not os.path.exists(path):
+        # mtime=0 keeps the gzip bytes a pure function of the content
+        _write_atomic(path, gzip.compress(body, compresslevel=9, mtime=0))
+    return digest
+
+
+def day_name(day):
+    return from_block(day * BLOCKS_PER_DAY).strftime("%Y-%m-%d")
+
+
+def day_fingerprints(engine, intervals, minutes):
+    """
+    Fingerprint per day of everything its windows read: the row stats of the
+    day itself and of the following days its longest window reaches into,
+    plus the bake settings.
+    """
+    from main import INTERVAL_CONFIG
+
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            f"SELECT block / {BLOCKS_PER_DAY}, COUNT(*), SUM(crz_entries), "
+            f"SUM(excluded_roadway_entries), SUM((block % {BLOCKS_PER_DAY}) * crz_entries) "
+            f"FROM {TrafficEntry.__tablename__} GROUP BY block / {BLOCKS_PER_DAY}"
+        ).all()
+    stats = {row[0]: row[1:] for row in rows}
+    if not stats:
+        return {}
+
+    max_blocks = max(INTERVAL_CONFIG[key]["blocks"] for key in intervals)
+    last_start = max(minutes) // 10 + 23 * 6
+    reach = (last_start + max_blocks - 1) // BLOCKS_PER_DAY
+    settings = [PREBAKE_FORMAT, list(intervals), list(minutes)]
+
+    fingerprints = {}
+    for day in range(min(stats), max(stats) + 1):
+        touched = [stats.get(d) for d in range(day, day + reach + 1)]
+        fingerprints[day] = hashlib.sha1(json.dumps([settings, touched]).encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def _init_worker():
+    global _app_context
+    from main import app
+    _app_context = app.app_context()
+    _app_context.push()
+
+
+def bake_day(directory, day, intervals, minutes):
+    """Bake every window starting on day; returns frame_id -> object hashes."""
+    from frame_store import FrameEntry, make_frame_id
+    from frames import frames_to_json
+    from main import compute_frame_arrays, summary_for_entry, spawn_bundle_for_entry, json_body
+
+    windows = {}
+    for hour in range(24):
+        for minute in minutes:
+            start_block = day * BLOCKS_PER_DAY + hour * 6 + minute // 10
+            for interval_key in intervals:
+                frame_id = make_frame_id(interval_key, start_block)
+                arrays = compute_frame_arrays(interval_key, start_block)
+                entry = FrameEntry(frame_id, frames_to_json(arrays), arrays)
+                windows[frame_id] = {
+                    "frames": write_object(directory, entry.body),
+                    "summary": write_object(directory, json_body(summary_for_entry(entry))),
+                    "bundle": write_object(directory, json_body(spawn_bundle_for_entry(entry))),
+                }
+    return windows
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return default
+
+
+def prebake(directory, engine, data_version, intervals=UI_INTERVALS, minutes=(0,), workers=None,
+            prune=False):
+    """Bring directory up to date; returns {"baked", "skipped", "windows"}."""
+    fingerprints = day_fingerprints(engine, intervals, minutes)
+    days_dir = os.path.join(directory, "days")
+
+    stale = []
+    for day, fingerprint in fingerprints.items():
+        manifest = _read_json(os.path.join(days_dir, f"{day_name(day)}.json"))
+        if manifest is None or manifest.get("fingerprint") != fingerprint:
+            stale.append(day)
+    print(f"{len(stale)} of {len(fingerprints)} days need baking.")
+
+    if stale:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            futures = {day: pool.submit(bake_day, directory, day, intervals, minutes) for day in stale}
+            for day, future in sorted(futures.items()):
+                _write_atomic(
+                    os.path.join(days_dir, f"{day_name(day)}.json"),
+                    json.dumps({"fingerprint": fingerprints[day], "windows": future.result()}).encode("utf-8")
+                )
+                print(f"  baked {day_name(day)}")
+
+    windows = {}
+    for day in fingerprints:
+        manifest = _read_json(os.path.join(days_dir, f"{day_name(day)}.json"), {})
+        windows.update(manifest.get("windows", {}))
+    _write_atomic(
+        os.path.join(directory, "index.json"),
+        json.dumps({"data_version": data_version, "windows": windows}).encode("utf-8")
+    )
+
+    if prune:
+        referenced = {digest for hashes in windows.values() for digest in hashes.values()}
+        objects_dir = os.path.join(directory, "objects")
+        for root, _, files in os.walk(objects_dir):
+            for name in files:
+                if name.endswith(".json.gz") and name[:-len(".json.gz")] not in referenced:
+                    os.remove(os.path.join(root, name))
+
+    return {"baked": len(stale), "skipped": len(fingerprints) - len(stale), "windows": len(windows)}
+
+
+class PrebakedStore:
+    """
+    Read side of the pre-baked files. index.json is re-read when it changes
+    on disk. While its data version is behind the current one (the job
+    hasn't caught up with an ingest yet), only the windows whose blocks
+    (window_range(frame_id)) no ingest since has touched are served, or none
+    if changes_source(since, version) doesn't know the changed ranges.
+    clear() makes the next lookup re-check, so it can be registered with a
+    DataVersionWatcher.
+    """
+
+    def __init__(self, directory, version_source, changes_source=None, window_range=None):
+        self.directory = directory
+        self.version_source = version_source
+        self.changes_source = changes_source
+        self.window_range = window_range
+        self._index = None
+        self._mtime = None
+        self._current = None  # (index data version, version, windows still valid)
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._index = None
+            self._mtime = None
+            self._current = None
+
+    def _windows(self):
+        path = os.path.join(self.directory, "index.json")
+        try:
+            mtime = os.stat(path).st_mtime
+        except FileNotFoundError:
+            return {}
+        with self._lock:
+            if self._index is None or mtime != self._mtime:
+                self._index = _read_json(path, {})
+                self._mtime = mtime
+            index = self._index
+        baked_version = index.get("data_version")
+        version = self.version_source()
+        windows = index.get("windows", {})
+        if baked_version == version:
+            return windows
+        current = self._current
+        if current is None or current[:2] != (baked_version, version):
+            current = (baked_version, version, self._untouched(windows, baked_version, version))
+            with self._lock:
+                self._current = current
+        return current[2]
+
+    def _untouched(self, windows, baked_version, version):
+        """The windows no ingest after baked_version changed a block of."""
+        if self.changes_source is None or self.window_range is None or not baked_version \
+                or baked_version > version:
+            return {}
+        ranges = self.changes_source(baked_version, version)
+        if ranges is None:
+            return {}
+        untouched = {}
+        for frame_id, hashes in windows.items():
+            start, end = self.window_range(frame_id)
+            if not any(start < change_end and change_start < end for change_start, change_end in ranges):
+                untouched[frame_id] = hashes
+        return untouched
+
+    def lookup(self, frame_id):
+        """{"frames", "summary", "bundle"} object hashes for frame_id, or None."""
+        return self._windows().get(frame_id)
+
+    def read(self, digest):
+        """The gzip'd bytes of an object."""
+        with open(object_path(self.directory, digest), "rb") as f:
+            return f.read()
+
+    def load(self, digest):
+        return json.loads(gzip.decompress(self.read(digest)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Pre-bake /realtime_series windows to static files")
+    parser.add_argument("--intervals", nargs="+", default=list(UI_INTERVALS))
+    parser.add_argument("--minutes", nargs="+", type=int, default=[0],
+                        help="start minutes within each hour (multiples of 10)")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--prune", action="store_true", help="delete objects no window uses any more")
+    args = parser.parse_args()
+
+    from main import app, aggregate_cube, read_data_version, PREBAKE_DIR
+    from database import readonly_engine
+
+    with app.app_context():
+        # Build the cube once here instead of in every worker
+        aggregate_cube.get()
+        stats = prebake(PREBAKE_DIR, readonly_engine(), read_data_version(), intervals=args.intervals,
+                        minutes=args.minutes, workers=args.workers, prune=args.prune)
+    print(f"Baked {stats['baked']} days, {stats['skipped']} unchanged, {stats['windows']} windows indexed.")
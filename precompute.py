@@ -0,0 +1,152 @@
+"""
+Parallel rebuild of the derived aggregates: the hourly/daily rollups and the
+aggregate cube (which the /extremes windows are answered from).
+
+The traffic_entry time range is split into day or week partitions and each
+partition is aggregated by its own process, reading the same database the
+rollups are written to. Partitions don't overlap and are merged in time order
+once all are done, so the result doesn't depend on which worker finished
+first. The rollups are then replaced in one transaction and the cube is saved
+where the server memory-maps it from. If an ingest lands while the workers
+are reading, the data version no longer matches and the run starts over, so
+the cube is never stamped with a version older than its rows.
+
+    python precompute.py                          # day partitions, one worker per core
+    python precompute.py --partition week --workers 8 --report precompute.json
+    python precompute.py --prebake                # then bring instance/prebaked up to date
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import create_engine
+
+from cube import AggregateCube
+from models import TrafficEntry, Dimensions, get_data_version, from_block
+from rollups import hourly_rows, daily_from_hourly, replace_rollups
+
+PARTITION_BLOCKS = {"day": 144, "week": 1008}
+MAX_ATTEMPTS = 3
+
+_engine = None
+
+
+def _init_worker(url):
+    """Open the database precompute() was given, once per worker process."""
+    global _engine
+    _engine = create_engine(url)
+
+
+def partitions(first_block, end_block, size):
+    """[start, stop) block ranges covering [first_block, end_block), aligned to multiples of size."""
+    start = first_block - first_block % size
+    return [(block, block + size) for block in range(start, end_block, size)]
+
+
+def aggregate_partition(start_block, stop_block):
+    """Cube and hourly rollup rows of the blocks [start_block, stop_block)."""
+    started = time.perf_counter()
+    with _engine.connect() as conn:
+        cube_rows = [tuple(row) for row in AggregateCube.block_rows(conn, start_block, stop_block)]
+        hourly = sorted(tuple(row) for row in hourly_rows(conn, start_block, stop_block))
+    return {"cube_rows": cube_rows, "hourly": hourly, "seconds": time.perf_counter() - started}
+
+
+def _aggregate(engine, partition, workers):
+    """
+    One pass over the partitions: (data_version, dimensions, cube_rows,
+    hourly, timings), or None if traffic_entry is empty.
+    """
+    with engine.connect() as conn:
+        data_version = get_data_version(conn)
+        dimensions = Dimensions.load(conn)
+        first_block, last_block = conn.exec_driver_sql(
+            f"SELECT MIN(block), MAX(block) FROM {TrafficEntry.__tablename__}"
+        ).first()
+    if first_block is None:
+        return None
+
+    parts = partitions(first_block, last_block + 1, PARTITION_BLOCKS[partition])
+    print(f"Aggregating {len(parts)} {partition} partitions with {workers} workers...")
+
+    url = engine.url.render_as_string(hide_password=False)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(url,)) as pool:
+        futures = [(start, stop, pool.submit(aggregate_partition, start, stop)) for start, stop in parts]
+        # Merge in partition order, whatever order the workers finish in
+        timings = []
+        cube_rows = []
+        hourly = []
+        for start, stop, future in futures:
+            result = future.result()
+            cube_rows.extend(result["cube_rows"])
+            hourly.extend(result["hourly"])
+            timings.append({
+                "start": from_block(start).strftime("%Y-%m-%d"),
+                "rows": len(result["cube_rows"]),
+                "seconds": result["seconds"],
+            })
+            print(f"  {timings[-1]['start']}: {len(result['cube_rows']):,} rows in {result['seconds']:.2f}s")
+    return data_version, dimensions, cube_rows, hourly, timings
+
+
+def precompute(engine, cube_dir, partition="day", workers=None):
+    """
+    Rebuild the rollups (written through engine) and the cube (saved to
+    cube_dir) from engine's database. Returns {"partitions": [...],
+    "workers", "seconds"}, with the rows and worker seconds of each partition.
+    """
+    started = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    for attempt in range(MAX_ATTEMPTS):
+        aggregated = _aggregate(engine, partition, workers)
+        if aggregated is None:
+            print("traffic_entry is empty, nothing to precompute.")
+            return {"partitions": [], "workers": 0, "seconds": 0.0}
+        data_version, dimensions, cube_rows, hourly, timings = aggregated
+
+        with engine.connect() as conn:
+            with conn.begin() as transaction:
+                replace_rollups(conn, hourly, daily_from_hourly(hourly))
+                # The rollup writes hold SQLite's write lock, so no ingest can commit after this check
+                if get_data_version(conn) == data_version:
+                    break
+                transaction.rollback()
+        print("The data changed while aggregating, starting over.")
+    else:
+        raise RuntimeError(f"The data kept changing, gave up after {MAX_ATTEMPTS} attempts")
+
+    cube = AggregateCube.from_coded_rows(cube_rows, dimensions, data_version)
+    if cube is not None:
+        cube.save(cube_dir)
+
+    elapsed = time.perf_counter() - started
+    busy = sum(timing["seconds"] for timing in timings)
+    print(f"Precomputed {len(timings)} partitions in {elapsed:.1f}s "
+          f"({busy:.1f}s of worker time, {busy / elapsed if elapsed else 0:.1f}x parallel).")
+    return {"partitions": timings, "workers": workers, "seconds": elapsed}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild the rollups and aggregate cube in parallel")
+    parser.add_argument("--partition", choices=sorted(PARTITION_BLOCKS), default="day")
+    parser.add_argument("--workers", type=int, default=None, help="default: one per core")
+    parser.add_argument("--report", help="write the per-partition timings to this JSON file")
+    parser.add_argument("--prebake", action="store_true", help="also pre-bake the UI windows (prebake.py)")
+    args = parser.parse_args()
+
+    from main import app, db, aggregate_cube, read_data_version, CUBE_DIR, PREBAKE_DIR
+    from database import readonly_engine
+
+    with app.app_context():
+        stats = precompute(db.engine, CUBE_DIR, partition=args.partition, workers=args.workers)
+        if args.prebake:
+            from prebake import prebake
+            aggregate_cube.get()
+            prebake(PREBAKE_DIR, readonly_engine(), read_data_version(), workers=args.workers)
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(stats, f, indent=2)
+        print(f"Wrote {args.report}")
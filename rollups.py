@@ -0,0 +1,182 @@
+"""
+Hourly and daily rollups of traffic_entry.
+
+traffic_hourly and traffic_daily hold crz_entries, and the revenue they make
+at the vehicle_class tolls, per hour (or day), detection group, class and
+peak flag. ingest.py refreshes the hours and days a load touched; the hourly
+table is summed from traffic_entry and the daily one from the hourly.
+
+Long windows read them instead of the 10-minute rows: split_range() covers a
+block range with whole days, then whole hours, then single blocks at the
+edges, and rollup_for_frames() picks the coarsest table whose periods never
+straddle a /realtime_series frame.
+
+    python rollups.py            # rebuild both tables from traffic_entry
+"""
+from frames import frame_bucket
+from models import db, TrafficEntry, VehicleClass, HourlyTotal, DailyTotal, Dimensions
+
+# Coarsest first
+ROLLUPS = (DailyTotal, HourlyTotal)
+
+
+def _period_range(start_block, end_block, blocks_per_period):
+    """Periods overlapping [start_block, end_block), as [first, stop)."""
+    return start_block // blocks_per_period, -(-end_block // blocks_per_period)
+
+
+def _hourly_select(block_filter=""):
+    """SELECT of the traffic_hourly rows, optionally limited by a block filter on e.block."""
+    hour_blocks = HourlyTotal.blocks_per_period
+    return (
+        f"SELECT e.block / {hour_blocks}, e.group_code, e.class_code, e.is_peak, SUM(e.crz_entries), "
+        f"SUM(e.crz_entries * CASE WHEN e.is_peak = 1 THEN c.peak_price ELSE c.off_peak_price END) "
+        f"FROM {TrafficEntry.__tablename__} e JOIN {VehicleClass.__tablename__} c ON c.code = e.class_code "
+        f"WHERE e.block IS NOT NULL {block_filter} "
+        f"GROUP BY e.block / {hour_blocks}, e.group_code, e.class_code, e.is_peak"
+    )
+
+
+def hourly_rows(conn, start_block, end_block):
+    """The traffic_hourly rows of the blocks [start_block, end_block), without writing them."""
+    return conn.exec_driver_sql(_hourly_select("AND e.block >= ? AND e.block < ?"), (start_block, end_block)).all()
+
+
+def daily_from_hourly(rows):
+    """Sum traffic_hourly rows into traffic_daily rows, sorted by key."""
+    hours_per_day = DailyTotal.blocks_per_period // HourlyTotal.blocks_per_period
+    totals = {}
+    for hour, group_code, class_code, is_peak, entries, revenue in rows:
+        key = (hour // hours_per_day, group_code, class_code, is_peak)
+        previous = totals.get(key, (0, 0.0))
+        totals[key] = (previous[0] + entries, previous[1] + revenue)
+    return [key + value for key, value in sorted(totals.items())]
+
+
+def replace_rollups(conn, hourly, daily):
+    """Replace both tables' contents with the given rows."""
+    for model, rows in ((HourlyTotal, hourly), (DailyTotal, daily)):
+        conn.exec_driver_sql(f"DELETE FROM {model.__tablename__}")
+        if rows:
+            conn.exec_driver_sql(
+                f"INSERT INTO {model.__tablename__} (period, group_code, class_code, is_peak, crz_entries, revenue) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [tuple(row) for row in rows]
+            )
+
+
+def refresh_rollups(conn, start_block=None, end_block=None):
+    """
+    Recompute the rollup rows of every hour and day overlapping [start_block,
+    end_block) from traffic_entry, or of the whole table without a range.
+    """
+    hourly = HourlyTotal.__tablename__
+    daily = DailyTotal.__tablename__
+    if start_block is None:
+        first_block, stop_block = 0, None
+    else:
+        # Whole days, so the daily rows can be summed from complete hours
+        first_day, stop_day = _period_range(start_block, end_block, DailyTotal.blocks_per_period)
+        first_block = first_day * DailyTotal.blocks_per_period
+        stop_block = stop_day * DailyTotal.blocks_per_period
+
+    hour_blocks = HourlyTotal.blocks_per_period
+    hours_per_day = DailyTotal.blocks_per_period // hour_blocks
+    for table, blocks in ((hourly, hour_blocks), (daily, DailyTotal.blocks_per_period)):
+        if stop_block is None:
+            conn.exec_driver_sql(f"DELETE FROM {table}")
+        else:
+            conn.exec_driver_sql(f"DELETE FROM {table} WHERE period >= ? AND period < ?",
+                                 (first_block // blocks, stop_block // blocks))
+
+    block_filter = "" if stop_block is None else "AND e.block >= ? AND e.block < ?"
+    conn.exec_driver_sql(
+        f"INSERT INTO {hourly} (period, group_code, class_code, is_peak, crz_entries, revenue) "
+        + _hourly_select(block_filter),
+        () if stop_block is None else (first_block, stop_block)
+    )
+
+    period_filter = "" if stop_block is None else "WHERE period >= ? AND period < ?"
+    conn.exec_driver_sql(
+        f"INSERT INTO {daily} (period, group_code, class_code, is_peak, crz_entries, revenue) "
+        f"SELECT period / {hours_per_day}, group_code, class_code, is_peak, SUM(crz_entries), SUM(revenue) "
+        f"FROM {hourly} {period_filter} "
+        f"GROUP BY period / {hours_per_day}, group_code, class_code, is_peak",
+        () if stop_block is None else (first_block // hour_blocks, stop_block // hour_blocks)
+    )
+
+
+def rollups_empty(conn):
+    return conn.exec_driver_sql(f"SELECT 1 FROM {HourlyTotal.__tablename__} LIMIT 1").first() is None
+
+
+def daily_totals(conn, first_day, stop_day, detection_group=None, vehicle_class=None):
+    """(day, entries, revenue) rows for the days [first_day, stop_day), from traffic_daily."""
+    dimensions = Dimensions.load(conn)
+    filters = ""
+    params = [first_day, stop_day]
+    if detection_group:
+        if detection_group not in dimensions.group_codes:
+            return []
+        filters += " AND group_code = ?"
+        params.append(dimensions.group_codes[detection_group])
+    if vehicle_class:
+        if vehicle_class not in dimensions.class_codes:
+            return []
+        filters += " AND class_code = ?"
+        params.append(dimensions.class_codes[vehicle_class])
+    return conn.exec_driver_sql(
+        f"SELECT period, SUM(crz_entries), SUM(revenue) FROM {DailyTotal.__tablename__} "
+        f"WHERE period >= ? AND period < ?{filters} GROUP BY period ORDER BY period",
+        tuple(params)
+    ).all()
+
+
+def split_range(start_block, end_block, rollups=ROLLUPS):
+    """
+    Cover [start_block, end_block) with the fewest whole periods, as
+    (model, first, stop) pieces; model is a rollup (first/stop are period
+    numbers) or TrafficEntry (first/stop are blocks).
+    """
+    if start_block >= end_block:
+        return []
+    if not rollups:
+        return [(TrafficEntry, start_block, end_block)]
+    model, finer = rollups[0], rollups[1:]
+    first = -(-start_block // model.blocks_per_period)
+    stop = end_block // model.blocks_per_period
+    if first >= stop:
+        return split_range(start_block, end_block, finer)
+    return (
+        split_range(start_block, first * model.blocks_per_period, finer)
+        + [(model, first, stop)]
+        + split_range(stop * model.blocks_per_period, end_block, finer)
+    )
+
+
+def rollup_for_frames(start_block, num_blocks, num_frames):
+    """
+    The coarsest rollup whose periods each fall inside a single frame of a
+    bucketed window (see frames.frame_bucket), or None if only the 10-minute
+    rows will do.
+    """
+    if num_blocks < num_frames:
+        return None
+    for model in ROLLUPS:
+        size = model.blocks_per_period
+        if start_block % size or num_blocks % size:
+            continue
+        if all(frame_bucket(offset, num_blocks, num_frames) == frame_bucket(offset + size - 1, num_blocks, num_frames)
+               for offset in range(0, num_blocks, size)):
+            return model
+    return None
+
+
+if __name__ == '__main__':
+    from main import app
+
+    with app.app_context():
+        db.metadata.create_all(bind=db.engine)
+        with db.engine.begin() as conn:
+            refresh_rollups(conn)
+        print("Rollups rebuilt.")
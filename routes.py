@@ -0,0 +1,134 @@
+"""
+Animation routes for every (vehicle class, detection group) pair.
+
+The geometry of each entry point never changes and the icon only depends on
+the vehicle class and the direction of travel, so the full table is built once
+at startup. Spawn generation then does a dict lookup per location instead of
+rebuilding the route list (and its url_for calls) every time.
+"""
+from dimensions import VEHICLE_CLASSES
+
+# name -> start/end of the animated path and the heading used to pick the icon
+ROUTE_GEOMETRY = {
+    "Lincoln Tunnel": {
+        "start": [40.766708, -74.018524],
+        "end": [40.760159, -74.002774],
+        "heading": 135,
+    },
+    "Brooklyn Bridge": {
+        "start": [40.702210, -73.992004],
+        "end": [40.708034, -73.999334],
+        "heading": 315,
+    },
+    "Williamsburg Bridge": {
+        "start": [40.712044, -73.966979],
+        "end": [40.714744, -73.976249],
+        "heading": 337,
+    },
+    "Manhattan Bridge": {
+        "start": [40.702299, -73.987915],
+        "end": [40.709581, -73.991853],
+        "heading": 292,
+    },
+    "Holland Tunnel": {
+        "start": [40.728897, -74.031589],
+        "end": [40.726183, -74.011329],
+        "heading": 180,
+    },
+    "Hugh L. Carey Tunnel": {
+        "start": [40.685010, -74.007056],
+        "end": [40.700987, -74.015532],
+        "heading": 292,
+    },
+    "Queensboro Bridge": {
+        "start": [40.754783, -73.949994],
+        "end": [40.758882, -73.959143],
+        "heading": 337,
+    },
+    "Queens Midtown Tunnel": {
+        "start": [40.74289229922877, -73.96082715665342],
+        "end": [40.747834966345074, -73.96816127996215],
+        "heading": 337,
+    },
+    "West 60th St": {
+        "start": [40.77164541992876, -73.98306418072985],
+        "end": [40.768193524649575, -73.98565628724995],
+        "heading": 45,
+    },
+    "FDR Drive at 60th St": {
+        "start": [40.765785223608674, -73.95748405831618],
+        "end": [40.76275029301429, -73.95971426811401],
+        "heading": 45,
+    },
+    "East 60th St": {
+        "start": [40.76328718520095, -73.96243948478009],
+        "end": [40.75937598422883, -73.96541471379228],
+        "heading": 45,
+    },
+    "West Side Highway at 60th St": {
+        "start": [40.77321742695657, -73.98939439202347],
+        "end": [40.77019877213487, -73.99163134442664],
+        "heading": 45,
+    },
+}
+
+# Static location markers shown on the map
+MARKER_COORDS = {
+    "Brooklyn Bridge": [40.7061, -73.9969],
+    "West Side Highway at 60th St": [40.7713, -73.9902],
+    "West 60th St": [40.7700, -73.9836],
+    "Queensboro Bridge": [40.7570, -73.9544],
+    "Queens Midtown Tunnel": [40.7433, -73.9698],
+    "Lincoln Tunnel": [40.7608, -74.0021],
+    "Holland Tunnel": [40.7260, -74.0086],
+    "FDR Drive at 60th St": [40.7626, -73.9585],
+    "East 60th St": [40.7616, -73.9641],
+    "Williamsburg Bridge": [40.7132, -73.9712],
+    "Manhattan Bridge": [40.7075, -73.9903],
+    "Hugh L. Carey Tunnel": [40.7003, -74.0132]
+}
+
+ROUTE_DURATION = 4000
+
+
+def icon_filename(vehicle_class, heading):
+    # Icons are named after the lower-cased class, e.g. "single unit trucks_icon_45.png"
+    return f"vehicles/{vehicle_class.lower()}_icon_{heading}.png"
+
+
+class RouteRegistry:
+    """
+    Routes keyed by (vehicle class, detection group).
+
+    static_url maps a path under static/ to its URL (url_for('static', ...)),
+    and is only called while the registry is built.
+    """
+
+    def __init__(self, static_url, vehicle_classes=VEHICLE_CLASSES, geometry=ROUTE_GEOMETRY):
+        self._by_class = {}
+        self._routes = {}
+        for vehicle_class in vehicle_classes:
+            class_routes = {}
+            for name, geo in geometry.items():
+                route = {
+                    "name": name,
+                    "start": geo["start"],
+                    "end": geo["end"],
+                    "duration": ROUTE_DURATION,
+                    "icon_url": static_url(icon_filename(vehicle_class, geo["heading"])),
+                }
+                class_routes[name] = route
+                self._routes[(vehicle_class, name)] = route
+            self._by_class[vehicle_class] = class_routes
+
+    def get(self, vehicle_class, detection_group):
+        """The route for one class at one entry point, or None."""
+        return self._routes.get((vehicle_class, detection_group))
+
+    def for_class(self, vehicle_class):
+        """Detection group -> route for one class (empty for unknown classes)."""
+        return self._by_class.get(vehicle_class, {})
+
+    def lookup(self, vehicle_class):
+        """A location-name -> route function for build_spawn_schedule()."""
+        return self.for_class(vehicle_class).get
@@ -0,0 +1,166 @@
+"""
+Compact spawn schedules for the map animation.
+
+Instead of one generated setTimeout line per vehicle, the page gets a table of
+the routes in use and a flat array of (step, route, count) triples. The small
+scheduler in index.html (runSpawnSchedule) expands those into addCar calls on
+the fly, spacing each step's vehicles evenly over spawn_window ms exactly like
+build_spawn_js_from_timestepdata did. Payload size now grows with
+routes x steps instead of with the number of vehicles.
+
+build_spawn_bundle() builds the schedules of every vehicle class from one
+pass over the frames, so the page can switch class without asking the
+server again.
+
+Busy windows are drawn to a marker budget: once the busiest step would keep
+more than max_active_markers icons on the map at once, one icon stands for
+`scale` vehicles. Each step's icons are then apportioned across locations by
+largest remainder, so their shares stay proportional.
+"""
+import base64
+import math
+import sys
+from array import array
+
+
+def pack_spawns(spawns):
+    """Base64 of the spawn triples as little-endian uint32, for the binary encoding."""
+    packed = array("I", spawns)
+    if sys.byteorder != "little":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+DEFAULT_MAX_ACTIVE_MARKERS = 150
+
+
+def choose_scale(step_totals, max_active_markers, speed, spawn_window):
+    """
+    Vehicles per icon so that no step keeps more than max_active_markers
+    icons moving at once. A step's icons appear evenly over spawn_window ms and
+    each one lives speed ms, so about total * speed / spawn_window are alive.
+    """
+    if not max_active_markers or not step_totals:
+        return 1
+    per_step_budget = max(1, max_active_markers * spawn_window // max(speed, 1))
+    return max(1, math.ceil(max(step_totals) / per_step_budget))
+
+
+def apportion(counts, scale):
+    """
+    Split round(sum(counts) / scale) icons across counts in proportion to
+    them (largest remainder method).
+    """
+    if scale == 1:
+        return list(counts)
+    target = int(round(sum(counts) / scale))
+    shares = [count / scale for count in counts]
+    result = [int(share) for share in shares]
+    by_remainder = sorted(range(len(counts)), key=lambda i: shares[i] - result[i], reverse=True)
+    for i in by_remainder[:max(target - sum(result), 0)]:
+        result[i] += 1
+    return result
+
+
+def build_spawn_schedule(timestep_data, route_lookup, speed=4000, spawn_window=20000,
+                         step_delay=2000, binary=False, max_active_markers=DEFAULT_MAX_ACTIVE_MARKERS):
+    """
+    :param timestep_data: output of parse_frames(), i.e. [
+      { "index": 0, "timestep": "...", "vehicles": [{"location": ..., "count": ...}, ...] },
+      ...
+    ]
+    :param route_lookup: location name -> route dict (start, end, icon_url) or None
+    :param binary: pack the spawn triples into "spawns_b64" instead of a JSON list
+    :param max_active_markers: marker budget, None to draw every vehicle
+    """
+    routes = []
+    route_index = {}
+    spawns = []
+    timesteps = []
+
+    step_items = []
+    for step_info in timestep_data:
+        items = []
+        for item in step_info["vehicles"]:
+            route = route_lookup(item["location"])
+            if route and item["count"] > 0:
+                items.append((route, item["count"]))
+        step_items.append(items)
+
+    scale = choose_scale([sum(count for _, count in items) for items in step_items],
+                         max_active_markers, speed, spawn_window)
+
+    for step_info, items in zip(timestep_data, step_items):
+        step_index = step_info["index"]
+        timesteps.append(step_info["timestep"])
+
+        icons = apportion([count for _, count in items], scale)
+        for (route, _), count in zip(items, icons):
+            if count <= 0:
+                continue
+
+            key = (tuple(route["start"]), tuple(route["end"]), route["icon_url"])
+            if key not in route_index:
+                route_index[key] = len(routes)
+                routes.append({
+                    "start": route["start"],
+                    "end": route["end"],
+                    "icon_url": route["icon_url"]
+                })
+            spawns.extend((step_index, route_index[key], count))
+
+    schedule = {
+        "speed": speed,
+        "spawn_window": spawn_window,
+        "step_delay": step_delay,
+        "scale": scale,
+        "timesteps": timesteps,
+        "routes": routes,
+    }
+    if binary:
+        schedule["spawns_b64"] = pack_spawns(spawns)
+    else:
+        schedule["spawns"] = spawns
+    return schedule
+
+
+def parse_frames_by_class(frames):
+    """
+    parse_frames() for every class at once: class -> timestep data, from a
+    single walk over the frames.
+    """
+    by_class = {}
+    for i, time_step in enumerate(frames):
+        for loc_name, loc_data in time_step.get("locations", {}).items():
+            for vclass, stats in loc_data["current"].get("by_class", {}).items():
+                vehicle_count = int(math.floor(stats["vehicles"]))
+                if vehicle_count > 0:
+                    steps = by_class.get(vclass)
+                    if steps is None:
+                        steps = by_class[vclass] = [
+                            {"index": j, "vehicles": [], "timestep": frame["timestamp"]}
+                            for j, frame in enumerate(frames)
+                        ]
+                    steps[i]["vehicles"].append({"location": loc_name, "count": vehicle_count})
+    return by_class
+
+
+def build_spawn_bundle(frames, route_registry, classes, speed=4000, spawn_window=20000,
+                       step_delay=2000, binary=False, max_active_markers=DEFAULT_MAX_ACTIVE_MARKERS):
+    """Spawn schedules for each of classes, as {"classes": {class: schedule}}."""
+    by_class = parse_frames_by_class(frames)
+    empty_steps = [{"index": i, "vehicles": [], "timestep": frame["timestamp"]} for i, frame in enumerate(frames)]
+    return {
+        "classes": {
+            vclass: build_spawn_schedule(
+                by_class.get(vclass, empty_steps),
+                route_registry.lookup(vclass),
+                speed=speed,
+                spawn_window=spawn_window,
+                step_delay=step_delay,
+                binary=binary,
+                max_active_markers=max_active_markers
+            )
+            for vclass in classes
+        }
+    }
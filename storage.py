@@ -0,0 +1,434 @@
+"""
+Storage backends for the read-only queries behind /filter, /data and
+/realtime_series.
+
+SQLiteBackend runs them against traffic.db, reading the hourly and daily
+rollups (rollups.py) for the whole hours and days of long windows. ColumnarBackend keeps
+the traffic_entry columns as NumPy arrays sorted by block, saved as .npy
+files next to the database and memory-mapped back in. A time range is then
+two binary searches plus a slice, and the GROUP BYs become bincounts over
+that slice. The columns are exported from SQLite once; when the data version
+moves, the rows of the block ranges ingested since are read again and merged
+in, the same way the aggregate cube is updated.
+
+Both group by the integer class/group codes and decode names only in the
+rows they return, in the shapes the SQL queries always had, so the frame
+builders don't care which one is configured (STORAGE_BACKEND=sqlite|columnar).
+"""
+import json
+import os
+import threading
+
+import numpy as np
+from sqlalchemy import func, case
+from sqlalchemy.exc import OperationalError
+
+from database import read_session
+from frames import frame_bucket
+from models import (TrafficEntry, VehicleClass, Dimensions, from_block, get_data_version, changed_ranges,
+                    merge_ranges, DATETIME_FORMAT)
+from rollups import split_range, rollup_for_frames
+
+COLUMNS = ("id", "block", "is_peak", "class_code", "group_code", "crz_entries", "excluded_roadway_entries")
+
+
+def _entry_dict(id, datetime, is_peak, vehicle_class, detection_group, crz_entries, excluded_roadway_entries):
+    return {
+        'id': id,
+        'datetime': datetime,
+        'is_peak': is_peak,
+        'vehicle_class': vehicle_class,
+        'detection_group': detection_group,
+        'crz_entries': crz_entries,
+        'excluded_roadway_entries': excluded_roadway_entries
+    }
+
+
+class SQLiteBackend:
+    name = "sqlite"
+
+    def clear(self):
+        pass
+
+    def class_totals(self, start_block, end_block, detection_group=None, vehicle_class=None):
+        """
+        (vehicle_class, entries, revenue) rows for the blocks [start_block,
+        end_block), priced with the tolls of the vehicle_class table. Whole
+        days and hours of the range are read from the rollup tables.
+        """
+        with read_session() as db_session:
+            dimensions = Dimensions.load(db_session.connection())
+            group_code = class_code = None
+            if detection_group:
+                if detection_group not in dimensions.group_codes:
+                    return []
+                group_code = dimensions.group_codes[detection_group]
+            if vehicle_class:
+                if vehicle_class not in dimensions.class_codes:
+                    return []
+                class_code = dimensions.class_codes[vehicle_class]
+
+            totals = {}
+            for model, first, stop in split_range(start_block, end_block):
+                for code, vehicles, revenue in self._class_totals_query(
+                        db_session, model, first, stop, group_code, class_code):
+                    previous = totals.get(code, (0, 0))
+                    totals[code] = (previous[0] + vehicles, previous[1] + revenue)
+        return [(dimensions.classes[code], vehicles, revenue) for code, (vehicles, revenue) in totals.items()]
+
+    def _class_totals_query(self, db_session, model, first, stop, group_code, class_code):
+        if model is TrafficEntry:
+            price = case(
+                (TrafficEntry.is_peak == 1, VehicleClass.peak_price),
+                else_=VehicleClass.off_peak_price
+            )
+            query = db_session.query(
+                TrafficEntry.class_code,
+                func.sum(TrafficEntry.crz_entries),
+                func.sum(TrafficEntry.crz_entries * price)
+            ).join(
+                VehicleClass, VehicleClass.code == TrafficEntry.class_code
+            ).filter(
+                TrafficEntry.block >= first,
+                TrafficEntry.block < stop
+            )
+        else:
+            query = db_session.query(
+                model.class_code,
+                func.sum(model.crz_entries),
+                func.sum(model.revenue)
+            ).filter(
+                model.period >= first,
+                model.period < stop
+            )
+        if group_code is not None:
+            query = query.filter(model.group_code == group_code)
+        if class_code is not None:
+            query = query.filter(model.class_code == class_code)
+        return query.group_by(model.class_code).all()
+
+    def frame_rows(self, start_block, num_blocks, num_frames):
+        """
+        (vehicle_class, is_peak, slot, detection_group, entries) rows for a
+        /realtime_series window. slot is the frame (see frame_bucket) when
+        the window has at least one block per frame, the block otherwise.
+        Windows whose frames are made of whole hours or days read the rollup.
+        """
+        rollup = rollup_for_frames(start_block, num_blocks, num_frames)
+        if rollup is not None:
+            model = rollup
+            size = rollup.blocks_per_period
+            slot = frame_bucket(rollup.period * size - start_block, num_blocks, num_frames)
+            in_window = (rollup.period >= start_block // size,
+                         rollup.period < (start_block + num_blocks) // size)
+        else:
+            model = TrafficEntry
+            if num_blocks >= num_frames:
+                slot = frame_bucket(TrafficEntry.block - start_block, num_blocks, num_frames)
+            else:
+                slot = TrafficEntry.block
+            in_window = (TrafficEntry.block >= start_block,
+                         TrafficEntry.block < start_block + num_blocks)
+
+        with read_session() as db_session:
+            dimensions = Dimensions.load(db_session.connection())
+            rows = db_session.query(
+                model.class_code,
+                model.is_peak,
+                slot.label("slot"),
+                model.group_code,
+                func.sum(model.crz_entries).label("vehicle_count")
+            ).filter(
+                *in_window
+            ).group_by(
+                model.class_code,
+                model.is_peak,
+                "slot",
+                model.group_code
+            ).all()
+        return [
+            (dimensions.classes[c], p, slot, dimensions.groups[g], total)
+            for c, p, slot, g, total in rows
+        ]
+
+    def class_prices(self):
+        """The vehicle_class tolls by class name, for pricing frame_rows."""
+        with read_session() as db_session:
+            return Dimensions.load(db_session.connection()).class_prices
+
+    def entries(self, limit):
+        """The first limit rows as /data dicts."""
+        with read_session() as db_session:
+            dimensions = Dimensions.load(db_session.connection())
+            return [
+                _entry_dict(e.id, e.datetime, e.is_peak, dimensions.classes[e.class_code],
+                            dimensions.groups[e.group_code], e.crz_entries, e.excluded_roadway_entries)
+                for e in db_session.query(TrafficEntry).limit(limit).all()
+            ]
+
+
+class Columns:
+    """
+    The exported columns (arrays, possibly memory-mapped) and their code
+    tables: classes and groups are the dimension names indexed by code, prices
+    the (off-peak, peak) toll per class code.
+    """
+
+    def __init__(self, arrays, classes, groups, prices, data_version):
+        self.arrays = arrays
+        self.classes = classes
+        self.groups = groups
+        self.prices = prices
+        self.data_version = data_version
+
+    def __getattr__(self, name):
+        try:
+            return self.arrays[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __len__(self):
+        return len(self.arrays["block"])
+
+    @staticmethod
+    def _rows(conn, start_block=None, end_block=None):
+        """traffic_entry rows in column order, of all blocks or of [start_block, end_block)."""
+        where, params = "", ()
+        if start_block is not None:
+            where, params = "WHERE block >= ? AND block < ? ", (start_block, end_block)
+        return conn.exec_driver_sql(
+            f"SELECT id, block, is_peak, class_code, group_code, crz_entries, "
+            f"excluded_roadway_entries FROM {TrafficEntry.__tablename__} {where}ORDER BY block, id",
+            params
+        ).all()
+
+    @classmethod
+    def export(cls, engine):
+        with engine.connect() as conn:
+            data_version = get_data_version(conn)
+            dimensions = Dimensions.load(conn)
+            rows = cls._rows(conn)
+        return cls._from_rows(rows, dimensions, data_version)
+
+    def updated(self, conn, ranges, data_version):
+        """
+        The columns with the rows of ranges (merged [start, end) block ranges)
+        read again from conn, so an append doesn't re-export the whole table.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for start, end in ranges:
+            keep[self.range(start, end)] = False
+        fresh = self._from_rows([row for start, end in ranges for row in self._rows(conn, start, end)],
+                                Dimensions.load(conn), data_version)
+        arrays = {name: np.concatenate([self.arrays[name][keep], fresh.arrays[name]]) for name in COLUMNS}
+        order = np.lexsort((arrays["id"], arrays["block"]))
+        arrays = {name: column[order] for name, column in arrays.items()}
+        return Columns(arrays, fresh.classes, fresh.groups, fresh.prices, data_version)
+
+    @classmethod
+    def _from_rows(cls, rows, dimensions, data_version):
+        ids, blocks, peaks, class_codes, group_codes, entries, excluded = zip(*rows) if rows else ((),) * 7
+        arrays = {
+            "id": np.asarray(ids, dtype=np.int64),
+            "block": np.asarray(blocks, dtype=np.int64),
+            "is_peak": np.asarray(peaks, dtype=np.int8),
+            "class_code": np.asarray(class_codes, dtype=np.int16),
+            "group_code": np.asarray(group_codes, dtype=np.int16),
+            "crz_entries": np.asarray(entries, dtype=np.int64),
+            "excluded_roadway_entries": np.asarray(excluded, dtype=np.int64),
+        }
+        classes = [dimensions.classes.get(code) for code in range(max(dimensions.classes, default=-1) + 1)]
+        groups = [dimensions.groups.get(code) for code in range(max(dimensions.groups, default=-1) + 1)]
+        prices = [list(dimensions.prices.get(code, (0, 0))) for code in range(len(classes))]
+        return cls(arrays, classes, groups, prices, data_version)
+
+    def save(self, directory):
+        # Columns first, meta.json last: readers trust the columns once meta says they're current.
+        # Tmp names are per process, as in AggregateCube.save.
+        os.makedirs(directory, exist_ok=True)
+        for name in COLUMNS:
+            path = os.path.join(directory, f"{name}.npy")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, self.arrays[name])
+            os.replace(tmp_path, path)
+        meta_path = os.path.join(directory, "meta.json")
+        meta_tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(meta_tmp, "w") as f:
+            json.dump({"classes": self.classes, "groups": self.groups, "prices": self.prices,
+                       "data_version": self.data_version, "rows": len(self)}, f)
+        os.replace(meta_tmp, meta_path)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            meta = json.load(f)
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in COLUMNS
+        }
+        return cls(arrays, meta["classes"], meta["groups"], meta["prices"], meta["data_version"])
+
+    def range(self, start_block, end_block):
+        """Slice of the rows in [start_block, end_block), by binary search on block."""
+        lo, hi = np.searchsorted(self.arrays["block"], [start_block, end_block], side="left")
+        return slice(int(lo), int(hi))
+
+
+def _group_sum(keys, values):
+    """Unique key rows and the sum of values per key row."""
+    if not len(values):
+        return np.zeros((0, keys.shape[1]), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=values, minlength=len(unique)).astype(np.int64)
+
+
+class ColumnarBackend:
+    """
+    Memory-mapped columns in directory, exported from the database on first
+    use and updated over the ingested block ranges when the saved export is
+    older than the data. clear() drops them, so it can be registered with a
+    DataVersionWatcher.
+    """
+    name = "columnar"
+
+    def __init__(self, engine_source, directory):
+        self.engine_source = engine_source
+        self.directory = directory
+        self._columns = None
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._columns = None
+
+    def columns(self):
+        with self._lock:
+            if self._columns is None:
+                self._columns = self._load_or_export()
+            return self._columns
+
+    def _load_or_export(self):
+        engine = self.engine_source()
+        try:
+            with engine.connect() as conn:
+                data_version = get_data_version(conn)
+        except OperationalError:
+            data_version = 0
+
+        if os.path.exists(os.path.join(self.directory, "meta.json")):
+            columns = Columns.load(self.directory)
+            if columns.data_version == data_version:
+                return columns
+            if columns.data_version < data_version:
+                # Only re-read the block ranges ingested since, if they're recorded
+                with engine.connect() as conn:
+                    ranges = changed_ranges(conn, columns.data_version, data_version)
+                    if ranges is not None:
+                        columns = columns.updated(conn, merge_ranges(ranges), data_version)
+                if ranges is not None:
+                    columns.save(self.directory)
+                    return Columns.load(self.directory)
+        try:
+            columns = Columns.export(engine)
+        except OperationalError:
+            # No traffic_entry table yet
+            return None
+        columns.save(self.directory)
+        return Columns.load(self.directory)
+
+    def _filtered(self, start_block, end_block, detection_group=None, vehicle_class=None):
+        columns = self.columns()
+        if columns is None:
+            return None, None
+        rows = columns.range(start_block, end_block)
+        mask = np.ones(rows.stop - rows.start, dtype=bool)
+        if detection_group:
+            if detection_group not in columns.groups:
+                return columns, None
+            mask &= columns.group_code[rows] == columns.groups.index(detection_group)
+        if vehicle_class:
+            if vehicle_class not in columns.classes:
+                return columns, None
+            mask &= columns.class_code[rows] == columns.classes.index(vehicle_class)
+        return columns, np.arange(rows.start, rows.stop)[mask]
+
+    def class_totals(self, start_block, end_block, detection_group=None, vehicle_class=None):
+        columns, index = self._filtered(start_block, end_block, detection_group, vehicle_class)
+        if index is None:
+            return []
+        class_codes = columns.class_code[index]
+        entries = columns.crz_entries[index]
+        tolls = np.asarray(columns.prices, dtype=np.float64).reshape(-1, 2)[class_codes, columns.is_peak[index]]
+        codes = np.unique(class_codes)
+        inverse = np.searchsorted(codes, class_codes)
+        vehicles = np.bincount(inverse, weights=entries, minlength=len(codes))
+        revenue = np.bincount(inverse, weights=entries * tolls, minlength=len(codes))
+        return [
+            (columns.classes[c], int(total), float(money))
+            for c, total, money in zip(codes.tolist(), vehicles.tolist(), revenue.tolist())
+        ]
+
+    def frame_rows(self, start_block, num_blocks, num_frames):
+        columns, index = self._filtered(start_block, start_block + num_blocks)
+        if index is None:
+            return []
+        blocks = columns.block[index]
+        if num_blocks >= num_frames:
+            slots = frame_bucket(blocks - start_block, num_blocks, num_frames)
+        else:
+            slots = blocks
+        keys = np.stack([columns.class_code[index], columns.is_peak[index], slots, columns.group_code[index]], axis=1)
+        unique, sums = _group_sum(keys, columns.crz_entries[index])
+        return [
+            (columns.classes[c], p, slot, columns.groups[g], total)
+            for (c, p, slot, g), total in zip(unique.tolist(), sums.tolist())
+        ]
+
+    def class_prices(self):
+        columns = self.columns()
+        if columns is None:
+            return {}
+        return {name: tuple(price) for name, price in zip(columns.classes, columns.prices) if name is not None}
+
+    def entries(self, limit):
+        columns = self.columns()
+        if columns is None:
+            return []
+        # /data lists rows in id order; only the smallest ids need sorting
+        ids = np.asarray(columns.id)
+        if limit < len(ids):
+            candidates = np.argpartition(ids, limit)[:limit]
+        else:
+            candidates = np.arange(len(ids))
+        order = candidates[np.argsort(ids[candidates], kind="stable")]
+        return [
+            _entry_dict(
+                int(columns.id[i]),
+                from_block(int(columns.block[i])).strftime(DATETIME_FORMAT),
+                int(columns.is_peak[i]),
+                columns.classes[columns.class_code[i]],
+                columns.groups[columns.group_code[i]],
+                int(columns.crz_entries[i]),
+                int(columns.excluded_roadway_entries[i]),
+            )
+            for i in order.tolist()
+        ]
+
+
+def make_backend(name, engine_source, directory):
+    if name == ColumnarBackend.name:
+        return ColumnarBackend(engine_source, directory)
+    if name == SQLiteBackend.name:
+        return SQLiteBackend()
+    raise ValueError(f"Unknown storage backend {name!r}")
+
+
+if __name__ == '__main__':
+    from main import app, COLUMNS_DIR
+    from database import readonly_engine
+
+    with app.app_context():
+        columns = Columns.export(readonly_engine())
+        columns.save(COLUMNS_DIR)
+        print(f"Saved {len(columns):,} rows x {len(COLUMNS)} columns to {COLUMNS_DIR}.")
@@ -1,9 +1,37 @@
 import pytest
 import json
-from main import app, parse_info_json, build_spawn_js_from_timestepdata
+
+@pytest.fixture(scope="session", autouse=True)
+def traffic_db(tmp_path_factory):
+    """
+    Two weeks of bench.py's synthetic rows, loaded into a traffic.db of its
+    own. main.py is pointed at it before it's first imported, so its cube,
+    columns and uploads are kept beside it too, never under instance/.
+    """
+    from sqlalchemy import create_engine
+    from bench import generate_congestion_csv
+    from ingest import bulk_load_csv
+
+    directory = tmp_path_factory.mktemp("traffic")
+    csv_path = directory / "congestion.csv"
+    db_path = directory / "traffic.db"
+    generate_congestion_csv(csv_path, days=14, start="2025-02-28 00:00:00")
+    engine = create_engine(f"sqlite:///{db_path}")
+    bulk_load_csv(str(csv_path), engine)
+    engine.dispose()
+
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("TRAFFIC_DB", str(db_path))
+        monkeypatch.setenv("SECRET_KEY", "test")
+        yield db_path
 
 @pytest.fixture
-def client():
+def app():
+    from main import app
+    return app
+
+@pytest.fixture
+def client(app):
     with app.test_client() as client:
         yield client
 
@@ -30,10 +58,676 @@ def test_save_timestep(client):
     response = client.post('/save_timestep', json=test_data)
 
     # Assert the response status code is 200 (success)
-    assert response.status_code == 500
+    assert response.status_code == 200
+    frame_id = response.get_json()["frame_id"]
+
+    # The uploaded frames are kept server-side and can be rendered by id
+    response = client.get(f'/?frame_id={frame_id}')
+    assert response.status_code == 200
     
 def test_index(client):
     response = client.get('/')
     assert response.status_code == 200
     assert b"Map" in response.data  # Check if the map is rendered in the response
 
+
+def test_frames_to_json_keeps_realtime_series_shape():
+    from datetime import datetime
+    from frames import build_frame_arrays, frames_to_json
+    from models import to_block
+
+    start = datetime(2025, 3, 12, 8, 0, 0)
+    start_block = to_block(start)
+    rows = [
+        ("Car", 1, start_block, "Lincoln Tunnel", 30),
+        ("Taxi", 1, start_block, "Lincoln Tunnel", 10),
+        ("Car", 1, start_block + 1, "Holland Tunnel", 6),
+    ]
+
+    # 30min = 3 blocks over 6 frames, so every frame gets half a block
+    tolls = {"Car": (2.25, 9), "Taxi": (0.75, 0.75)}
+    frames = frames_to_json(build_frame_arrays(rows, tolls, start, start_block, 3, 6))
+
+    assert len(frames) == 6
+    assert frames[0]["timestamp"] == "2025-03-12 08:00:00"
+    assert set(frames[0]) == {"timestamp", "locations"}  # the marker scale is per class, in the spawn bundle
+    lincoln = frames[1]["locations"]["Lincoln Tunnel"]
+    assert lincoln["current"]["by_class"]["Car"] == {"vehicles": 15.0, "revenue": 135.0}
+    assert lincoln["current"]["total_vehicles"] == 20.0
+    assert lincoln["cumulative"]["by_class"]["Taxi"]["vehicles"] == 10.0
+    assert "Holland Tunnel" not in frames[1]["locations"]
+    assert frames[2]["locations"]["Holland Tunnel"]["current"]["total_revenue"] == 27.0
+    assert frames[5]["locations"] == {}
+
+def test_windows_without_rows_are_empty_frames(client):
+    from datetime import datetime
+    from frames import build_frame_arrays, build_bucketed_frame_arrays
+
+    start = datetime(2024, 6, 1)
+    assert build_frame_arrays([], {}, start, 0, 3, 6).vehicles.shape == (6, 0, 0)
+    assert build_bucketed_frame_arrays([], {}, start, 144, 20).revenue.shape == (20, 0, 0)
+    for interval in ("1hr", "1day"):
+        response = client.get(f'/realtime_series?interval={interval}&datetime_start=2024-06-01 00:00:00')
+        assert response.status_code == 200
+        assert all(frame["locations"] == {} for frame in response.get_json())
+
+def test_build_spawn_schedule_packs_counts_per_route():
+    from spawn_schedule import build_spawn_schedule
+
+    route = {"start": [40.0, -74.0], "end": [40.1, -74.1], "icon_url": "/static/vehicles/car_icon_0.png"}
+    timestep_data = [
+        {"index": 0, "timestep": "2025-03-12 08:00:00",
+         "vehicles": [{"location": "Lincoln Tunnel", "count": 500}]},
+        {"index": 1, "timestep": "2025-03-12 08:10:00",
+         "vehicles": [{"location": "Lincoln Tunnel", "count": 2}, {"location": "Nowhere", "count": 3}]},
+    ]
+
+    schedule = build_spawn_schedule(timestep_data, {"Lincoln Tunnel": route}.get)
+
+    assert schedule["routes"] == [route]
+    assert schedule["spawns"] == [0, 0, 500, 1, 0, 2]
+    assert schedule["timesteps"] == ["2025-03-12 08:00:00", "2025-03-12 08:10:00"]
+
+def test_result_cache_lru_and_data_version():
+    from cache import ResultCache, DataVersionWatcher, normalize_params
+
+    version = {"value": 1}
+    watcher = DataVersionWatcher(lambda: version["value"], check_interval=0)
+    cache = watcher.register(ResultCache(max_entries=2))
+    watcher.check()
+
+    assert normalize_params("filter", b="x", a=" 1 ", c="") == ("filter", ("a", "1"), ("b", "x"))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    version["value"] = 2
+    watcher.check()
+    assert len(cache) == 0
+    assert cache.stats()["invalidations"] == 1
+
+def test_aggregate_cube_range_totals():
+    from cube import AggregateCube
+
+    rows = [
+        (100, "Lincoln Tunnel", "Car", 1, 10),
+        (101, "Lincoln Tunnel", "Car", 0, 4),
+        (101, "Holland Tunnel", "Taxi", 1, 7),
+        (103, "Lincoln Tunnel", "Car", 1, 1),
+    ]
+    cube = AggregateCube.from_rows(rows, {"Car": (2.25, 9), "Taxi": (0.75, 0.75)})
+
+    vehicles, revenue = cube.class_totals(100, 102)
+    assert vehicles == {"Car": 14, "Taxi": 7}
+    assert revenue == {"Car": 10 * 9 + 4 * 2.25, "Taxi": 7 * 0.75}
+
+    vehicles, _ = cube.class_totals(101, 200, detection_group="Lincoln Tunnel")
+    assert vehicles == {"Car": 5}
+    assert cube.class_totals(0, 100) == ({}, {})
+
+def test_cube_saves_from_concurrent_workers(tmp_path):
+    import numpy as np
+    from concurrent.futures import ProcessPoolExecutor
+    from cube import AggregateCube
+
+    rows = [(100, "Lincoln Tunnel", "Car", 1, 10), (103, "Holland Tunnel", "Taxi", 0, 2)]
+    cube = AggregateCube.from_rows(rows, {})
+    # Workers rebuilding after the same bump all save to the one directory
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        list(pool.map(cube.save, [str(tmp_path)] * 16))
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["meta.json", "prefix.npy"]
+    assert np.array_equal(AggregateCube.load(str(tmp_path)).prefix, cube.prefix)
+
+def test_cube_and_frames_price_with_the_vehicle_class_tolls(tmp_path):
+    from sqlalchemy import create_engine
+    from bench import generate_congestion_csv
+    from cube import AggregateCube
+    from frames import price_matrix
+    from ingest import bulk_load_csv
+    from models import Dimensions
+
+    generate_congestion_csv(tmp_path / "day.csv", days=1)
+    engine = create_engine(f"sqlite:///{tmp_path / 'traffic.db'}")
+    bulk_load_csv(str(tmp_path / "day.csv"), engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("UPDATE vehicle_class SET off_peak_price = 50, peak_price = 100 WHERE name = 'Car'")
+    with engine.connect() as conn:
+        assert price_matrix(["Car", "Unknown"], Dimensions.load(conn).class_prices).tolist() == [[50, 100], [0, 0]]
+        expected = conn.exec_driver_sql(
+            "SELECT SUM(crz_entries * CASE WHEN is_peak = 1 THEN peak_price ELSE off_peak_price END) "
+            "FROM traffic_entry JOIN vehicle_class ON vehicle_class.code = traffic_entry.class_code "
+            "WHERE vehicle_class.name = 'Car'"
+        ).scalar()
+
+    AggregateCube.build(engine).save(str(tmp_path / "cube"))
+    cube = AggregateCube.load(str(tmp_path / "cube"))
+    _, revenue = cube.class_totals(cube.first_block, cube.end_block, vehicle_class="Car")
+    assert revenue["Car"] == pytest.approx(expected)
+    engine.dispose()
+
+def test_extreme_windows_uses_sliding_sums():
+    from cube import AggregateCube
+    from extremes import extreme_windows
+    from models import to_block
+
+    start = to_block("2025-03-12 00:00:00")
+    counts = [5, 1, 1, 9, 9, 2, 0, 4]
+    cube = AggregateCube.from_rows([
+        (start + i, "Lincoln Tunnel", "Car", 0, n) for i, n in enumerate(counts)
+    ], {})
+
+    quiet = extreme_windows(cube, 2, start, start + len(counts), "Lincoln Tunnel", k=2)
+    assert [w["vehicles"] for w in quiet] == [2, 2]
+    assert quiet[0]["start"] == "2025-03-12 00:10:00"
+    assert quiet[1]["start"] == "2025-03-12 00:50:00"
+
+    busy = extreme_windows(cube, 2, start, start + len(counts), k=1, busiest=True)
+    assert busy == [{"start": "2025-03-12 00:30:00", "end": "2025-03-12 00:50:00", "vehicles": 18}]
+
+def test_extremes_rejects_bad_k_and_skips_empty_series(client):
+    import warnings
+    import numpy as np
+    from extremes import frame_extremes
+    from frames import FrameArrays
+
+    url = '/extremes?window=1hr&datetime_start=2025-03-05 00:00:00&datetime_end=2025-03-06 00:00:00'
+    assert client.get(f'{url}&k=2').status_code == 200
+    assert client.get(f'{url}&k=0').status_code == 400
+    assert client.get(f'{url}&k=-1').status_code == 400
+
+    # Taxi has no rows at all: left out, without an "All-NaN slice" warning
+    arrays = FrameArrays(["t0", "t1"], ["Lincoln Tunnel"], ["Car", "Taxi"],
+                         np.array([[[3.0, 0.0]], [[5.0, 0.0]]]), np.zeros((2, 1, 2)),
+                         np.array([[[True, False]], [[True, False]]]))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        extremes = frame_extremes(arrays)
+    assert list(extremes["classes"]) == ["Car"] and extremes["classes"]["Car"]["percentiles"]["50"] == 4.0
+
+def test_vehicle_selection_is_per_client(app):
+    frames = [{
+        "timestamp": "2025-04-05 00:00:00",
+        "locations": {"Brooklyn Bridge": {"current": {"by_class": {
+            "Car": {"vehicles": 3, "revenue": 27},
+            "Taxi": {"vehicles": 2, "revenue": 1.5}
+        }}}}
+    }]
+    taxi_client = app.test_client()
+    car_client = app.test_client()
+    frame_id = taxi_client.post('/save_timestep', json={"frames_data": frames, "chosen_vehicle": "Taxi"}).get_json()["frame_id"]
+    car_client.post('/save_timestep', json={"frame_id": frame_id, "chosen_vehicle": "Car"})
+
+    # Each client keeps its own class, the second save doesn't overwrite the first
+    taxi = taxi_client.get('/get_updated_spawns').get_json()["schedule"]
+    car = car_client.get('/get_updated_spawns').get_json()["schedule"]
+    assert "taxi_icon" in taxi["routes"][0]["icon_url"] and taxi["spawns"][2] == 2
+    assert "car_icon" in car["routes"][0]["icon_url"] and car["spawns"][2] == 3
+
+    # Saving without frames is a client error, an unknown id isn't found
+    assert car_client.post('/save_timestep', json={"chosen_vehicle": "Car"}).status_code == 400
+    assert car_client.post('/save_timestep', json={"frame_id": "1hr:x", "chosen_vehicle": "Car"}).status_code == 404
+
+def test_uploads_are_capped_and_pruned(app, monkeypatch):
+    import os
+    from main import UPLOAD_DIR
+
+    client = app.test_client()
+    frame = lambda n: {"timestamp": f"2025-04-05 00:{n:02d}:00", "locations": {}}
+    monkeypatch.setitem(app.config, "MAX_UPLOADS", 2)
+    for n in range(3):
+        assert client.post('/save_timestep', json={"frames_data": [frame(n)]}).status_code == 200
+    assert len([name for name in os.listdir(UPLOAD_DIR) if name.endswith(".json")]) == 2
+
+    monkeypatch.setitem(app.config, "MAX_UPLOAD_FRAMES", 2)
+    assert client.post('/save_timestep', json={"frames_data": [frame(n) for n in range(3)]}).status_code == 413
+    assert client.post('/save_timestep', json={"frames_data": "x"}).status_code == 400
+    monkeypatch.setitem(app.config, "MAX_CONTENT_LENGTH", 100)
+    assert client.post('/save_timestep', json={"frames_data": [frame(0)] * 10}).status_code == 413
+
+def test_secret_key_is_shared_by_workers(tmp_path, monkeypatch):
+    from concurrent.futures import ProcessPoolExecutor
+    from main import load_secret_key
+
+    monkeypatch.delenv("SECRET_KEY")
+    path = str(tmp_path / "secret_key")
+    with ProcessPoolExecutor(max_workers=4) as pool:
+        keys = set(pool.map(load_secret_key, [path] * 16))
+    assert len(keys) == 1 and len(keys.pop()) == 64
+    assert [p.name for p in tmp_path.iterdir()] == ["secret_key"]
+
+def test_synthetic_dataset_is_seeded(tmp_path):
+    from bench import generate_congestion_csv
+    from ingest import iter_csv_chunks
+
+    first, second = tmp_path / "a.csv", tmp_path / "b.csv"
+    rows = generate_congestion_csv(first, days=1, seed=7)
+    generate_congestion_csv(second, days=1, seed=7)
+
+    assert rows == 144 * 12 * 6
+    assert first.read_bytes() == second.read_bytes()
+    # The file parses with the real loader, peak flags included
+    parsed = [row for chunk in iter_csv_chunks(first) for row in chunk]
+    assert len(parsed) == rows and {row[3] for row in parsed} == {0, 1}
+
+def test_metrics_endpoint_and_server_timing(client, app):
+    app.config['SERVER_TIMING'] = True
+    try:
+        response = client.get('/realtime_series?interval=1hr&datetime_start=2025-03-05 08:00:00')
+    finally:
+        app.config['SERVER_TIMING'] = False
+    assert response.status_code == 200
+    assert "total;dur=" in response.headers["Server-Timing"]
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'http_request_duration_seconds_count{route="/realtime_series",method="GET",status="200"}' in text
+    assert 'http_response_size_bytes_count{route="/realtime_series"}' in text
+    assert "# TYPE sql_statements_total counter" in text
+
+def test_realtime_series_etag_and_compression(client):
+    url = '/realtime_series?interval=1day&datetime_start=2025-03-05 08:00:00'
+    first = client.get(url)
+    assert first.status_code == 200 and first.headers["Cache-Control"] == "no-cache"
+
+    # Revalidating with the ETag costs a bodyless 304
+    again = client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+    assert again.status_code == 304 and again.data == b""
+
+    zipped = client.get(f'{url}&v={first.headers["X-Data-Version"]}', headers={"Accept-Encoding": "gzip"})
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert "immutable" in zipped.headers["Cache-Control"]
+    import gzip
+    assert json.loads(gzip.decompress(zipped.data)) == first.get_json()
+
+def test_long_windows_are_bucketed_per_frame(app):
+    from main import compute_frame_arrays, compute_window_summary, INTERVAL_CONFIG
+    from models import to_block
+
+    start_block = to_block("2025-03-05 08:00:00")
+    with app.app_context():
+        arrays = compute_frame_arrays("1day", start_block)
+        summary = compute_window_summary(f"1day:{start_block}")
+    # One frame per bucket, and together the buckets hold every block of the window
+    assert arrays.vehicles.shape[0] == INTERVAL_CONFIG["1day"]["duration"]
+    assert round(arrays.vehicles.sum()) == sum(stats["vehicles"] for stats in summary.values())
+
+def test_spawn_bundle_matches_per_class_schedules(client):
+    from main import parse_frames, route_registry
+    from spawn_schedule import build_spawn_schedule
+
+    with open("info.json", "r") as f:
+        frames = json.load(f)
+    bundle = client.get('/spawn_bundle?frame_id=default').get_json()
+
+    assert bundle["frame_id"] == "default"
+    for vclass in ("Car", "Taxi", "Buses"):
+        expected = build_spawn_schedule(parse_frames(frames, vclass), route_registry.lookup(vclass),
+                                        speed=4000, spawn_window=20000, step_delay=2000)
+        assert bundle["classes"][vclass] == expected
+
+def test_marker_budget_scales_busy_windows():
+    from spawn_schedule import build_spawn_schedule, apportion
+
+    route = lambda name: {"start": [0, 0], "end": [1, 1], "icon_url": f"/{name}.png"}
+    busy = [{"index": 0, "timestep": "t0",
+             "vehicles": [{"location": "A", "count": 3000}, {"location": "B", "count": 1000},
+                          {"location": "C", "count": 1}]}]
+    schedule = build_spawn_schedule(busy, route, speed=4000, spawn_window=20000, max_active_markers=100)
+
+    # 100 markers alive at once -> 500 icons per 20s step -> one icon per 9 vehicles
+    assert schedule["scale"] == 9
+    # 445 icons split by largest remainder, C's single vehicle rounds away
+    assert schedule["spawns"] == [0, 0, 334, 0, 1, 111]
+    assert apportion([5, 5, 5], 2) == [3, 3, 2]
+
+def test_prebaked_store_is_content_addressed(tmp_path):
+    import os
+    from prebake import PrebakedStore, write_object
+
+    digest = write_object(str(tmp_path), b'{"a":1}')
+    assert write_object(str(tmp_path), b'{"a":1}') == digest
+    with open(tmp_path / "index.json", "w") as f:
+        json.dump({"data_version": 3, "windows": {"1hr:100": {"frames": digest}}}, f)
+
+    version = {"current": 3}
+    store = PrebakedStore(str(tmp_path), lambda: version["current"])
+    assert store.load(store.lookup("1hr:100")["frames"]) == {"a": 1}
+    # Baked for an older data version: not served
+    version["current"] = 4
+    assert store.lookup("1hr:100") is None
+    assert len(os.listdir(tmp_path / "objects")) == 1
+
+def test_columnar_backend_matches_sqlite(tmp_path, app):
+    from database import readonly_engine
+    from models import to_block
+    from storage import ColumnarBackend, SQLiteBackend
+
+    start_block = to_block("2025-03-05 08:00:00")
+    with app.app_context():
+        columnar = ColumnarBackend(readonly_engine, str(tmp_path))
+        sqlite = SQLiteBackend()
+        for num_blocks, num_frames in ((1, 3), (144, 20)):
+            assert sorted(columnar.frame_rows(start_block, num_blocks, num_frames)) == \
+                sorted(tuple(row) for row in sqlite.frame_rows(start_block, num_blocks, num_frames))
+        # Revenue is summed in a different order (rollups vs. one bincount)
+        columnar_totals = sorted(columnar.class_totals(start_block, start_block + 500, "Lincoln Tunnel"))
+        sqlite_totals = sorted(sqlite.class_totals(start_block, start_block + 500, "Lincoln Tunnel"))
+        assert [row[:2] for row in columnar_totals] == [tuple(row[:2]) for row in sqlite_totals]
+        assert [row[2] for row in columnar_totals] == pytest.approx([row[2] for row in sqlite_totals])
+        assert columnar.entries(12) == sqlite.entries(12)
+        assert columnar.class_prices() == sqlite.class_prices()
+
+def test_migration_encodes_dimension_columns(tmp_path):
+    from sqlalchemy import create_engine
+    from migrations import upgrade_traffic_db
+    from models import Dimensions
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            "CREATE TABLE traffic_entry (id INTEGER PRIMARY KEY, datetime VARCHAR(100), is_peak INTEGER, "
+            "vehicle_class VARCHAR(50), detection_group VARCHAR(50), crz_entries INTEGER, "
+            "excluded_roadway_entries INTEGER)")
+        conn.exec_driver_sql(
+            "INSERT INTO traffic_entry VALUES (1, '2025-03-05 08:00:00', 1, 'Car', 'Lincoln Tunnel', 7, 0), "
+            "(2, '2025-03-05 08:10:00', 1, 'Hovercraft', 'Brooklyn Bridge', 2, 1)")
+
+    upgrade_traffic_db(engine)
+    upgrade_traffic_db(engine)
+
+    with engine.connect() as conn:
+        dimensions = Dimensions.load(conn)
+        rows = conn.exec_driver_sql("SELECT id, class_code, group_code FROM traffic_entry ORDER BY id").all()
+        columns = {row[1] for row in conn.exec_driver_sql("PRAGMA table_info(traffic_entry)")}
+    assert "vehicle_class" not in columns
+    assert [(dimensions.classes[c], dimensions.groups[g]) for _, c, g in rows] == \
+        [("Car", "Lincoln Tunnel"), ("Hovercraft", "Brooklyn Bridge")]
+    assert dimensions.prices[rows[0][1]] == (2.25, 9)
+    assert dimensions.prices[rows[1][1]] == (0, 0)
+
+def test_rollups_cover_long_windows(client, app):
+    from database import readonly_engine
+    from models import TrafficEntry, HourlyTotal, DailyTotal, to_block
+    from rollups import split_range, rollup_for_frames
+    from storage import SQLiteBackend
+
+    start_block = to_block("2025-03-05 08:10:00")
+    pieces = split_range(start_block, start_block + 500)
+    assert [model for model, _, _ in pieces] == [TrafficEntry, HourlyTotal, DailyTotal, HourlyTotal, TrafficEntry]
+    assert rollup_for_frames(to_block("2025-03-01 00:00:00"), 4320, 120) is HourlyTotal
+    assert rollup_for_frames(start_block, 1008, 30) is None
+
+    with app.app_context():
+        # Rollup pieces add up to what the raw rows give
+        with readonly_engine().connect() as conn:
+            raw = conn.exec_driver_sql(
+                "SELECT SUM(crz_entries) FROM traffic_entry WHERE block >= ? AND block < ?",
+                (start_block, start_block + 500)).scalar()
+        assert sum(row[1] for row in SQLiteBackend().class_totals(start_block, start_block + 500)) == raw
+
+    response = client.get('/calendar_totals?month=2025-03')
+    assert response.status_code == 200
+    days = response.get_json()["days"]
+    assert "2025-03-05" in days and all(day.startswith("2025-03-") for day in days)
+    assert client.get('/calendar_totals?month=March').status_code == 400
+
+def test_precompute_matches_serial_build(tmp_path, app):
+    import numpy as np
+    from cube import AggregateCube
+    from database import readonly_engine
+    from models import db
+    from precompute import precompute, partitions
+
+    assert partitions(150, 400, 144) == [(144, 288), (288, 432)]
+    with app.app_context():
+        def rollup_rows():
+            with db.engine.connect() as conn:
+                return [conn.exec_driver_sql(f"SELECT * FROM {table} ORDER BY 1, 2, 3, 4").all()
+                        for table in ("traffic_hourly", "traffic_daily")]
+
+        before = rollup_rows()
+        stats = precompute(db.engine, str(tmp_path), partition="day", workers=2)
+        after = rollup_rows()
+        assert [[row[:5] for row in rows] for rows in after] == [[row[:5] for row in rows] for rows in before]
+        assert [row[5] for row in after[1]] == pytest.approx([row[5] for row in before[1]])
+        assert [timing["start"] for timing in stats["partitions"]] == \
+            sorted(timing["start"] for timing in stats["partitions"])
+        assert np.array_equal(AggregateCube.load(str(tmp_path)).prefix, AggregateCube.build(readonly_engine()).prefix)
+
+def test_precompute_reads_its_own_database_and_rechecks_the_version(tmp_path, monkeypatch):
+    import numpy as np
+    from sqlalchemy import create_engine
+    import precompute as precompute_module
+    from bench import generate_congestion_csv
+    from cube import AggregateCube
+    from ingest import bulk_load_csv
+    from models import get_data_version, bump_data_version
+
+    # Not the app's TRAFFIC_DB: the workers have to read this one too
+    generate_congestion_csv(tmp_path / "other.csv", days=3, start="2025-06-01 00:00:00")
+    engine = create_engine(f"sqlite:///{tmp_path / 'other.db'}")
+    bulk_load_csv(str(tmp_path / "other.csv"), engine)
+
+    # An ingest landing while the first pass is aggregating
+    partitions = precompute_module.partitions
+    calls = []
+    def partitions_then_ingest(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            with engine.begin() as conn:
+                bump_data_version(conn)
+        return partitions(*args)
+    monkeypatch.setattr(precompute_module, "partitions", partitions_then_ingest)
+
+    precompute_module.precompute(engine, str(tmp_path / "cube"), workers=2)
+    cube = AggregateCube.load(str(tmp_path / "cube"))
+    with engine.connect() as conn:
+        assert cube.data_version == get_data_version(conn)
+    assert len(calls) == 2
+    assert np.array_equal(cube.prefix, AggregateCube.build(engine).prefix)
+    engine.dispose()
+
+def test_drop_directory_appends_and_scopes_invalidation(tmp_path, monkeypatch):
+    import numpy as np
+    from sqlalchemy import create_engine
+    from cache import ResultCache, DataVersionWatcher
+    from cube import AggregateCube, CubeHolder
+    from ingest import ingest_drop_directory
+    from models import to_block, get_data_version, changed_ranges
+    from prebake import PrebakedStore
+    from storage import Columns, ColumnarBackend
+
+    header = "Index,Datetime,Is Peak,Vehicle Class,Detection Group,CRZ Entries,Excluded Roadway Entries\n"
+    drop = tmp_path / "incoming"
+    drop.mkdir()
+    engine = create_engine(f"sqlite:///{tmp_path / 'traffic.db'}")
+
+    (drop / "day1.csv").write_text(header + "1,2025-03-05 08:00:00,1,Car,Lincoln Tunnel,7,0\n"
+                                            "2,2025-03-05 08:10:00,1,Taxi,Lincoln Tunnel,3,0\n")
+    assert [stats["inserted"] for stats in ingest_drop_directory(str(drop), engine)] == [2]
+    assert (drop / "done" / "day1.csv").exists() and not (drop / "day1.csv").exists()
+    cubes = CubeHolder(lambda: engine, str(tmp_path / "cube"))
+    columnar = ColumnarBackend(lambda: engine, str(tmp_path / "columns"))
+    cubes.get(), columnar.columns()
+
+    # Row 2 again plus one new row a day later: only the new row is appended
+    (drop / "day2.csv").write_text(header + "2,2025-03-05 08:10:00,1,Taxi,Lincoln Tunnel,3,0\n"
+                                            "3,2025-03-06 09:00:00,1,Car,Holland Tunnel,5,0\n")
+    assert [stats["inserted"] for stats in ingest_drop_directory(str(drop), engine)] == [1]
+    new_block = to_block("2025-03-06 09:00:00")
+    with engine.connect() as conn:
+        assert get_data_version(conn) == 2
+        assert changed_ranges(conn, 1, 2) == [(new_block, new_block + 1)]
+        assert changed_ranges(conn, 0, 2) == [(to_block("2025-03-05 08:00:00"), to_block("2025-03-05 08:10:00") + 1),
+                                              (new_block, new_block + 1)]
+        assert conn.exec_driver_sql("SELECT SUM(crz_entries) FROM traffic_daily").scalar() == 15
+
+    # The saved cube and columns are brought up to date over that range, not rebuilt
+    expected_cube, expected_columns = AggregateCube.build(engine), Columns.export(engine)
+    monkeypatch.setattr(AggregateCube, "build", None)
+    monkeypatch.setattr(Columns, "export", None)
+    cubes.clear()
+    columnar.clear()
+    cube, columns = cubes.get(), columnar.columns()
+    assert cube.data_version == columns.data_version == 2
+    assert (cube.first_block, cube.groups) == (expected_cube.first_block, expected_cube.groups)
+    assert np.array_equal(cube.prefix, expected_cube.prefix)
+    assert all(np.array_equal(columns.arrays[name], expected_columns.arrays[name]) for name in columns.arrays)
+
+    # Windows baked at version 1 stay servable unless the append touched them
+    (tmp_path / "prebaked").mkdir()
+    (tmp_path / "prebaked" / "index.json").write_text(json.dumps({"data_version": 1, "windows": {
+        "old": {"frames": "a"}, "new": {"frames": "b"}}}))
+    window_blocks = {"old": (new_block - 100, new_block), "new": (new_block - 1, new_block + 5)}
+    baked = PrebakedStore(str(tmp_path / "prebaked"), lambda: 2, window_range=window_blocks.get,
+                          changes_source=lambda old, new: [(new_block, new_block + 1)])
+    assert baked.lookup("old") == {"frames": "a"} and baked.lookup("new") is None
+
+    # Only cached results overlapping the changed range are dropped
+    version = {"value": 1}
+    watcher = DataVersionWatcher(lambda: version["value"], check_interval=0,
+                                 changes_source=lambda old, new: [(new_block, new_block + 1)])
+    cache = watcher.register(ResultCache(), key_range=lambda key: key)
+    watcher.check()
+    cache.put((new_block - 10, new_block), "before")
+    cache.put((new_block - 10, new_block + 10), "around")
+    version["value"] = 2
+    watcher.check()
+    assert (new_block - 10, new_block) in cache and (new_block - 10, new_block + 10) not in cache
+
+def test_resumed_load_rebuilds_indexes(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine
+    import ingest
+
+    header = "Index,Datetime,Is Peak,Vehicle Class,Detection Group,CRZ Entries,Excluded Roadway Entries\n"
+    path = tmp_path / "day.csv"
+    path.write_text(header + "".join(f"{i},2025-03-05 08:{i:02d}:00,1,Car,Lincoln Tunnel,1,0\n" for i in range(6)))
+    engine = create_engine(f"sqlite:///{tmp_path / 'traffic.db'}")
+
+    # Crash after the first chunk, with the indexes dropped for the load
+    original = ingest.new_rows
+    calls = []
+    def crash_second_chunk(conn, chunk):
+        calls.append(chunk)
+        if len(calls) == 2:
+            raise RuntimeError("crash")
+        return original(conn, chunk)
+    monkeypatch.setattr(ingest, "new_rows", crash_second_chunk)
+    with pytest.raises(RuntimeError):
+        ingest.bulk_load_csv(str(path), engine, chunk_size=3)
+    monkeypatch.setattr(ingest, "new_rows", original)
+
+    assert ingest.bulk_load_csv(str(path), engine, chunk_size=3)["resumed_from"] == 3
+    with engine.connect() as conn:
+        indexes = {row[0] for row in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'traffic_entry'")}
+    assert {"ix_traffic_block", "ix_traffic_block_group_class", "ix_traffic_group_class_block"} <= indexes
+
+def test_load_hands_pooled_connections_back_unchanged(tmp_path):
+    from sqlalchemy import create_engine, event
+    from database import _set_write_pragmas
+    from ingest import bulk_load_csv
+
+    header = "Index,Datetime,Is Peak,Vehicle Class,Detection Group,CRZ Entries,Excluded Roadway Entries\n"
+    path = tmp_path / "day.csv"
+    path.write_text(header + "".join(f"{i},2025-03-05 08:{i:02d}:00,1,Car,Lincoln Tunnel,1,0\n" for i in range(6)))
+    # One pooled connection, set up like the app's (synchronous=NORMAL)
+    engine = create_engine(f"sqlite:///{tmp_path / 'traffic.db'}", pool_size=1, max_overflow=0)
+    event.listen(engine, "connect", _set_write_pragmas)
+    bulk_load_csv(str(path), engine, chunk_size=3)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA synchronous").scalar() == 1
+    engine.dispose()
+
+def test_export_streams_keyset_pages(client, tmp_path):
+    import csv
+    import io
+    from sqlalchemy import create_engine
+    from bench import generate_congestion_csv
+    from export import iter_row_batches, next_cursor
+    from ingest import bulk_load_csv
+
+    params = "datetime_start=2025-03-05 08:00:00&datetime_end=2025-03-05 09:00:00&vehicle_class=Taxi"
+    full = list(csv.reader(io.StringIO(client.get(f'/export?{params}').data.decode())))
+    assert full[0][:3] == ["id", "datetime", "is_peak"] and len(full) > 10
+    assert all(row[3] == "Taxi" for row in full[1:])
+
+    pages, after = [], ""
+    while True:
+        response = client.get(f'/export?{params}&format=ndjson&limit=7&after={after}')
+        assert response.is_streamed
+        pages.extend(json.loads(line) for line in response.data.decode().splitlines())
+        after = response.headers.get("X-Next-Cursor")
+        if after is None:
+            break
+    assert [str(row["id"]) for row in pages] == [row[0] for row in full[1:]]
+    assert client.get('/export?format=xml').status_code == 400
+
+    # A database without ix_traffic_block (mid-load, or never upgraded) still exports in order
+    generate_congestion_csv(tmp_path / "day.csv", days=1)
+    engine = create_engine(f"sqlite:///{tmp_path / 'day.db'}")
+    bulk_load_csv(str(tmp_path / "day.csv"), engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_traffic_block")
+    with engine.connect() as conn:
+        rows = [row for batch in iter_row_batches(conn, batch_size=100) for row in batch]
+        assert [row[1] for row in rows] == sorted(row[1] for row in rows)
+        assert next_cursor(conn, 10) is not None
+    engine.dispose()
+
+def test_playback_stream_sends_frames_lazily(client, app):
+    from main import compute_frame_arrays, route_registry
+    from models import to_block
+    from playback import RouteTable, stream_events
+
+    def parse_events(body):
+        events = []
+        for chunk in body.decode().strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in chunk.splitlines())
+            events.append((fields["event"], json.loads(fields["data"])))
+        return events
+
+    params = "datetime_start=2025-03-03 00:00:00&interval=1week"
+    response = client.get(f'/playback_stream?{params}&pace=0')
+    assert response.mimetype == "text/event-stream" and response.is_streamed
+    events = parse_events(response.data)
+    assert events[0][0] == "meta" and events[0][1]["frames"] == 30 and events[-1][0] == "end"
+    frames = [data for event, data in events if event == "frame"]
+    assert [frame["index"] for frame in frames] == list(range(30))
+
+    # Frame by frame queries add up to the whole window's arrays
+    with app.app_context():
+        arrays = compute_frame_arrays("1week", to_block("2025-03-03 00:00:00", round_up=True))
+    taxi = list(arrays.classes).index("Taxi")
+    assert [frame["classes"]["Taxi"]["vehicles"] for frame in frames] == \
+        pytest.approx(arrays.vehicles[:, :, taxi].sum(axis=1).tolist())
+
+    # Seeking and reconnecting pick up at the cursor
+    later = parse_events(client.get(f'/playback_stream?{params}&pace=0&cursor=28').data)
+    assert [data["index"] for event, data in later if event == "frame"] == [28, 29]
+    resumed = client.get(f'/playback_stream?{params}&pace=0&cursor=0', headers={"Last-Event-ID": "27"})
+    assert [data for event, data in parse_events(resumed.data) if event == "frame"] == frames[28:]
+    assert client.get(f'/playback_stream?{params}&cursor=31').status_code == 400
+    # Streaming doesn't make the next page load front-load the window
+    with client.session_transaction() as session:
+        assert "frame_id" not in session and "vehicle" not in session
+
+    # Paced: lookahead frames at once, then one per animation step. The
+    # clock advances a little on every read, the sleep must never go negative.
+    now = [0.0]
+    def clock():
+        now[0] += 0.001
+        return now[0]
+    def sleep(seconds):
+        assert seconds > 0
+        now[0] += seconds
+    stream = stream_events(lambda index: (arrays, index), 4, arrays.timestamps, RouteTable(route_registry, []),
+                           [], lookahead=2, sleep=sleep, clock=clock)
+    sent_at = []
+    for _ in stream:
+        sent_at.append(now[0])
+    # meta, frames 0 and 1 at once, frames 2 and 3 one and two steps after the start
+    assert max(sent_at[:3]) < 0.01
+    assert sent_at[3:5] == pytest.approx([22.001, 44.001])
@@ -1,13 +1,20 @@
 from flask import Flask, Blueprint, render_template_string
 import folium
 import json
+import functools
 from folium.plugins import Fullscreen
 
 views_bp = Blueprint('views', __name__)
 
 
 @views_bp.route('/lincoln_tunnel')
-def bridge(): 
+def bridge():
+    # Nothing on this page depends on the request, so render it once
+    return _render_lincoln_tunnel()
+
+
+@functools.lru_cache(maxsize=1)
+def _render_lincoln_tunnel():
     location_coords = {
         "Brooklyn Bridge": [40.7061, -73.9969],
         "West Side Highway at 60th St": [40.7713, -73.9902],